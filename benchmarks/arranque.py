@@ -0,0 +1,114 @@
+"""Benchmark de arranque de main.py: --help y una corrida fetch mínima
+
+Cada medición es un proceso nuevo de Python (el costo de importar es lo que se
+mide). La línea base antepone los imports que main.py hacía al cargar el
+módulo (requests y openpyxl, que arrastra numpy si está instalado), así se ve
+cuánto del arranque se ahorra con los imports diferidos. También se informa
+qué bibliotecas pesadas quedaron cargadas al terminar cada caso.
+
+Uso:
+    python benchmarks/arranque.py
+    python benchmarks/arranque.py --repeticiones 10 --salida arranque.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+
+import servidor_xubio_falso as servidor_falso  # noqa: E402
+
+DIRECTORIO_RESULTADOS = os.path.join(BENCHMARKS, "resultados")
+
+BIBLIOTECAS_PESADAS = ["requests", "openpyxl", "pandas", "numpy", "pyarrow"]
+
+# Imports de nivel de módulo que tenía main.py antes de diferirlos
+IMPORTS_ANTERIORES = "import requests, openpyxl; from openpyxl.utils import get_column_letter\n"
+
+# Corre main.main(argv) contra el servidor falso e imprime las bibliotecas cargadas
+PLANTILLA = """
+import sys, json
+{previo}sys.path.insert(0, {raiz!r})
+sys.argv = ["main.py"] + {argv!r}
+import main
+main.BASE_URL = {url!r}
+main.TOKEN_URL = {url!r} + "/TokenEndpoint"
+main.CLIENT_ID = main.SECRET_ID = "benchmark"
+try:
+    main.main(sys.argv[1:])
+except SystemExit:
+    pass
+print("__CARGADAS__" + json.dumps([m for m in {pesadas!r} if m in sys.modules]))
+"""
+
+CASOS = {
+    "help": ["--help"],
+    "fetch_catalogo": ["-q", "--sin-metricas", "fetch", "--endpoints", "cuentas"],
+}
+
+
+def medir_caso(argv, url, previo, repeticiones):
+    """Mediana de segundos de pared y bibliotecas cargadas en la última repetición"""
+    codigo = PLANTILLA.format(previo=previo, raiz=RAIZ, argv=argv, url=url, pesadas=BIBLIOTECAS_PESADAS)
+    tiempos, cargadas = [], []
+    for _ in range(repeticiones):
+        # Directorio limpio: el fetch crea almacén, diario y archivo crudo donde corre
+        with tempfile.TemporaryDirectory() as directorio:
+            inicio = time.perf_counter()
+            proceso = subprocess.run([sys.executable, "-c", codigo], cwd=directorio,
+                                     capture_output=True, text=True, timeout=120)
+            tiempos.append(time.perf_counter() - inicio)
+        if proceso.returncode != 0:
+            raise RuntimeError(f"{argv} terminó con {proceso.returncode}:\n{proceso.stderr[-2000:]}")
+        for linea in proceso.stdout.splitlines():
+            if linea.startswith("__CARGADAS__"):
+                cargadas = json.loads(linea[len("__CARGADAS__"):])
+    return statistics.median(tiempos), cargadas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de arranque de main.py (--help y fetch)")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--casos", nargs="+", default=list(CASOS), choices=list(CASOS))
+    parser.add_argument("--salida", help="Archivo JSON de resultados")
+    opciones = parser.parse_args()
+
+    _, _, url = servidor_falso.iniciar_servidor({"latencia_ms": 0, "registros_por_mes": 1, "asientos": 1})
+    resultados = []
+    for caso in opciones.casos:
+        diferido, cargadas = medir_caso(CASOS[caso], url, "", opciones.repeticiones)
+        anterior, cargadas_antes = medir_caso(CASOS[caso], url, IMPORTS_ANTERIORES, opciones.repeticiones)
+        resultado = {"benchmark": f"arranque_{caso}", "argv": CASOS[caso],
+                     "segundos": round(diferido, 4), "segundos_imports_anteriores": round(anterior, 4),
+                     "fraccion": round(diferido / anterior, 3), "cargadas": cargadas,
+                     "cargadas_imports_anteriores": cargadas_antes}
+        resultados.append(resultado)
+        print(f"   • {caso:<16} {diferido:>7.3f}s (antes {anterior:.3f}s, {resultado['fraccion']:.0%}) "
+              f"cargadas: {', '.join(cargadas) or 'ninguna'}")
+
+    salida = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "opciones": {k: v for k, v in vars(opciones).items() if k != "salida"},
+        "resultados": resultados,
+    }
+    os.makedirs(DIRECTORIO_RESULTADOS, exist_ok=True)
+    ruta = opciones.salida or os.path.join(
+        DIRECTORIO_RESULTADOS, f"arranque_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(salida, f, indent=2, ensure_ascii=False)
+    print(f"\n💾 Resultados: {ruta}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Benchmarks reproducibles de descarga y exportación contra el servidor Xubio falso
+
+Mide get_data_monthly_chunks_only, el paso de detalle de asientos,
+aplanar_item_final y los exportadores de Excel a varios tamaños, y escribe
+resultados en JSON (más una línea NDJSON por medición en el historial) para
+seguir regresiones corrida a corrida.
+
+Uso:
+    python benchmarks/benchmark.py --tamanos chico mediano
+    python benchmarks/benchmark.py --comparar benchmarks/resultados/bench_20250101_120000.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import main as xubio  # noqa: E402
+import servidor_xubio_falso as servidor_falso  # noqa: E402
+
+DIRECTORIO_RESULTADOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resultados")
+
+# Cada tamaño fija cuántos datos sirve el servidor y cuántos registros se procesan offline
+TAMANOS = {
+    "chico": {"registros_por_mes": 20, "asientos": 100, "registros_offline": 2_000},
+    "mediano": {"registros_por_mes": 200, "asientos": 500, "registros_offline": 20_000},
+    "grande": {"registros_por_mes": 1_000, "asientos": 2_000, "registros_offline": 100_000},
+}
+
+
+def reiniciar_estado_global(rps, max_workers):
+    """Deja main.py como recién importado: sin singletons, almacén local ni archivo crudo"""
+    xubio._LIMITADOR_GLOBAL = None
+    xubio._CONTROL_GLOBAL = None
+    xubio._SEMAFORO_EN_VUELO = None
+    xubio._SESION_HTTP = None
+    xubio._ALMACEN = None
+    xubio._REGISTRO_ESQUEMAS = None
+    xubio._DIARIO = None
+    xubio._ARCHIVO = None
+    xubio.CONFIG_ALMACEN["HABILITADO"] = False
+    xubio.CONFIG_ARCHIVO["HABILITADO"] = False
+    xubio.CONFIG_CONCURRENCIA["REQUESTS_POR_SEGUNDO"] = rps
+    xubio.CONFIG_CONCURRENCIA["RAFAGA"] = max(1, int(rps))
+    xubio.CONFIG_CONCURRENCIA["TASA_MAXIMA"] = max(rps, xubio.CONFIG_CONCURRENCIA["TASA_MAXIMA"])
+    xubio.CONFIG_CONCURRENCIA["MAX_WORKERS"] = max_workers
+    xubio.CONFIG_CONCURRENCIA["MAX_WORKERS_DETALLE"] = max_workers * 2
+
+
+@contextlib.contextmanager
+def silenciar(activo=True):
+    if not activo:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def medir(funcion):
+    inicio = time.perf_counter()
+    resultado = funcion()
+    return resultado, time.perf_counter() - inicio
+
+
+def _resultado(benchmark, tamano, segundos, registros, extra=None):
+    fila = {
+        "benchmark": benchmark,
+        "tamano": tamano,
+        "segundos": round(segundos, 4),
+        "registros": registros,
+        "registros_por_segundo": round(registros / segundos, 1) if segundos > 0 else None,
+    }
+    fila.update(extra or {})
+    return fila
+
+
+def bench_descarga_ventanas(tamano, parametros, opciones):
+    _, estado, url_base = servidor_falso.iniciar_servidor({
+        "registros_por_mes": parametros["registros_por_mes"],
+        "latencia_ms": opciones.latencia_ms,
+        "limite_rps": opciones.limite_rps,
+    })
+    xubio.BASE_URL = url_base
+    reiniciar_estado_global(opciones.rps, opciones.workers)
+    fecha_desde = (date.today().replace(day=1) - timedelta(days=30 * opciones.meses)).replace(day=1)
+    with silenciar(not opciones.verbose):
+        datos, segundos = medir(lambda: xubio.get_data_monthly_chunks_only(
+            "token-bench", "factura_venta", "comprobanteVentaBean", fecha_desde.isoformat()))
+    return _resultado("descarga_ventanas", tamano, segundos, len(datos), estado.resumen())
+
+
+def bench_detalle_asientos(tamano, parametros, opciones):
+    _, estado, url_base = servidor_falso.iniciar_servidor({
+        "asientos": parametros["asientos"],
+        "latencia_ms": opciones.latencia_ms,
+        "limite_rps": opciones.limite_rps,
+    })
+    xubio.BASE_URL = url_base
+    reiniciar_estado_global(opciones.rps, opciones.workers)
+    with silenciar(not opciones.verbose):
+        datos, segundos = medir(lambda: xubio.get_asientos_contables_con_detalle_mejorado(
+            "token-bench", "asiento_contable", "asientoContableManualBean"))
+    con_detalle = sum(1 for d in datos if "items" in d)
+    return _resultado("detalle_asientos", tamano, segundos, len(datos),
+                      {**estado.resumen(), "con_detalle": con_detalle})
+
+
+def _registros_offline(cantidad):
+    """Comprobantes generados localmente (mismo formato que sirve el servidor)"""
+    config = dict(servidor_falso.CONFIG_DEFECTO)
+    registros = []
+    dia = date(2024, 1, 1)
+    while len(registros) < cantidad:
+        for k in range(10):
+            registros.append(servidor_falso._comprobante(config, "comprobanteVentaBean", dia, k))
+        dia += timedelta(days=1)
+    return registros[:cantidad]
+
+
+def bench_aplanar(tamano, parametros, opciones, registros):
+    _, segundos = medir(lambda: [xubio.aplanar_item_final(r) for r in registros])
+    return _resultado("aplanar_item_final", tamano, segundos, len(registros))
+
+
+def bench_aplanar_esquema(tamano, parametros, opciones, registros):
+    """Inferencia + compilación del esquema y extracción de todas las filas"""
+    def aplanar():
+        esquema = xubio.EsquemaCompilado.desde_registros("factura_venta", registros)
+        for _ in esquema.filas(registros):
+            pass
+    _, segundos = medir(aplanar)
+    return _resultado("aplanar_esquema", tamano, segundos, len(registros))
+
+
+def bench_exportar_excel(tamano, parametros, opciones, registros, streaming):
+    exportador = xubio.exportar_a_excel_streaming if streaming else xubio.exportar_a_excel_simple
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, "bench.xlsx")
+        with silenciar(not opciones.verbose):
+            _, segundos = medir(lambda: exportador({"factura_venta": registros}, ruta))
+        tamano_archivo = os.path.getsize(ruta)
+    nombre = "exportar_excel_streaming" if streaming else "exportar_excel_simple"
+    return _resultado(nombre, tamano, segundos, len(registros), {"bytes_archivo": tamano_archivo})
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def comparar(actual, archivo_base):
+    """Imprime la variación de tiempo contra una corrida anterior"""
+    with open(archivo_base, encoding="utf-8") as f:
+        base = {(r["benchmark"], r["tamano"]): r for r in json.load(f)["resultados"]}
+    print(f"\n📈 Comparación contra {archivo_base}:")
+    for r in actual["resultados"]:
+        previo = base.get((r["benchmark"], r["tamano"]))
+        if not previo or not previo["segundos"]:
+            continue
+        delta = (r["segundos"] - previo["segundos"]) / previo["segundos"] * 100
+        marca = "🔴" if delta > 10 else "🟢" if delta < -10 else "⚪"
+        print(f"   {marca} {r['benchmark']:<26} {r['tamano']:<8} "
+              f"{previo['segundos']:>8.3f}s → {r['segundos']:>8.3f}s ({delta:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de main.py contra el servidor Xubio falso")
+    parser.add_argument("--tamanos", nargs="+", default=["chico", "mediano"], choices=list(TAMANOS))
+    parser.add_argument("--benchmarks", nargs="+",
+                        default=["descarga_ventanas", "detalle_asientos", "aplanar", "excel"],
+                        choices=["descarga_ventanas", "detalle_asientos", "aplanar", "excel"])
+    parser.add_argument("--meses", type=int, default=12, help="Meses de historial para la descarga por ventanas")
+    parser.add_argument("--latencia-ms", type=int, default=20)
+    parser.add_argument("--limite-rps", type=int, default=0, help="429 del servidor a partir de estos req/s")
+    parser.add_argument("--rps", type=float, default=50.0, help="Tasa del limitador del cliente")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--salida", help="Archivo JSON de resultados")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para ver regresiones")
+    parser.add_argument("--verbose", action="store_true", help="No silenciar la salida de main.py")
+    opciones = parser.parse_args()
+
+    resultados = []
+    for tamano in opciones.tamanos:
+        parametros = TAMANOS[tamano]
+        print(f"⏱️ Tamaño {tamano}: {parametros}")
+        registros = None
+        if {"aplanar", "excel"} & set(opciones.benchmarks):
+            registros = _registros_offline(parametros["registros_offline"])
+
+        pasos = []
+        if "descarga_ventanas" in opciones.benchmarks:
+            pasos.append(lambda: bench_descarga_ventanas(tamano, parametros, opciones))
+        if "detalle_asientos" in opciones.benchmarks:
+            pasos.append(lambda: bench_detalle_asientos(tamano, parametros, opciones))
+        if "aplanar" in opciones.benchmarks:
+            pasos.append(lambda: bench_aplanar(tamano, parametros, opciones, registros))
+            pasos.append(lambda: bench_aplanar_esquema(tamano, parametros, opciones, registros))
+        if "excel" in opciones.benchmarks:
+            pasos.append(lambda: bench_exportar_excel(tamano, parametros, opciones, registros, False))
+            pasos.append(lambda: bench_exportar_excel(tamano, parametros, opciones, registros, True))
+
+        for paso in pasos:
+            resultado = paso()
+            resultados.append(resultado)
+            print(f"   • {resultado['benchmark']:<26} {resultado['segundos']:>8.3f}s "
+                  f"({resultado['registros_por_segundo']} reg/s)")
+
+    salida = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit_actual(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "opciones": {k: v for k, v in vars(opciones).items() if k not in ("salida", "comparar")},
+        "resultados": resultados,
+    }
+
+    os.makedirs(DIRECTORIO_RESULTADOS, exist_ok=True)
+    ruta = opciones.salida or os.path.join(
+        DIRECTORIO_RESULTADOS, f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(salida, f, indent=2, ensure_ascii=False)
+    with open(os.path.join(DIRECTORIO_RESULTADOS, "historial.ndjson"), "a", encoding="utf-8") as f:
+        for resultado in resultados:
+            f.write(json.dumps({"fecha": salida["fecha"], "commit": salida["commit"], **resultado},
+                               ensure_ascii=False) + "\n")
+    print(f"\n💾 Resultados: {ruta}")
+
+    if opciones.comparar:
+        comparar(salida, opciones.comparar)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+"""Servidor HTTP local que imita la API de Xubio para pruebas y benchmarks
+
+Emula TokenEndpoint, los endpoints con filtro de fechas, los catálogos y
+asientoContableManualBean/{id}. Latencia, tamaño de payload, límite de
+requests (429), timeouts, errores 500 y cantidad de registros son
+configurables. Los datos son deterministas (misma semilla → mismos datos).
+
+Uso standalone:
+    python benchmarks/servidor_xubio_falso.py --puerto 8080 --latencia-ms 50
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from datetime import date, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+CONFIG_DEFECTO = {
+    "latencia_ms": 20,          # Latencia base de cada respuesta
+    "jitter_ms": 10,            # Variación aleatoria sumada a la latencia
+    "registros_por_mes": 60,    # Endpoints con fechas
+    "registros_catalogo": 300,  # Catálogos sin fechas
+    "asientos": 200,            # Cabeceras de asientos
+    "bytes_extra": 200,         # Relleno por registro para simular payloads grandes
+    "limite_rps": 0,            # Requests/segundo antes de responder 429 (0 = sin límite)
+    "prob_timeout": 0.0,        # Probabilidad de colgarse `demora_timeout_s` segundos
+    "demora_timeout_s": 5.0,
+    "prob_error_500": 0.0,
+    "expires_in": 3600,         # Vigencia de los tokens emitidos
+    "validar_tokens": False,    # 401 ante tokens desconocidos o vencidos
+    "etag_catalogos": False,    # Catálogos con ETag y 304 ante If-None-Match
+    "semilla": 42,
+}
+
+ENDPOINTS_CON_FECHAS = {"comprobanteVentaBean", "comprobanteCompraBean", "cobranzaBean", "retencionBean"}
+CATALOGOS = {"clienteBean", "cuenta", "categoriaCuenta", "pagoBean"}
+ASIENTOS = "asientoContableManualBean"
+
+
+class EstadoServidor:
+    """Contadores y control de tasa compartidos por los hilos del servidor"""
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.respuestas_429 = 0
+        self.timeouts = 0
+        self.errores_500 = 0
+        self.respuestas_304 = 0
+        self.bytes_enviados = 0
+        self.tokens_emitidos = 0
+        self.respuestas_401 = 0
+        self._vencimientos = {}   # token emitido -> time.monotonic() de vencimiento
+        self._ventana_inicio = time.monotonic()
+        self._ventana_requests = 0
+
+    def admitir(self):
+        """False si la request supera limite_rps en la ventana de 1 segundo actual"""
+        limite = self.config["limite_rps"]
+        with self.lock:
+            self.requests += 1
+            if not limite:
+                return True
+            ahora = time.monotonic()
+            if ahora - self._ventana_inicio >= 1.0:
+                self._ventana_inicio = ahora
+                self._ventana_requests = 0
+            self._ventana_requests += 1
+            if self._ventana_requests > limite:
+                self.respuestas_429 += 1
+                return False
+            return True
+
+    def emitir_token(self):
+        with self.lock:
+            self.tokens_emitidos += 1
+            token = f"token-{self.tokens_emitidos}"
+            self._vencimientos[token] = time.monotonic() + self.config["expires_in"]
+            return token
+
+    def token_valido(self, autorizacion):
+        if not autorizacion.startswith("Bearer "):
+            return False
+        if not self.config["validar_tokens"]:
+            return True
+        with self.lock:
+            vence = self._vencimientos.get(autorizacion[len("Bearer "):])
+            if vence is not None and time.monotonic() < vence:
+                return True
+            self.respuestas_401 += 1
+            return False
+
+    def resumen(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "respuestas_429": self.respuestas_429,
+                "timeouts": self.timeouts,
+                "errores_500": self.errores_500,
+                "respuestas_304": self.respuestas_304,
+                "bytes_enviados": self.bytes_enviados,
+                "tokens_emitidos": self.tokens_emitidos,
+                "respuestas_401": self.respuestas_401,
+            }
+
+
+# --- Generación determinista de datos -------------------------------------
+
+def _rng(config, *partes):
+    return random.Random(f"{config['semilla']}:" + ":".join(str(p) for p in partes))
+
+
+def _relleno(config, rng):
+    n = config["bytes_extra"]
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(n)) if n else ""
+
+
+def _registros_del_dia(config, dia):
+    """Cantidad de registros de un día, repartiendo registros_por_mes en el mes"""
+    base = config["registros_por_mes"] / 30.0
+    rng = _rng(config, "dia", dia.isoformat())
+    return int(base) + (1 if rng.random() < base - int(base) else 0)
+
+
+def _id_comprobante(dia, k):
+    return int(dia.strftime("%Y%m%d")) * 1000 + k
+
+
+def _importe_comprobante(config, id_comprobante):
+    return round(_rng(config, "importe", id_comprobante).uniform(1000, 250000), 2)
+
+
+def _entidad(config, tipo, numero):
+    return {"ID": numero, "nombre": f"{tipo.title()} {numero}", "codigo": f"{tipo[:3].upper()}{numero:05d}"}
+
+
+def _comprobante(config, endpoint, dia, k):
+    rng = _rng(config, endpoint, dia.isoformat(), k)
+    id_comprobante = _id_comprobante(dia, k)
+    total = _importe_comprobante(config, id_comprobante)
+    gravado = round(total / 1.21, 2)
+    contraparte = "proveedor" if endpoint == "comprobanteCompraBean" else "cliente"
+    items = []
+    for n in range(rng.randint(1, 4)):
+        items.append({
+            "producto": _entidad(config, "producto", rng.randint(1, 80)),
+            "cantidad": rng.randint(1, 10),
+            "precio": round(gravado / (n + 1), 2),
+            "importe": round(gravado / (n + 1), 2),
+        })
+    return {
+        "transaccionid": id_comprobante,
+        "tipo": "Factura",
+        "numeroDocumento": f"A-0001-{id_comprobante % 100000000:08d}",
+        "fecha": dia.isoformat(),
+        "fechaVto": (dia + timedelta(days=30)).isoformat(),
+        contraparte: _entidad(config, contraparte, rng.randint(1, config["registros_catalogo"])),
+        "moneda": {"ID": 1, "nombre": "Pesos Argentinos", "codigo": "ARS"},
+        "importeGravado": gravado,
+        "importeImpuestos": round(total - gravado, 2),
+        "importetotal": total,
+        "transaccionProductoItems": items,
+        "descripcion": _relleno(config, rng),
+    }
+
+
+def _cobro_o_pago(config, endpoint, dia, k):
+    """Cobro/pago que cancela (total o parcialmente) comprobantes de 15 días antes"""
+    rng = _rng(config, endpoint, dia.isoformat(), k)
+    origen = dia - timedelta(days=15)
+    aplicados = []
+    for _ in range(rng.randint(1, 2)):
+        k_origen = rng.randrange(max(1, _registros_del_dia(config, origen)))
+        id_comprobante = _id_comprobante(origen, k_origen)
+        total = _importe_comprobante(config, id_comprobante)
+        importe = total if rng.random() < 0.7 else round(total * rng.uniform(0.2, 0.9), 2)
+        aplicados.append({"comprobante": {"ID": id_comprobante}, "importe": importe})
+    detalle = "detalleCobranzas" if endpoint == "cobranzaBean" else "detallePagos"
+    contraparte = "cliente" if endpoint == "cobranzaBean" else "proveedor"
+    return {
+        "transaccionid": _id_comprobante(dia, 500 + k),
+        "numeroDocumento": f"R-0001-{k:08d}",
+        "fecha": dia.isoformat(),
+        contraparte: _entidad(config, contraparte, rng.randint(1, config["registros_catalogo"])),
+        "importeTotal": round(sum(a["importe"] for a in aplicados), 2),
+        detalle: aplicados,
+        "descripcion": _relleno(config, rng),
+    }
+
+
+def _retencion(config, dia, k):
+    rng = _rng(config, "retencion", dia.isoformat(), k)
+    return {
+        "transaccionid": _id_comprobante(dia, 800 + k),
+        "fecha": dia.isoformat(),
+        "tipo": rng.choice(["IIBB", "Ganancias", "IVA"]),
+        "importe": round(rng.uniform(100, 5000), 2),
+        "descripcion": _relleno(config, rng),
+    }
+
+
+def generar_ventana(config, endpoint, desde, hasta):
+    registros = []
+    dia = desde
+    while dia <= hasta:
+        for k in range(_registros_del_dia(config, dia)):
+            if endpoint in ("comprobanteVentaBean", "comprobanteCompraBean"):
+                registros.append(_comprobante(config, endpoint, dia, k))
+            elif endpoint == "retencionBean":
+                registros.append(_retencion(config, dia, k))
+            else:
+                registros.append(_cobro_o_pago(config, endpoint, dia, k))
+        dia += timedelta(days=1)
+    return registros
+
+
+def generar_catalogo(config, endpoint):
+    n = config["registros_catalogo"]
+    if endpoint == "pagoBean":
+        hoy = date.today()
+        return [_cobro_o_pago(config, endpoint, hoy - timedelta(days=i % 365), i) for i in range(n)]
+    if endpoint == "cuenta":
+        return [{"ID": i, "codigo": f"{1 + i % 5}.{i:04d}", "nombre": f"Cuenta {i}",
+                 "tipo": ["Activo", "Pasivo", "Patrimonio", "Ingreso", "Egreso"][i % 5]} for i in range(1, n + 1)]
+    if endpoint == "categoriaCuenta":
+        return [{"ID": i, "nombre": f"Categoría {i}"} for i in range(1, min(n, 20) + 1)]
+    return [{"cliente_id": i, "nombre": f"Cliente {i}", "cuit": f"30-{i:08d}-1",
+             "email": f"cliente{i}@ejemplo.com"} for i in range(1, n + 1)]
+
+
+def generar_cabecera_asiento(config, i):
+    dia = date.today() - timedelta(days=i % 600)
+    return {"transaccionId": i, "numeroAsiento": i, "fecha": dia.isoformat(),
+            "descripcion": f"Asiento {i}"}
+
+
+def generar_detalle_asiento(config, i):
+    rng = _rng(config, "asiento", i)
+    cabecera = generar_cabecera_asiento(config, i)
+    importe = round(rng.uniform(100, 100000), 2)
+    cuentas = rng.sample(range(1, 60), 2)
+    cabecera["items"] = [
+        {"cuenta": _entidad(config, "cuenta", cuentas[0]), "debe": importe, "haber": 0},
+        {"cuenta": _entidad(config, "cuenta", cuentas[1]), "debe": 0, "haber": importe},
+    ]
+    cabecera["observaciones"] = _relleno(config, rng)
+    return cabecera
+
+
+# --- HTTP -------------------------------------------------------------------
+
+class ManejadorXubio(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    estado = None   # Se asigna por servidor en iniciar_servidor
+
+    def log_message(self, *args):
+        pass
+
+    def _enviar(self, codigo, cuerpo, extra_headers=None):
+        datos = json.dumps(cuerpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(datos)))
+        for clave, valor in (extra_headers or {}).items():
+            self.send_header(clave, valor)
+        self.end_headers()
+        try:
+            self.wfile.write(datos)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        with self.estado.lock:
+            self.estado.bytes_enviados += len(datos)
+
+    def _sin_cambios(self, etag):
+        self.send_response(304)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        with self.estado.lock:
+            self.estado.respuestas_304 += 1
+
+    def _simular_red(self):
+        """Aplica latencia, timeouts, 500 y 429. Devuelve False si ya respondió"""
+        config = self.estado.config
+        if not self.estado.admitir():
+            self._enviar(429, {"error": "rate limit"}, {"Retry-After": "1"})
+            return False
+        demora = (config["latencia_ms"] + random.uniform(0, config["jitter_ms"])) / 1000.0
+        if config["prob_timeout"] and random.random() < config["prob_timeout"]:
+            with self.estado.lock:
+                self.estado.timeouts += 1
+            demora = config["demora_timeout_s"]
+        time.sleep(demora)
+        if config["prob_error_500"] and random.random() < config["prob_error_500"]:
+            with self.estado.lock:
+                self.estado.errores_500 += 1
+            self._enviar(500, {"error": "interno"})
+            return False
+        return True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not urlparse(self.path).path.endswith("/TokenEndpoint"):
+            return self._enviar(404, {"error": "no encontrado"})
+        if not self._simular_red():
+            return
+        self._enviar(200, {"access_token": self.estado.emitir_token(), "token_type": "bearer",
+                           "expires_in": self.estado.config["expires_in"]})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        partes = [p for p in url.path.split("/") if p]
+        if not self.estado.token_valido(self.headers.get("Authorization", "")):
+            return self._enviar(401, {"error": "token inválido o vencido"})
+        if not self._simular_red():
+            return
+        config = self.estado.config
+        query = parse_qs(url.query)
+
+        if len(partes) >= 2 and partes[-2] == ASIENTOS and partes[-1].isdigit():
+            numero = int(partes[-1])
+            if not 1 <= numero <= config["asientos"]:
+                return self._enviar(404, {"error": "no encontrado"})
+            return self._enviar(200, generar_detalle_asiento(config, numero))
+
+        recurso = partes[-1] if partes else ""
+        if recurso in ENDPOINTS_CON_FECHAS:
+            try:
+                desde = date.fromisoformat(query["fechaDesde"][0])
+                hasta = date.fromisoformat(query["fechaHasta"][0])
+            except (KeyError, ValueError):
+                return self._enviar(400, {"error": "fechaDesde/fechaHasta requeridos"})
+            return self._enviar(200, generar_ventana(config, recurso, desde, hasta))
+        if recurso in CATALOGOS:
+            catalogo = generar_catalogo(config, recurso)
+            if not config["etag_catalogos"]:
+                return self._enviar(200, catalogo)
+            etag = '"%s"' % hashlib.sha1(json.dumps(catalogo).encode("utf-8")).hexdigest()
+            if self.headers.get("If-None-Match") == etag:
+                return self._sin_cambios(etag)
+            return self._enviar(200, catalogo, {"ETag": etag})
+        if recurso == ASIENTOS:
+            return self._enviar(200, [generar_cabecera_asiento(config, i)
+                                      for i in range(1, config["asientos"] + 1)])
+        self._enviar(404, {"error": "no encontrado"})
+
+
+def iniciar_servidor(config=None, puerto=0):
+    """Levanta el servidor en un hilo. Devuelve (servidor, estado, url_base)"""
+    config = {**CONFIG_DEFECTO, **(config or {})}
+    estado = EstadoServidor(config)
+    manejador = type("ManejadorConfigurado", (ManejadorXubio,), {"estado": estado})
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    url_base = f"http://127.0.0.1:{servidor.server_address[1]}/API/1.1"
+    return servidor, estado, url_base
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor falso de la API de Xubio")
+    parser.add_argument("--puerto", type=int, default=8080)
+    for clave, valor in CONFIG_DEFECTO.items():
+        if isinstance(valor, bool):
+            parser.add_argument(f"--{clave.replace('_', '-')}", action="store_true", default=valor)
+        else:
+            parser.add_argument(f"--{clave.replace('_', '-')}", type=type(valor), default=valor)
+    args = parser.parse_args()
+    config = {clave: getattr(args, clave) for clave in CONFIG_DEFECTO}
+    servidor, estado, url_base = iniciar_servidor(config, args.puerto)
+    print(f"🧪 Servidor Xubio falso escuchando en {url_base}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servidor.shutdown()
+        print(f"📊 {estado.resumen()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,31 @@
-import requests
 import os
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
-from requests.auth import HTTPBasicAuth
-import openpyxl
 import json
+import marshal
+import mmap
+import struct
+import tempfile
+import csv
+import math
+import codecs
 import time
+import random
+import sqlite3
+import zlib
+import hashlib
+import argparse
+import threading
+import multiprocessing
+import cProfile
+import pstats
+from contextlib import ExitStack, contextmanager, nullcontext
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from collections import deque
+from array import array
+from bisect import bisect_right
+from operator import itemgetter
 
 # Cargar credenciales
 load_dotenv()
@@ -29,44 +49,1545 @@ ENDPOINTS_FUNCIONALES = {
     "categorias_cuentas": "categoriaCuenta"  
 }
 
+# Clasificar endpoints por método
+ENDPOINTS_CON_FECHAS = ['factura_compra', 'factura_venta', 'cobros', 'retenciones']
+ENDPOINTS_SIN_FECHAS = ['clientes', 'cuentas', 'categorias_cuentas', 'pagos']
+ENDPOINTS_ESPECIALES = ['asiento_contable']
 
 CONFIG_FECHAS = {
     "FECHA_DESDE": "2024-01-01",  
     "FECHA_HASTA": None,  
 }
 
-def get_token():
-    """Genera y devuelve un access_token válido"""
-    print("🔑 Generando token de acceso...")
+CONFIG_CONCURRENCIA = {
+    "HABILITADO": True,
+    "MAX_WORKERS": 4,              # Ventanas descargadas en paralelo
+    "REQUESTS_POR_SEGUNDO": 4.0,   # Tasa sostenida del token bucket
+    "RAFAGA": 4,                   # Capacidad del bucket (ráfaga máxima)
+    "MAX_WORKERS_DETALLE": 8,      # Detalles de asientos en paralelo
+    "TASA_MINIMA": 0.5,            # Piso del throttling adaptativo (req/s)
+    "TASA_MAXIMA": 12.0,           # Techo del throttling adaptativo (req/s)
+    "MAX_ENDPOINTS_PARALELO": 4,   # Endpoints descargados a la vez por el orquestador
+    "MAX_EN_VUELO": 8,             # Requests simultáneos en total (todos los endpoints)
+}
+
+CONFIG_ALMACEN = {
+    "HABILITADO": True,
+    "RUTA": "xubio_cache.sqlite",
+    "MESES_LOOKBACK": 2,       # Meses cerrados recientes que se vuelven a descargar
+    "FULL_REFRESH": False,     # --full-refresh: ignora lo guardado y descarga todo
+    "DETALLE_MAX_ENTRADAS": 100000,   # Caché de detalles de asientos: tope de entradas
+    "DETALLE_MAX_DIAS": 120,          # ... y antigüedad máxima
+    "CATALOGOS_CONDICIONALES": True,  # ETag/Last-Modified o huella: catálogos sin cambios no se reescriben
+}
+
+CONFIG_DIARIO = {
+    "HABILITADO": True,        # Cada ventana, catálogo y bloque de detalle terminado queda en disco
+    "RUTA": "xubio_diario.sqlite",
+    "CONSERVAR_COMPLETAS": False,  # Al terminar bien se borran las unidades de la corrida
+}
+
+CONFIG_ARCHIVO = {
+    "HABILITADO": True,        # Guarda las respuestas crudas (NDJSON comprimido) de cada descarga completa
+    "DIRECTORIO": "xubio_archivo",
+    "NIVEL_COMPRESION": 6,
+    "OFFLINE": False,          # --offline: exporta solo desde el archivo, sin requests
+    "DESDE": None,             # --desde/--hasta offline: ventanas (y registros) fuera del rango se omiten
+    "HASTA": None,
+}
+
+CONFIG_EXPORTACION = {
+    "EXCEL_STREAMING": True,   # Workbook write-only (memoria plana); False = modo clásico
+    "ANCHO_MAXIMO": 50,
+    "FORMATOS": ["excel"],     # --formato: excel, parquet, csv, feather
+}
+
+CONFIG_PIPELINE = {
+    "HABILITADO": True,        # Descarga → aplanado → estadísticas → escritura sin retener registros
+    "VENTANAS_ANTICIPADAS": 2, # Ventanas en curso por worker: acota la memoria de la descarga
+    "BLOQUE_DETALLE": 500,     # Asientos cuyo detalle se resuelve (y libera) por bloque
+}
+
+CONFIG_VENTANAS = {
+    "ADAPTATIVO": True,        # Dividir/fusionar ventanas según el historial
+    "UMBRAL_DIVISION": 2000,   # Registros por ventana a partir de los cuales se divide
+    "UMBRAL_FUSION": 50,       # Meses consecutivos con menos registros se piden juntos
+    "MAX_MESES_FUSION": 6,
+}
+
+CONFIG_STREAMING = {
+    "JSON_INCREMENTAL": True,  # Parsear arrays grandes elemento por elemento
+    "TAM_BLOQUE": 64 * 1024,   # Bytes leídos por iteración del stream
+}
+
+CONFIG_ESQUEMA = {
+    "HABILITADO": True,        # Columnas con punto (cliente.ID) y tablas hijas; False = aplanado clásico
+    "MUESTRA": 500,            # Registros (repartidos en todo el endpoint) para inferir el esquema
+    "PROFUNDIDAD_MAXIMA": 3,   # Objetos más profundos quedan como JSON en una columna
+    # Arrays de objetos que se exportan como tabla hija: campo → sufijo de la tabla
+    "TABLAS_HIJAS": {
+        "transaccionProductoItems": "items",
+        "items": "items",
+        "detalleCobranzas": "detalle",
+        "detallePagos": "detalle",
+    },
+    # Campo que vincula cada fila hija con su registro padre (el primero presente)
+    "CAMPOS_CLAVE": ["transaccionid", "transaccionId", "ID", "id"],
+}
+
+CONFIG_DEDUP = {
+    "HABILITADO": True,        # Un registro por clave primaria: el más completo (detalle sobre cabecera)
+    "CAMPOS_CLAVE": ["transaccionid", "transaccionId", "ID", "id"],  # Candidatos, en orden de preferencia
+    "CLAVES_POR_ENDPOINT": {},  # Fuerza la clave de un endpoint, ej: {"clientes": "cliente_id"}
+    "UNICIDAD_MINIMA": 0.9,     # Proporción de valores distintos en la muestra para aceptar un campo
+}
+
+CONFIG_ANALITICA = {
+    "HABILITADO": True,        # Hojas de análisis (mensual, clientes, cuentas) con pandas junto a las salidas
+    "TOP_CLIENTES": 25,
+    "TOLERANCIA": 0.01,        # Conciliación: diferencia de importe que se considera cancelada
+    # Columnas aplanadas candidatas para cada dato, en orden de preferencia
+    "CAMPOS": {
+        "id": ["transaccionid", "transaccionId", "ID", "id"],
+        "numero": ["numeroDocumento", "numeroComprobante", "numero"],
+        "fecha": ["fecha", "fechaComprobante", "fechaEmision"],
+        "fecha_vto": ["fechaVto", "fechaVencimiento"],
+        "importe": ["importetotal", "importeTotal", "total", "importe", "monto"],
+        "cliente": ["cliente.ID", "cliente.id", "clienteId", "cliente_id"],
+        "cliente_nombre": ["cliente.nombre", "cliente.razonSocial", "clienteNombre"],
+        "proveedor": ["proveedor.ID", "proveedor.id", "proveedorId", "proveedor_id"],
+        "proveedor_nombre": ["proveedor.nombre", "proveedor.razonSocial", "proveedorNombre"],
+        # Líneas de cobros/pagos (detalleCobranzas/detallePagos): comprobante cancelado e importe aplicado
+        "padre": ["padre.transaccionid", "padre.transaccionId", "padre.ID", "padre.id"],
+        "comprobante": ["comprobante.ID", "comprobante.id", "comprobanteId", "idComprobante"],
+        "aplicado": ["importe", "importeAplicado", "monto"],
+        "cuenta": ["cuenta.ID", "cuenta.id", "cuentaId", "cuenta_id"],
+        "cuenta_codigo": ["cuenta.codigo", "cuentaCodigo"],
+        "cuenta_nombre": ["cuenta.nombre", "cuentaNombre"],
+        "debe": ["debe", "importeDebe"],
+        "haber": ["haber", "importeHaber"],
+    },
+}
+
+# Modo lote (--lote): una empresa por proceso. Credenciales en .env:
+#   XUBIO_PERFILES=empresa_a,empresa_b
+#   CLIENT_ID_EMPRESA_A=...   CLIENT_SECRET_EMPRESA_A=...
+CONFIG_LOTE = {
+    "MAX_PROCESOS": None,      # None: una por núcleo (tope: cantidad de perfiles)
+    "DIRECTORIO": "xubio_lote", # Cada empresa escribe en DIRECTORIO/<perfil>/ (salidas, caché, diario)
+}
+
+CONFIG_TOKEN = {
+    "MARGEN_RENOVACION": 60,   # Segundos antes del vencimiento en que se renueva
+    "CACHE_EN_DISCO": False,   # --cache-token: reutiliza el token entre corridas
+    "RUTA_CACHE": ".xubio_token.json",
+}
+
+# Timeouts (conexión, lectura) por tipo de petición
+POLITICAS_TIMEOUT = {
+    "token": (10, 30),
+    "ventana": (10, 90),       # Chunks mensuales
+    "catalogo": (10, 180),     # Catálogos sin fechas
+    "cabeceras": (10, 120),    # Listado de asientos
+    "detalle": (5, 30),        # Detalle de un asiento
+    "debug": (10, 30),
+}
+
+# Overrides opcionales por endpoint, ej: {"clientes": (10, 300)}
+TIMEOUTS_POR_ENDPOINT = {}
+
+CONFIG_REINTENTOS = {
+    "MAX_REINTENTOS": 4,
+    "BACKOFF_BASE": 0.5,       # Segundos; se duplica en cada intento
+    "BACKOFF_MAXIMO": 30.0,
+    "STATUS_REINTENTABLES": (429, 500, 502, 503, 504),
+}
+
+CONFIG_METRICAS = {
+    "HABILITADO": True,        # Escribe xubio_metricas_{timestamp}.ndjson/.json por corrida
+    "DIRECTORIO": "metricas",
+    "VERBOSIDAD": 1,           # 0: errores, 1: normal, 2: detalle, 3: cada request HTTP
+    "PERFILAR": False,         # --perfilar: cProfile sobre la exportación
+    "PERFIL_TOP": 30,          # Funciones listadas en el reporte del perfil
+}
+
+# Niveles de la consola
+NIVEL_ERROR = 0
+NIVEL_NORMAL = 1
+NIVEL_DETALLE = 2
+NIVEL_TRAZA = 3
+
+_CONSOLA_LOCK = threading.Lock()
+_PREFIJO_CONSOLA = ""
+
+def emitir(mensaje="", nivel=NIVEL_NORMAL):
+    """Imprime una línea si la verbosidad lo permite; el lock evita líneas mezcladas entre hilos"""
+    if nivel <= CONFIG_METRICAS["VERBOSIDAD"]:
+        if _PREFIJO_CONSOLA:
+            # Modo lote: cada proceso marca sus líneas con el perfil
+            mensaje = "\n".join(_PREFIJO_CONSOLA + linea if linea else linea for linea in str(mensaje).split("\n"))
+        with _CONSOLA_LOCK:
+            print(mensaje)
+
+def _percentil(valores_ordenados, p):
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    if not valores_ordenados:
+        return None
+    indice = max(0, math.ceil(p / 100 * len(valores_ordenados)) - 1)
+    return valores_ordenados[indice]
+
+class RegistroMetricas:
+    """Eventos de la corrida: cada request HTTP y la duración de cada etapa
+
+    Los eventos se guardan en memoria y al final se vuelcan a NDJSON (uno por
+    línea) junto con un resumen JSON con percentiles de latencia por endpoint y
+    el tiempo por etapa. La consola muestra los mismos eventos según VERBOSIDAD.
+    """
+
+    def __init__(self):
+        self.eventos = []
+        self.inicio = time.time()
+        self._inicio_monotonic = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _agregar(self, evento):
+        evento["t"] = round(time.monotonic() - self._inicio_monotonic, 4)
+        with self._lock:
+            self.eventos.append(evento)
+
+    def registrar_http(self, metodo, url, endpoint, contexto, status, latencia, duracion,
+                       bytes_respuesta, reintentos, error=None):
+        self._agregar({
+            "tipo": "http",
+            "metodo": metodo,
+            "url": url,
+            "endpoint": endpoint,
+            "contexto": contexto,
+            "status": status,
+            "latencia": round(latencia, 4),
+            "duracion": round(duracion, 4),
+            "bytes": bytes_respuesta,
+            "reintentos": reintentos,
+            "error": error,
+        })
+        estado = status if status is not None else error
+        emitir(f"      🌐 {metodo} {endpoint or url} {contexto or ''} → {estado} "
+               f"{latencia * 1000:.0f}ms{f' ({reintentos} reintentos)' if reintentos else ''}",
+               NIVEL_TRAZA)
+
+    def registrar_etapa(self, nombre, segundos, **extra):
+        self._agregar({"tipo": "etapa", "etapa": nombre, "segundos": round(segundos, 4), **extra})
+        emitir(f"   ⏱️ Etapa {nombre}: {segundos:.2f}s", NIVEL_DETALLE)
+
+    @contextmanager
+    def medir_etapa(self, nombre, **extra):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registrar_etapa(nombre, time.perf_counter() - inicio, **extra)
+
+    def resumen(self):
+        """Percentiles de latencia, bytes, reintentos y status por endpoint; segundos por etapa"""
+        with self._lock:
+            eventos = list(self.eventos)
+
+        por_endpoint = {}
+        etapas = {}
+        for evento in eventos:
+            if evento["tipo"] == "http":
+                por_endpoint.setdefault(evento["endpoint"] or evento["url"], []).append(evento)
+            elif evento["tipo"] == "etapa":
+                etapa = etapas.setdefault(evento["etapa"], {"veces": 0, "segundos": 0.0})
+                etapa["veces"] += 1
+                etapa["segundos"] = round(etapa["segundos"] + evento["segundos"], 4)
+
+        def agregar(lista):
+            latencias = sorted(e["latencia"] for e in lista)
+            status = {}
+            for e in lista:
+                clave = str(e["status"] if e["status"] is not None else e["error"])
+                status[clave] = status.get(clave, 0) + 1
+            return {
+                "requests": len(lista),
+                "reintentos": sum(e["reintentos"] for e in lista),
+                "bytes": sum(e["bytes"] or 0 for e in lista),
+                "latencia_p50": _percentil(latencias, 50),
+                "latencia_p90": _percentil(latencias, 90),
+                "latencia_p99": _percentil(latencias, 99),
+                "latencia_max": latencias[-1] if latencias else None,
+                "status": status,
+            }
+
+        http = [e for e in eventos if e["tipo"] == "http"]
+        return {
+            "inicio": datetime.fromtimestamp(self.inicio).isoformat(timespec="seconds"),
+            "duracion_total": round(time.monotonic() - self._inicio_monotonic, 2),
+            "http": agregar(http),
+            "http_por_endpoint": {nombre: agregar(lista) for nombre, lista in sorted(por_endpoint.items())},
+            "etapas": etapas,
+        }
+
+    def guardar(self, prefijo):
+        """Escribe {prefijo}.ndjson con los eventos y {prefijo}.json con el resumen"""
+        directorio = os.path.dirname(prefijo)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        with self._lock:
+            eventos = list(self.eventos)
+        with open(f"{prefijo}.ndjson", "w", encoding="utf-8") as f:
+            for evento in eventos:
+                f.write(json.dumps(evento, ensure_ascii=False) + "\n")
+        resumen = self.resumen()
+        with open(f"{prefijo}.json", "w", encoding="utf-8") as f:
+            json.dump(resumen, f, indent=2, ensure_ascii=False)
+        return resumen
+
+_METRICAS = None
+_METRICAS_LOCK = threading.Lock()
+
+def obtener_metricas():
+    """Registro de métricas de la corrida actual (uno por proceso)"""
+    global _METRICAS
+    with _METRICAS_LOCK:
+        if _METRICAS is None:
+            _METRICAS = RegistroMetricas()
+        return _METRICAS
+
+def reiniciar_metricas():
+    """Empieza un registro nuevo (al inicio de cada corrida)"""
+    global _METRICAS
+    with _METRICAS_LOCK:
+        _METRICAS = RegistroMetricas()
+        return _METRICAS
+
+@contextmanager
+def perfilar(prefijo, habilitado=None):
+    """cProfile opcional: guarda {prefijo}.prof y el top por tiempo acumulado en {prefijo}.txt"""
+    if habilitado is None:
+        habilitado = CONFIG_METRICAS["PERFILAR"]
+    if not habilitado:
+        yield
+        return
+    perfil = cProfile.Profile()
+    perfil.enable()
+    try:
+        yield
+    finally:
+        perfil.disable()
+        directorio = os.path.dirname(prefijo)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        perfil.dump_stats(f"{prefijo}.prof")
+        with open(f"{prefijo}.txt", "w", encoding="utf-8") as f:
+            pstats.Stats(perfil, stream=f).sort_stats("cumulative").print_stats(CONFIG_METRICAS["PERFIL_TOP"])
+        emitir(f"🔬 Perfil de exportación: {prefijo}.prof / {prefijo}.txt")
+
+class LimitadorTasa:
+    """Token bucket thread-safe: reemplaza los time.sleep fijos entre requests"""
+
+    def __init__(self, tasa, capacidad=None):
+        self.tasa = float(tasa)
+        self.capacidad = float(capacidad or max(1.0, self.tasa))
+        self._tokens = self.capacidad
+        self._ultimo = time.monotonic()
+        self._pausa_hasta = 0.0
+        self._lock = threading.Lock()
+
+    def adquirir(self):
+        """Bloquea hasta que haya un token disponible"""
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+                self._ultimo = ahora
+                if self._tokens >= 1 and ahora >= self._pausa_hasta:
+                    self._tokens -= 1
+                    return
+                espera = max((1 - self._tokens) / self.tasa, self._pausa_hasta - ahora)
+            time.sleep(espera)
+
+    def ajustar_tasa(self, nueva_tasa):
+        """Cambia la tasa sostenida (usado por el throttling adaptativo)"""
+        with self._lock:
+            self.tasa = float(nueva_tasa)
+
+    def pausar(self, segundos):
+        """Frena a todos los consumidores durante `segundos` (backoff global)"""
+        with self._lock:
+            self._tokens = 0.0
+            self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + segundos)
+
+class ControlAdaptativo:
+    """Throttling AIMD: baja la tasa a la mitad ante 429/5xx y la sube de a poco si la API responde bien"""
+
+    def __init__(self, limitador, tasa_minima=None, tasa_maxima=None,
+                 factor_baja=0.5, incremento=0.5, exitos_para_subir=10):
+        self.limitador = limitador
+        self.tasa_minima = tasa_minima or CONFIG_CONCURRENCIA["TASA_MINIMA"]
+        self.tasa_maxima = tasa_maxima or CONFIG_CONCURRENCIA["TASA_MAXIMA"]
+        self.factor_baja = factor_baja
+        self.incremento = incremento
+        self.exitos_para_subir = exitos_para_subir
+        self._exitos = 0
+        self._lock = threading.Lock()
+
+    def registrar(self, status_code, retry_after=None):
+        """Ajusta la tasa según el código HTTP de la última respuesta"""
+        with self._lock:
+            if status_code == 429 or status_code >= 500:
+                self._exitos = 0
+                nueva = max(self.tasa_minima, self.limitador.tasa * self.factor_baja)
+                self.limitador.ajustar_tasa(nueva)
+                self.limitador.pausar(retry_after if retry_after else 1.0 / nueva)
+            elif status_code < 400:
+                self._exitos += 1
+                if self._exitos >= self.exitos_para_subir:
+                    self._exitos = 0
+                    self.limitador.ajustar_tasa(min(self.tasa_maxima, self.limitador.tasa + self.incremento))
+
+class ContadorProgreso:
+    """Contador thread-safe que informa avance y registros/segundo"""
+
+    def __init__(self, total, cada=50):
+        self.total = total
+        self.cada = cada
+        self.procesados = 0
+        self.exitosos = 0
+        self.errores = 0
+        self._inicio = time.monotonic()
+        self._lock = threading.Lock()
+
+    def velocidad(self):
+        transcurrido = time.monotonic() - self._inicio
+        return self.procesados / transcurrido if transcurrido > 0 else 0.0
+
+    def avanzar(self, exito, mensaje_error=None):
+        with self._lock:
+            self.procesados += 1
+            if exito:
+                self.exitosos += 1
+            else:
+                self.errores += 1
+                # Igual que antes: solo se muestran los primeros errores
+                if mensaje_error and self.errores <= 3:
+                    emitir(f"      [{self.procesados}/{self.total}] {mensaje_error}")
+            if self.procesados % self.cada == 0 or self.procesados == self.total:
+                emitir(f"      [{self.procesados}/{self.total}] ✅ {self.exitosos} exitosos, "
+                       f"{self.errores} errores ({self.velocidad():.1f} reg/s)")
+
+_LIMITADOR_GLOBAL = None
+_LIMITADOR_LOCK = threading.Lock()
+
+def obtener_limitador():
+    """Devuelve el limitador compartido por todos los fetchers"""
+    global _LIMITADOR_GLOBAL
+    with _LIMITADOR_LOCK:
+        if _LIMITADOR_GLOBAL is None:
+            _LIMITADOR_GLOBAL = LimitadorTasa(CONFIG_CONCURRENCIA["REQUESTS_POR_SEGUNDO"],
+                                              CONFIG_CONCURRENCIA["RAFAGA"])
+        return _LIMITADOR_GLOBAL
+
+_SEMAFORO_EN_VUELO = None
+
+def obtener_semaforo_en_vuelo():
+    """Semáforo global que acota los requests simultáneos de todos los endpoints"""
+    global _SEMAFORO_EN_VUELO
+    with _LIMITADOR_LOCK:
+        if _SEMAFORO_EN_VUELO is None:
+            _SEMAFORO_EN_VUELO = threading.BoundedSemaphore(max(1, CONFIG_CONCURRENCIA["MAX_EN_VUELO"]))
+        return _SEMAFORO_EN_VUELO
+
+_CONTROL_GLOBAL = None
+
+def obtener_control():
+    """Devuelve el throttling adaptativo compartido (alimentado por todas las respuestas)"""
+    global _CONTROL_GLOBAL
+    limitador = obtener_limitador()
+    with _LIMITADOR_LOCK:
+        if _CONTROL_GLOBAL is None:
+            _CONTROL_GLOBAL = ControlAdaptativo(limitador)
+        return _CONTROL_GLOBAL
+
+_SESION_HTTP = None
+_SESION_LOCK = threading.Lock()
+
+def obtener_sesion():
+    """Sesión HTTP compartida: keep-alive con pool dimensionado a la concurrencia y compresión"""
+    import requests
+    from requests.adapters import HTTPAdapter
+    global _SESION_HTTP
+    with _SESION_LOCK:
+        if _SESION_HTTP is None:
+            tamano_pool = max(CONFIG_CONCURRENCIA["MAX_WORKERS"],
+                              CONFIG_CONCURRENCIA["MAX_WORKERS_DETALLE"],
+                              CONFIG_CONCURRENCIA["MAX_EN_VUELO"]) + 2
+            sesion = requests.Session()
+            # Los reintentos los maneja solicitar_http (backoff con jitter + Retry-After)
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=tamano_pool, max_retries=0)
+            sesion.mount("https://", adapter)
+            sesion.mount("http://", adapter)
+            sesion.headers.update({
+                "Accept": "application/json",
+                "Accept-Encoding": "gzip, deflate",
+            })
+            _SESION_HTTP = sesion
+        return _SESION_HTTP
+
+def _parsear_retry_after(valor):
+    """Convierte un header Retry-After (segundos o fecha HTTP) a segundos"""
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        fecha = parsedate_to_datetime(valor)
+        return max(0.0, (fecha - datetime.now(fecha.tzinfo)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def _calcular_espera(intento, retry_after=None):
+    """Backoff exponencial con jitter completo; Retry-After tiene prioridad"""
+    if retry_after is not None:
+        return min(retry_after, CONFIG_REINTENTOS["BACKOFF_MAXIMO"])
+    techo = min(CONFIG_REINTENTOS["BACKOFF_MAXIMO"], CONFIG_REINTENTOS["BACKOFF_BASE"] * (2 ** intento))
+    return random.uniform(techo / 2, techo)
+
+def obtener_timeout(politica, endpoint_name=None):
+    """Timeout (conexión, lectura) para el tipo de petición, con override por endpoint"""
+    return TIMEOUTS_POR_ENDPOINT.get(endpoint_name) or POLITICAS_TIMEOUT[politica]
+
+class CorridaInterrumpida(Exception):
+    """La corrida se canceló (Ctrl-C): los requests pendientes no se envían"""
+
+_CANCELACION = threading.Event()
+
+def solicitar_http(metodo, url, politica, endpoint_name=None, limitar=True, token=None, contexto=None,
+                   reintentar_timeout=True, **kwargs):
+    """Punto único de acceso HTTP para todos los fetchers
+    
+    Usa la sesión compartida, respeta el limitador global y reintenta timeouts,
+    errores de conexión y los status de CONFIG_REINTENTOS. Devuelve la última
+    respuesta (aunque no sea 200) o relanza la última excepción de red.
+    
+    `token` puede ser el string del access_token o un GestorToken; con un
+    GestorToken, un 401 fuerza una renovación y se reintenta una vez, sin
+    consumir el cupo de reintentos.
+    
+    Con reintentar_timeout=False un timeout se relanza sin reintentar (quien
+    llama tiene una alternativa mejor, como partir la ventana).
+    
+    Cada llamada deja un evento en obtener_metricas() con status, latencia del
+    último intento, bytes y reintentos; `contexto` identifica la ventana o el ID.
+    """
+    import requests
+    if CONFIG_ARCHIVO["OFFLINE"]:
+        raise RuntimeError(f"--offline: no se hacen requests ({metodo} {url})")
+    sesion = obtener_sesion()
+    metricas = obtener_metricas()
+    inicio_llamada = time.perf_counter()
+    control = obtener_control() if limitar else None
+    kwargs.setdefault("timeout", obtener_timeout(politica, endpoint_name))
+    headers = dict(kwargs.pop("headers", None) or {})
+    max_reintentos = CONFIG_REINTENTOS["MAX_REINTENTOS"]
+    renovado = False
+    intento = 0
+    
+    # Cada vuelta termina en return, raise o continue; `intento` cuenta solo los reintentos
+    while True:
+        if _CANCELACION.is_set():
+            raise CorridaInterrumpida("corrida interrumpida")
+        valor_token = token.obtener() if isinstance(token, GestorToken) else token
+        if valor_token:
+            headers["Authorization"] = f"Bearer {valor_token}"
+        if limitar:
+            obtener_limitador().adquirir()
+        inicio_intento = time.perf_counter()
+        try:
+            # Con stream=True el cupo se libera al recibir los headers
+            with obtener_semaforo_en_vuelo():
+                response = sesion.request(metodo, url, headers=headers, **kwargs)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            if control:
+                control.registrar(504)
+            sin_reintento = not reintentar_timeout and isinstance(e, requests.exceptions.Timeout)
+            if intento >= max_reintentos or sin_reintento:
+                fin = time.perf_counter()
+                metricas.registrar_http(metodo, url, endpoint_name, contexto, None, fin - inicio_intento,
+                                        fin - inicio_llamada, None, intento, type(e).__name__)
+                raise
+            time.sleep(_calcular_espera(intento))
+            intento += 1
+            continue
+        
+        if response.status_code == 401 and isinstance(token, GestorToken) and not renovado:
+            response.close()
+            token.invalidar(valor_token)
+            renovado = True
+            continue
+        
+        retry_after = _parsear_retry_after(response.headers.get("Retry-After"))
+        if control:
+            control.registrar(response.status_code, retry_after)
+        
+        if response.status_code in CONFIG_REINTENTOS["STATUS_REINTENTABLES"] and intento < max_reintentos:
+            response.close()
+            time.sleep(_calcular_espera(intento, retry_after))
+            intento += 1
+            continue
+        
+        fin = time.perf_counter()
+        if kwargs.get("stream"):
+            # El cuerpo todavía no se leyó: se usa Content-Length si viene
+            largo = response.headers.get("Content-Length")
+            bytes_respuesta = int(largo) if largo and largo.isdigit() else None
+        else:
+            bytes_respuesta = len(response.content)
+        metricas.registrar_http(metodo, url, endpoint_name, contexto, response.status_code,
+                                fin - inicio_intento, fin - inicio_llamada, bytes_respuesta, intento)
+        return response
+
+def _solicitar_token():
+    """Pide un token nuevo al TokenEndpoint y devuelve la respuesta completa (dict)"""
+    from requests.auth import HTTPBasicAuth
     data = {"grant_type": "client_credentials",
             "scope":"api_auth"}
+    
+    response = solicitar_http(
+        "POST",
+        TOKEN_URL,
+        "token",
+        limitar=False,
+        data=data,
+        auth=HTTPBasicAuth(CLIENT_ID, SECRET_ID),
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    response.raise_for_status()
+    return response.json()
+
+def get_token():
+    """Genera y devuelve un access_token válido"""
+    import requests
+    emitir("🔑 Generando token de acceso...")
 
     try:
-        response = requests.post(
-            TOKEN_URL,
-            data=data,
-            auth=HTTPBasicAuth(CLIENT_ID, SECRET_ID),
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-            timeout=30
-        )
-        response.raise_for_status()
-        token_data = response.json()
-        return token_data["access_token"]
+        return _solicitar_token()["access_token"]
     except requests.exceptions.RequestException as e:
-        print(f"❌ Error obteniendo token: {e}")
+        emitir(f"❌ Error obteniendo token: {e}", NIVEL_ERROR)
         raise
 
-def get_data_monthly_chunks_only(token, endpoint_name, endpoint, fecha_desde=None):
-    """MÉTODO ÚNICO: Obtiene datos dividiendo por meses (más efectivo y rápido)"""
-    if fecha_desde is None:
-        fecha_desde = CONFIG_FECHAS["FECHA_DESDE"]
+class GestorToken:
+    """Token OAuth compartido entre workers: vence, se renueva solo y se puede cachear en disco
+    
+    obtener() renueva de forma proactiva MARGEN_RENOVACION segundos antes del
+    vencimiento (expires_in), o a mitad de la vida del token si es más corta
+    que el doble del margen. invalidar() se usa ante un 401: si varios workers
+    fallan con el mismo token, solo el primero lo renueva y el resto recibe el
+    nuevo. Todas las renovaciones pasan por un único lock.
+    """
+
+    def __init__(self, cache_en_disco=None, ruta_cache=None):
+        self.cache_en_disco = CONFIG_TOKEN["CACHE_EN_DISCO"] if cache_en_disco is None else cache_en_disco
+        self.ruta_cache = ruta_cache or CONFIG_TOKEN["RUTA_CACHE"]
+        self.renovaciones = 0
+        self._token = None
+        self._vence = 0.0      # epoch, para que sirva entre corridas
+        self._vida = 0.0       # expires_in del token actual
+        self._lock = threading.Lock()
+        if self.cache_en_disco:
+            self._leer_cache()
+
+    def _clave_cliente(self):
+        # El cache se asocia a las credenciales: otro CLIENT_ID no lo reutiliza
+        return hashlib.sha256(f"{CLIENT_ID}:{TOKEN_URL}".encode("utf-8")).hexdigest()
+
+    def _leer_cache(self):
+        try:
+            with open(self.ruta_cache, encoding="utf-8") as f:
+                cache = json.load(f)
+            if cache.get("cliente") == self._clave_cliente():
+                self._token = cache["access_token"]
+                self._vence = float(cache["vence"])
+                self._vida = float(cache.get("vida") or 3600)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _guardar_cache(self):
+        contenido = json.dumps({"cliente": self._clave_cliente(),
+                                "access_token": self._token,
+                                "vence": self._vence,
+                                "vida": self._vida})
+        try:
+            fd = os.open(self.ruta_cache, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(contenido)
+        except OSError as e:
+            emitir(f"   ⚠️ No se pudo guardar el token en disco: {e}", NIVEL_ERROR)
+
+    def vigente(self):
+        margen = min(CONFIG_TOKEN["MARGEN_RENOVACION"], self._vida / 2)
+        return self._token is not None and time.time() < self._vence - margen
+
+    def _renovar(self):
+        token_data = _solicitar_token()
+        self._token = token_data["access_token"]
+        self._vida = float(token_data.get("expires_in") or 3600)
+        self._vence = time.time() + self._vida
+        self.renovaciones += 1
+        if self.cache_en_disco:
+            self._guardar_cache()
+
+    def obtener(self):
+        """Devuelve un access_token vigente, renovándolo si está por vencer"""
+        with self._lock:
+            if not self.vigente():
+                self._renovar()
+            return self._token
+
+    def invalidar(self, token_usado):
+        """Renueva tras un 401, salvo que otro worker ya lo haya hecho"""
+        with self._lock:
+            if token_usado == self._token:
+                self._renovar()
+            return self._token
+
+    def segundos_restantes(self):
+        return max(0.0, self._vence - time.time())
+
+class AlmacenLocal:
+    """Almacén SQLite de ventanas ya descargadas, para sincronización incremental"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._conn = sqlite3.connect(ruta, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS ventanas (
+                    endpoint TEXT NOT NULL,
+                    desde TEXT NOT NULL,
+                    hasta TEXT NOT NULL,
+                    cantidad INTEGER NOT NULL,
+                    registros BLOB NOT NULL,
+                    descargado TEXT NOT NULL,
+                    PRIMARY KEY (endpoint, desde, hasta)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS detalles (
+                    endpoint TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    huella TEXT NOT NULL,
+                    payload BLOB NOT NULL,
+                    descargado TEXT NOT NULL,
+                    usado TEXT NOT NULL,
+                    PRIMARY KEY (endpoint, id)
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_detalles_usado ON detalles (usado)")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS duraciones_endpoint (
+                    endpoint TEXT PRIMARY KEY,
+                    segundos REAL NOT NULL,
+                    actualizado TEXT NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS esquemas (
+                    endpoint TEXT NOT NULL,
+                    rol TEXT NOT NULL,
+                    campos TEXT NOT NULL,
+                    contenido BLOB NOT NULL,
+                    actualizado TEXT NOT NULL,
+                    PRIMARY KEY (endpoint, rol)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS catalogos (
+                    endpoint TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    huella TEXT NOT NULL,
+                    cantidad INTEGER NOT NULL,
+                    registros BLOB,
+                    actualizado TEXT NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS historial_ventanas (
+                    endpoint TEXT NOT NULL,
+                    desde TEXT NOT NULL,
+                    hasta TEXT NOT NULL,
+                    registros INTEGER NOT NULL,
+                    duracion REAL NOT NULL,
+                    actualizado TEXT NOT NULL,
+                    PRIMARY KEY (endpoint, desde, hasta)
+                )
+            """)
+
+    @staticmethod
+    def _comprimir(obj):
+        return zlib.compress(json.dumps(obj, ensure_ascii=False).encode("utf-8"))
+
+    @staticmethod
+    def _descomprimir(blob):
+        return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+    def obtener_ventana(self, endpoint, desde, hasta):
+        """Devuelve los registros guardados de la ventana o None si no está"""
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT registros FROM ventanas WHERE endpoint = ? AND desde = ? AND hasta = ?",
+                (endpoint, desde, hasta)).fetchone()
+        return self._descomprimir(fila[0]) if fila else None
+
+    def guardar_ventana(self, endpoint, desde, hasta, registros):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ventanas VALUES (?, ?, ?, ?, ?, ?)",
+                (endpoint, desde, hasta, len(registros), self._comprimir(registros),
+                 datetime.now().isoformat(timespec="seconds")))
+
+    def obtener_rango(self, endpoint, desde, hasta):
+        """Registros de [desde, hasta] si las ventanas guardadas lo cubren exactamente
+        
+        Admite que el rango esté partido en varias ventanas guardadas (p.ej. un
+        trimestre fusionado o un mes dividido por el planificador).
+        """
+        guardados = self.obtener_ventana(endpoint, desde, hasta)
+        if guardados is not None:
+            return guardados
+        with self._lock:
+            filas = self._conn.execute(
+                "SELECT desde, hasta FROM ventanas WHERE endpoint = ? AND desde >= ? AND hasta <= ? "
+                "ORDER BY desde, hasta DESC",
+                (endpoint, desde, hasta)).fetchall()
+        # Recorrido greedy: en cada paso la ventana más larga que arranca en el cursor
+        por_inicio = {}
+        for d, h in filas:
+            por_inicio.setdefault(d, h)
+        tramos = []
+        cursor = desde
+        while cursor <= hasta:
+            fin = por_inicio.get(cursor)
+            if fin is None:
+                return None
+            tramos.append((cursor, fin))
+            cursor = (datetime.strptime(fin, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+        registros = []
+        for d, h in tramos:
+            registros.extend(self.obtener_ventana(endpoint, d, h))
+        return registros
+
+    def obtener_historial(self, endpoint):
+        """Ventanas de la última partición usada: [(desde, hasta, registros)]"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT desde, hasta, registros FROM historial_ventanas WHERE endpoint = ? ORDER BY desde",
+                (endpoint,)).fetchall()
+
+    def reemplazar_historial(self, endpoint, desde, hasta, hojas):
+        """Reemplaza el historial de [desde, hasta] por las ventanas efectivamente usadas"""
+        ahora = datetime.now().isoformat(timespec="seconds")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM historial_ventanas WHERE endpoint = ? AND desde <= ? AND hasta >= ?",
+                (endpoint, hasta, desde))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO historial_ventanas VALUES (?, ?, ?, ?, ?, ?)",
+                [(endpoint, d, h, n, dur, ahora) for d, h, n, dur in hojas])
+
+    def obtener_catalogo(self, endpoint):
+        """Última versión conocida del catálogo: etag, last_modified, huella y cantidad (o None)"""
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT etag, last_modified, huella, cantidad, registros IS NOT NULL FROM catalogos "
+                "WHERE endpoint = ?", (endpoint,)).fetchone()
+        if not fila:
+            return None
+        return {"etag": fila[0], "last_modified": fila[1], "huella": fila[2], "cantidad": fila[3],
+                "con_registros": bool(fila[4])}
+
+    def obtener_registros_catalogo(self, endpoint):
+        with self._lock:
+            fila = self._conn.execute("SELECT registros FROM catalogos WHERE endpoint = ?", (endpoint,)).fetchone()
+        return self._descomprimir(fila[0]) if fila and fila[0] is not None else None
+
+    def guardar_catalogo(self, endpoint, etag, last_modified, huella, cantidad, registros=None):
+        """Los registros solo hacen falta si hay validadores: son los que se sirven ante un 304"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO catalogos VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (endpoint, etag, last_modified, huella, cantidad,
+                 self._comprimir(registros) if registros is not None else None,
+                 datetime.now().isoformat(timespec="seconds")))
+
+    def obtener_duraciones(self):
+        """{endpoint: segundos} de la última corrida de cada endpoint"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT endpoint, segundos FROM duraciones_endpoint").fetchall())
+
+    def guardar_duracion(self, endpoint, segundos):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO duraciones_endpoint VALUES (?, ?, ?)",
+                (endpoint, segundos, datetime.now().isoformat(timespec="seconds")))
+
+    def obtener_huellas_detalles(self, endpoint):
+        """Devuelve {id: huella} de los detalles guardados del endpoint (sin payloads)"""
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT id, huella FROM detalles WHERE endpoint = ?", (endpoint,)).fetchall())
+
+    def obtener_detalles(self, endpoint, ids=None):
+        """Devuelve {id: (huella, payload comprimido)} de los detalles guardados del endpoint
+        
+        Con `ids` solo trae esos (en tandas, por el límite de parámetros de SQLite).
+        """
+        with self._lock:
+            if ids is None:
+                filas = self._conn.execute(
+                    "SELECT id, huella, payload FROM detalles WHERE endpoint = ?", (endpoint,)).fetchall()
+            else:
+                filas = []
+                for inicio in range(0, len(ids), 500):
+                    tanda = [str(id_) for id_ in ids[inicio:inicio + 500]]
+                    filas.extend(self._conn.execute(
+                        f"SELECT id, huella, payload FROM detalles WHERE endpoint = ? "
+                        f"AND id IN ({','.join('?' * len(tanda))})", (endpoint, *tanda)).fetchall())
+        return {id_: (huella, payload) for id_, huella, payload in filas}
+
+    def guardar_detalles(self, endpoint, entradas):
+        """Guarda una lista de (id, huella, detalle)"""
+        ahora = datetime.now().isoformat(timespec="seconds")
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO detalles VALUES (?, ?, ?, ?, ?, ?)",
+                [(endpoint, str(id_), huella, self._comprimir(detalle), ahora, ahora)
+                 for id_, huella, detalle in entradas])
+
+    def marcar_detalles_usados(self, endpoint, ids):
+        ahora = datetime.now().isoformat(timespec="seconds")
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE detalles SET usado = ? WHERE endpoint = ? AND id = ?",
+                [(ahora, endpoint, str(id_)) for id_ in ids])
+
+    def podar_detalles(self, max_entradas, max_dias):
+        """Desaloja detalles viejos y, si sobran, los menos usados. Devuelve cuántos borró"""
+        limite = (datetime.now() - timedelta(days=max_dias)).isoformat(timespec="seconds")
+        with self._lock, self._conn:
+            borrados = self._conn.execute(
+                "DELETE FROM detalles WHERE descargado < ?", (limite,)).rowcount
+            total = self._conn.execute("SELECT COUNT(*) FROM detalles").fetchone()[0]
+            if total > max_entradas:
+                borrados += self._conn.execute(
+                    "DELETE FROM detalles WHERE rowid IN "
+                    "(SELECT rowid FROM detalles ORDER BY usado LIMIT ?)",
+                    (total - max_entradas,)).rowcount
+        return borrados
+
+    def obtener_esquemas(self):
+        """{(endpoint, rol): (campos, contenido)} de todos los esquemas guardados"""
+        with self._lock:
+            filas = self._conn.execute("SELECT endpoint, rol, campos, contenido FROM esquemas").fetchall()
+        return {(endpoint, rol): (json.loads(campos), self._descomprimir(contenido))
+                for endpoint, rol, campos, contenido in filas}
+
+    def guardar_esquema(self, endpoint, rol, campos, contenido):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO esquemas VALUES (?, ?, ?, ?, ?)",
+                (endpoint, rol, json.dumps(sorted(campos)), self._comprimir(contenido),
+                 datetime.now().isoformat(timespec="seconds")))
+
+    def cerrar(self):
+        with self._lock:
+            self._conn.close()
+
+_ALMACEN = None
+
+def obtener_almacen():
+    """Devuelve el almacén local compartido, o None si está deshabilitado"""
+    global _ALMACEN
+    if not CONFIG_ALMACEN["HABILITADO"]:
+        return None
+    with _SESION_LOCK:
+        if _ALMACEN is None:
+            _ALMACEN = AlmacenLocal(CONFIG_ALMACEN["RUTA"])
+        return _ALMACEN
+
+class _UnidadEnCurso:
+    """Unidad del diario que se comprime a medida que llegan sus registros"""
+
+    def __init__(self, diario, endpoint, clave):
+        self.diario = diario
+        self.endpoint = endpoint
+        self.clave = clave
+        self.cantidad = 0
+        self._compresor = zlib.compressobj()
+        self._partes = [self._compresor.compress(b"[")]
+
+    def agregar(self, registro):
+        separador = b"," if self.cantidad else b""
+        self._partes.append(self._compresor.compress(
+            separador + json.dumps(registro, ensure_ascii=False).encode("utf-8")))
+        self.cantidad += 1
+
+    def confirmar(self):
+        """Guarda la unidad como terminada (mismo formato que AlmacenLocal._comprimir)"""
+        self._partes.append(self._compresor.compress(b"]"))
+        self._partes.append(self._compresor.flush())
+        self.diario._insertar(self.endpoint, self.clave, self.cantidad, b"".join(self._partes))
+        self._partes = None
+
+class DiarioCorrida:
+    """Diario SQLite de la corrida: cada unidad terminada se guarda al instante
+    
+    Una unidad es una ventana de fechas ("ventana:desde..hasta"), un catálogo
+    ("catalogo"), las cabeceras de asientos ("cabeceras") o un bloque de
+    detalle ("detalle:inicio+cantidad"). Con reanudar=True se retoma la última
+    corrida sin terminar: sus unidades se sirven desde el diario sin HTTP y
+    las salidas se vuelven a armar con el mismo timestamp.
+    
+    También guarda el plan de ventanas de cada endpoint: al reanudar se usa
+    el mismo, así las claves de las ventanas coinciden aunque el historial
+    del planificador haya cambiado en la corrida cortada.
+    """
+
+    def __init__(self, ruta, reanudar=False):
+        self.ruta = ruta
+        self._conn = sqlite3.connect(ruta, timeout=30, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.fallos = []
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS corridas (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TEXT NOT NULL,
+                    estado TEXT NOT NULL,
+                    inicio TEXT NOT NULL,
+                    fin TEXT
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS unidades (
+                    corrida INTEGER NOT NULL,
+                    endpoint TEXT NOT NULL,
+                    clave TEXT NOT NULL,
+                    cantidad INTEGER NOT NULL,
+                    registros BLOB NOT NULL,
+                    guardado TEXT NOT NULL,
+                    PRIMARY KEY (corrida, endpoint, clave)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS planes (
+                    corrida INTEGER NOT NULL,
+                    endpoint TEXT NOT NULL,
+                    rango TEXT NOT NULL,
+                    ventanas TEXT NOT NULL,
+                    PRIMARY KEY (corrida, endpoint)
+                )
+            """)
+            fila = None
+            if reanudar:
+                fila = self._conn.execute(
+                    "SELECT id, timestamp FROM corridas WHERE estado = 'en_curso' ORDER BY id DESC LIMIT 1"
+                ).fetchone()
+            if fila:
+                self.id, self.timestamp = fila
+            else:
+                # Una corrida nueva descarta las que quedaron a medias
+                for tabla in ("unidades", "planes"):
+                    self._conn.execute(f"DELETE FROM {tabla} WHERE corrida IN "
+                                       "(SELECT id FROM corridas WHERE estado = 'en_curso')")
+                self._conn.execute("UPDATE corridas SET estado = 'abandonada' WHERE estado = 'en_curso'")
+                self.timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                self.id = self._conn.execute(
+                    "INSERT INTO corridas (timestamp, estado, inicio) VALUES (?, 'en_curso', ?)",
+                    (self.timestamp, datetime.now().isoformat(timespec="seconds"))).lastrowid
+            self.reanudada = fila is not None
+            self._claves = {(endpoint, clave) for endpoint, clave in self._conn.execute(
+                "SELECT endpoint, clave FROM unidades WHERE corrida = ?", (self.id,))}
+
+    def unidades_completas(self):
+        return len(self._claves)
+
+    def contiene(self, endpoint, clave):
+        return (endpoint, clave) in self._claves
+
+    def obtener(self, endpoint, clave):
+        """Registros de la unidad si ya se completó en esta corrida, si no None"""
+        if not self.contiene(endpoint, clave):
+            return None
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT registros FROM unidades WHERE corrida = ? AND endpoint = ? AND clave = ?",
+                (self.id, endpoint, clave)).fetchone()
+        return AlmacenLocal._descomprimir(fila[0]) if fila else None
+
+    def guardar(self, endpoint, clave, registros):
+        self._insertar(endpoint, clave, len(registros), AlmacenLocal._comprimir(registros))
+
+    def unidad(self, endpoint, clave):
+        """Unidad que se arma registro por registro y se guarda con confirmar()"""
+        return _UnidadEnCurso(self, endpoint, clave)
+
+    def _insertar(self, endpoint, clave, cantidad, blob):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO unidades VALUES (?, ?, ?, ?, ?, ?)",
+                (self.id, endpoint, clave, cantidad, blob, datetime.now().isoformat(timespec="seconds")))
+            self._claves.add((endpoint, clave))
+
+    def plan(self, endpoint, rango):
+        """Ventanas [(desde, hasta)] planificadas en esta corrida para el mismo rango, o None"""
+        with self._lock:
+            fila = self._conn.execute("SELECT rango, ventanas FROM planes WHERE corrida = ? AND endpoint = ?",
+                                      (self.id, endpoint)).fetchone()
+        if not fila or fila[0] != rango:
+            return None
+        return [tuple(ventana) for ventana in json.loads(fila[1])]
+
+    def guardar_plan(self, endpoint, rango, ventanas):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO planes VALUES (?, ?, ?, ?)",
+                               (self.id, endpoint, rango, json.dumps(ventanas)))
+
+    def registrar_fallo(self, endpoint, clave, motivo=None):
+        """Unidad que no se completó: la corrida queda pendiente para --resume"""
+        with self._lock:
+            self.fallos.append((endpoint, clave, motivo))
+
+    def completar(self):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE corridas SET estado = 'completa', fin = ? WHERE id = ?",
+                               (datetime.now().isoformat(timespec="seconds"), self.id))
+            if not CONFIG_DIARIO["CONSERVAR_COMPLETAS"]:
+                self._conn.execute("DELETE FROM unidades WHERE corrida = ?", (self.id,))
+                self._conn.execute("DELETE FROM planes WHERE corrida = ?", (self.id,))
+
+    def cerrar(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def pendiente(ruta):
+        """(timestamp, {endpoint: unidades}) de la última corrida sin terminar, sin abrir una nueva"""
+        if not os.path.exists(ruta):
+            return None
+        conn = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True)
+        try:
+            fila = conn.execute(
+                "SELECT id, timestamp FROM corridas WHERE estado = 'en_curso' ORDER BY id DESC LIMIT 1"
+            ).fetchone()
+            if not fila:
+                return None
+            return fila[1], dict(conn.execute(
+                "SELECT endpoint, COUNT(*) FROM unidades WHERE corrida = ? GROUP BY endpoint", (fila[0],)))
+        finally:
+            conn.close()
+
+_DIARIO = None
+
+def iniciar_diario(reanudar=False):
+    """Abre el diario de la corrida (nueva o la última sin terminar) y lo deja compartido"""
+    global _DIARIO
+    habilitado = CONFIG_DIARIO["HABILITADO"] and not CONFIG_ARCHIVO["OFFLINE"]
+    _DIARIO = DiarioCorrida(CONFIG_DIARIO["RUTA"], reanudar) if habilitado else None
+    return _DIARIO
+
+def obtener_diario():
+    """Diario de la corrida en curso, o None (uso como librería, benchmarks)"""
+    return _DIARIO
+
+# Índice de IDs del archivo: hash del ID, unidad del manifiesto y línea dentro de la unidad
+_REGISTRO_INDICE = struct.Struct("<QII")
+
+def _id_registro(registro):
+    """Valor del primer campo de CONFIG_DEDUP["CAMPOS_CLAVE"] presente en el registro"""
+    if registro.__class__ is dict:
+        for campo in CONFIG_DEDUP["CAMPOS_CLAVE"]:
+            valor = registro.get(campo)
+            if valor is not None and valor != "":
+                return valor
+    return None
+
+class _UnidadArchivo:
+    """Miembro gzip de un segmento que se escribe a medida que llegan los registros"""
+
+    def __init__(self, escritor, clave):
+        self.escritor = escritor
+        self.clave = clave
+        self.cantidad = 0
+        self._archivo = escritor._abrir_segmento()
+        self._offset = self._archivo.tell()
+        # wbits=31: cada unidad es un miembro gzip completo (el segmento se lee con zcat)
+        self._compresor = zlib.compressobj(CONFIG_ARCHIVO["NIVEL_COMPRESION"], zlib.DEFLATED, 31)
+        self._posicion = len(escritor.unidades)
+        self._inicio_indice = len(escritor._hashes)
+
+    def agregar(self, registro):
+        linea = json.dumps(registro, ensure_ascii=False) + "\n"
+        self._archivo.write(self._compresor.compress(linea.encode("utf-8")))
+        id_ = _id_registro(registro)
+        if id_ is not None:
+            self.escritor._indexar(IndiceClaves._hash(id_), self._posicion, self.cantidad)
+        self.cantidad += 1
+
+    def confirmar(self, reutilizable=False):
+        """Cierra el miembro gzip; con reutilizable=True, si la unidad anterior tiene la misma
+        cantidad de registros se descarta lo escrito y se conserva la anterior"""
+        if reutilizable and self.escritor.reutilizar(self.clave, self.cantidad):
+            self._archivo.truncate(self._offset)
+            # En modo "ab" el truncate no mueve la posición: sin el seek, tell() seguiría en el final viejo
+            self._archivo.seek(self._offset)
+            for indice in (self.escritor._hashes, self.escritor._unidades_idx, self.escritor._lineas_idx):
+                del indice[self._inicio_indice:]
+            return
+        self._archivo.write(self._compresor.flush())
+        self.escritor.unidades.append({
+            "clave": self.clave, "segmento": self.escritor.segmento, "offset": self._offset,
+            "largo": self._archivo.tell() - self._offset, "registros": self.cantidad,
+        })
+
+class EscritorArchivo:
+    """Descarga de un endpoint hacia el archivo: un segmento nuevo y, al terminar, el manifiesto
+    
+    Las unidades que no vinieron de la API (almacén local, diario) se reutilizan
+    del manifiesto anterior si ya estaban. Si algo falló o la descarga se cortó,
+    el manifiesto anterior queda vigente y el segmento nuevo se borra.
+    
+    Una descarga por fechas reemplaza solo las ventanas que pidió: las del
+    manifiesto anterior fuera de su rango se conservan (las que lo cruzan se
+    reescriben con los días que quedaron afuera), así un fetch más angosto no
+    borra el historial archivado.
+    """
+
+    def __init__(self, archivo, endpoint):
+        self.archivo = archivo
+        self.endpoint = endpoint
+        self.completo = True
+        self.unidades = []
+        self.segmento = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{threading.get_ident()}.ndjson.gz"
+        self._previo = archivo.manifiesto(endpoint) or {"unidades": []}
+        self._previas = {u["clave"]: i for i, u in enumerate(self._previo["unidades"])}
+        self._reutilizadas = {}    # posición en el manifiesto anterior → posición nueva
+        self._hashes = array("Q")
+        self._unidades_idx = array("I")
+        self._lineas_idx = array("I")
+        self._segmento = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        if tipo is not None:
+            self.completo = False
+        self.cerrar()
+        return False
+
+    def _abrir_segmento(self):
+        if self._segmento is None:
+            os.makedirs(self.archivo._ruta(self.endpoint), exist_ok=True)
+            self._segmento = open(self.archivo._ruta(self.endpoint, self.segmento), "ab")
+        return self._segmento
+
+    def _indexar(self, hash_id, unidad, linea):
+        self._hashes.append(hash_id)
+        self._unidades_idx.append(unidad)
+        self._lineas_idx.append(linea)
+
+    def unidad(self, clave):
+        return _UnidadArchivo(self, clave)
+
+    def reutilizar(self, clave, cantidad):
+        """Agrega la unidad del manifiesto anterior si existe con esa cantidad de registros"""
+        previa = self._previas.get(clave)
+        if previa is None or self._previo["unidades"][previa]["registros"] != cantidad:
+            return False
+        self._reutilizadas[previa] = len(self.unidades)
+        self.unidades.append(dict(self._previo["unidades"][previa]))
+        return True
+
+    def registrar(self, clave, registros, reutilizable=False):
+        """Agrega una unidad completa; con reutilizable=True antes se busca en el manifiesto anterior"""
+        if reutilizable and self.reutilizar(clave, len(registros)):
+            return
+        unidad = self.unidad(clave)
+        for registro in registros:
+            unidad.agregar(registro)
+        unidad.confirmar()
+
+    def fallo(self):
+        self.completo = False
+
+    def cerrar(self):
+        if self.completo:
+            self._conservar_previas()
+        if self._segmento is not None:
+            self._segmento.close()
+        if self.completo:
+            self._publicar()
+        self.archivo._limpiar(self.endpoint)
+
+    def _conservar_previas(self):
+        """Suma las ventanas del manifiesto anterior que esta descarga no cubrió, en orden cronológico"""
+        cubiertas = sorted(rango for rango in (_rango_unidad(u["clave"]) for u in self.unidades) if rango)
+        if not cubiertas:
+            # Catálogos y asientos: cada descarga trae el conjunto completo
+            return
+        claves = {u["clave"] for u in self.unidades}
+        conservadas = False
+        for posicion, unidad in enumerate(self._previo["unidades"]):
+            rango = _rango_unidad(unidad["clave"])
+            if rango is None or unidad["clave"] in claves or posicion in self._reutilizadas:
+                continue
+            restos = _restar_rangos(rango, cubiertas)
+            if not restos:
+                continue
+            conservadas = True
+            if restos == [rango]:
+                self._reutilizadas[posicion] = len(self.unidades)
+                self.unidades.append(dict(unidad))
+                continue
+            # Ventana anterior que cruza el rango nuevo: se reescriben sus días no cubiertos
+            registros = [json.loads(linea) for linea in self.archivo._leer_unidad(self.endpoint, unidad).splitlines()]
+            for desde, hasta in restos:
+                parte = self.unidad(f"ventana:{desde}..{hasta}")
+                for registro in registros:
+                    fecha = str(registro.get("fecha") or "")[:10]
+                    if desde <= fecha <= hasta or (not fecha and (desde, hasta) == restos[0]):
+                        parte.agregar(registro)
+                parte.confirmar()
+        if conservadas:
+            orden = sorted(range(len(self.unidades)), key=lambda i: _rango_unidad(self.unidades[i]["clave"]))
+            nueva = {vieja: i for i, vieja in enumerate(orden)}
+            self.unidades = [self.unidades[i] for i in orden]
+            self._unidades_idx = array("I", (nueva[u] for u in self._unidades_idx))
+            self._reutilizadas = {previa: nueva[actual] for previa, actual in self._reutilizadas.items()}
+
+    def _publicar(self):
+        """Escribe el índice (ordenado por hash, para mmap + búsqueda binaria) y después el manifiesto"""
+        if self._reutilizadas:
+            for hash_id, unidad, linea in self.archivo._entradas_indice(self.endpoint, self._previo):
+                nueva = self._reutilizadas.get(unidad)
+                if nueva is not None:
+                    self._indexar(hash_id, nueva, linea)
+        hashes, unidades, lineas = self._hashes, self._unidades_idx, self._lineas_idx
+        indice = f"ids_{self.segmento.split('.')[0]}.idx"
+        ruta_indice = self.archivo._ruta(self.endpoint, indice)
+        os.makedirs(self.archivo._ruta(self.endpoint), exist_ok=True)
+        with open(ruta_indice + ".tmp", "wb") as f:
+            for i in sorted(range(len(hashes)), key=hashes.__getitem__):
+                f.write(_REGISTRO_INDICE.pack(hashes[i], unidades[i], lineas[i]))
+        os.replace(ruta_indice + ".tmp", ruta_indice)
         
-    print(f"📅 Descargando {endpoint_name} mes por mes desde {fecha_desde}")
+        ruta_manifiesto = self.archivo._ruta(self.endpoint, "manifiesto.json")
+        with open(ruta_manifiesto + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"endpoint": self.endpoint, "actualizado": datetime.now().isoformat(timespec="seconds"),
+                       "registros": sum(u["registros"] for u in self.unidades), "indice": indice,
+                       "unidades": self.unidades}, f, ensure_ascii=False)
+        os.replace(ruta_manifiesto + ".tmp", ruta_manifiesto)
+
+def _rango_unidad(clave):
+    """("desde", "hasta") de una unidad "ventana:desde..hasta"; None para catálogos y asientos"""
+    if not clave.startswith("ventana:"):
+        return None
+    return tuple(clave[len("ventana:"):].split("..", 1))
+
+def _restar_rangos(rango, cubiertas):
+    """Tramos de [desde, hasta] (ISO, inclusive) que no cubre ninguna de las ventanas (ordenadas)"""
+    un_dia = timedelta(days=1)
+    cursor, fin = (datetime.strptime(fecha, "%Y-%m-%d") for fecha in rango)
+    restos = []
+    for desde, hasta in cubiertas:
+        desde, hasta = datetime.strptime(desde, "%Y-%m-%d"), datetime.strptime(hasta, "%Y-%m-%d")
+        if hasta < cursor or desde > fin:
+            continue
+        if desde > cursor:
+            restos.append((cursor, desde - un_dia))
+        cursor = max(cursor, hasta + un_dia)
+        if cursor > fin:
+            break
+    if cursor <= fin:
+        restos.append((cursor, fin))
+    return [(desde.strftime("%Y-%m-%d"), hasta.strftime("%Y-%m-%d")) for desde, hasta in restos]
+
+class ArchivoCrudo:
+    """Archivo de respuestas crudas por endpoint, para volver a exportar sin la API
     
-    all_data = []
+    Cada endpoint tiene su directorio con segmentos .ndjson.gz (un miembro gzip
+    por unidad: ventana, catálogo o bloque de detalle), un manifiesto con las
+    unidades de la última descarga completa en orden y un índice binario
+    ordenado ID → (unidad, línea) que se consulta con mmap.
+    """
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self._lock = threading.Lock()
+
+    def _ruta(self, endpoint, *partes):
+        return os.path.join(self.directorio, endpoint, *partes)
+
+    def manifiesto(self, endpoint):
+        try:
+            with open(self._ruta(endpoint, "manifiesto.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def escritor(self, endpoint):
+        return EscritorArchivo(self, endpoint)
+
+    def _leer_unidad(self, endpoint, unidad):
+        with open(self._ruta(endpoint, unidad["segmento"]), "rb") as f:
+            f.seek(unidad["offset"])
+            return zlib.decompress(f.read(unidad["largo"]), 31)
+
+    def iterar(self, endpoint, desde=None, hasta=None):
+        """Registros de la última descarga completa, unidad por unidad (None si no hay)
+        
+        Con desde/hasta (ISO) se saltean las ventanas fuera del rango; en las que
+        lo cruzan se descartan los registros cuya "fecha" cae afuera.
+        """
+        manifiesto = self.manifiesto(endpoint)
+        if manifiesto is None:
+            return None
+        if not desde and not hasta:
+            return (json.loads(linea) for unidad in manifiesto["unidades"]
+                    for linea in self._leer_unidad(endpoint, unidad).splitlines())
+        return self._iterar_rango(endpoint, manifiesto["unidades"], desde, hasta)
+
+    def _iterar_rango(self, endpoint, unidades, desde, hasta):
+        desde, hasta = desde or "0000-00-00", hasta or "9999-99-99"
+        for unidad in unidades:
+            ventana = _rango_unidad(unidad["clave"])
+            if ventana and (ventana[1] < desde or ventana[0] > hasta):
+                continue
+            parcial = ventana is not None and (ventana[0] < desde or ventana[1] > hasta)
+            for linea in self._leer_unidad(endpoint, unidad).splitlines():
+                registro = json.loads(linea)
+                if parcial:
+                    fecha = str(registro.get("fecha") or "")[:10]
+                    if fecha and not desde <= fecha <= hasta:
+                        continue
+                yield registro
+
+    def cobertura(self, endpoint):
+        """(primer día, último día) de las ventanas archivadas del endpoint, o None"""
+        manifiesto = self.manifiesto(endpoint)
+        ventanas = [v for v in (_rango_unidad(u["clave"]) for u in (manifiesto or {}).get("unidades", [])) if v]
+        if not ventanas:
+            return None
+        return min(d for d, _ in ventanas), max(h for _, h in ventanas)
+
+    def _entradas_indice(self, endpoint, manifiesto):
+        ruta = self._ruta(endpoint, manifiesto.get("indice") or "")
+        if not manifiesto.get("indice") or not os.path.exists(ruta):
+            return
+        with open(ruta, "rb") as f:
+            contenido = f.read()
+        yield from _REGISTRO_INDICE.iter_unpack(contenido)
+
+    def buscar(self, endpoint, id_):
+        """Registro archivado con ese ID (búsqueda binaria sobre el índice mapeado), o None"""
+        manifiesto = self.manifiesto(endpoint)
+        if not manifiesto or not manifiesto.get("indice"):
+            return None
+        objetivo = IndiceClaves._hash(id_)
+        tam = _REGISTRO_INDICE.size
+        with open(self._ruta(endpoint, manifiesto["indice"]), "rb") as f:
+            if os.fstat(f.fileno()).st_size < tam:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as indice:
+                total = len(indice) // tam
+                bajo, alto = 0, total
+                while bajo < alto:
+                    medio = (bajo + alto) // 2
+                    if _REGISTRO_INDICE.unpack_from(indice, medio * tam)[0] < objetivo:
+                        bajo = medio + 1
+                    else:
+                        alto = medio
+                # Hashes iguales: se confirma contra el ID real por si hay colisión
+                while bajo < total:
+                    hash_id, unidad, linea = _REGISTRO_INDICE.unpack_from(indice, bajo * tam)
+                    if hash_id != objetivo:
+                        break
+                    lineas = self._leer_unidad(endpoint, manifiesto["unidades"][unidad]).splitlines()
+                    registro = json.loads(lineas[linea])
+                    if str(_id_registro(registro)) == str(id_):
+                        return registro
+                    bajo += 1
+        return None
+
+    def _limpiar(self, endpoint):
+        """Borra segmentos e índices que el manifiesto vigente ya no referencia"""
+        with self._lock:
+            manifiesto = self.manifiesto(endpoint) or {"unidades": []}
+            vigentes = {u["segmento"] for u in manifiesto["unidades"]} | {manifiesto.get("indice")}
+            directorio = self._ruta(endpoint)
+            if not os.path.isdir(directorio):
+                return
+            for nombre in os.listdir(directorio):
+                if nombre.endswith((".ndjson.gz", ".idx")) and nombre not in vigentes:
+                    try:
+                        os.remove(os.path.join(directorio, nombre))
+                    except OSError:
+                        pass
+
+_ARCHIVO = None
+
+def obtener_archivo():
+    """Archivo de respuestas crudas compartido, o None si está deshabilitado"""
+    global _ARCHIVO
+    if not CONFIG_ARCHIVO["HABILITADO"] and not CONFIG_ARCHIVO["OFFLINE"]:
+        return None
+    with _SESION_LOCK:
+        if _ARCHIVO is None:
+            _ARCHIVO = ArchivoCrudo(CONFIG_ARCHIVO["DIRECTORIO"])
+        return _ARCHIVO
+
+def escritor_archivo(endpoint_name):
+    """Escritor del archivo para una descarga, o un contexto vacío si no se archiva"""
+    archivo = obtener_archivo()
+    if archivo is None or CONFIG_ARCHIVO["OFFLINE"]:
+        return nullcontext()
+    return archivo.escritor(endpoint_name)
+
+def calcular_corte_incremental(hoy=None):
+    """Primer día desde el que se vuelve a descargar: mes abierto + MESES_LOOKBACK meses"""
+    hoy = hoy or datetime.now()
+    anio, mes = hoy.year, hoy.month - CONFIG_ALMACEN["MESES_LOOKBACK"]
+    while mes < 1:
+        mes += 12
+        anio -= 1
+    return datetime(anio, mes, 1)
+
+def periodo_configurado():
+    """(desde, hasta) para mostrar: el de la descarga o, offline, el filtro sobre el archivo"""
+    if CONFIG_ARCHIVO["OFFLINE"]:
+        return CONFIG_ARCHIVO["DESDE"] or "inicio del archivo", CONFIG_ARCHIVO["HASTA"] or "fin del archivo"
+    return CONFIG_FECHAS["FECHA_DESDE"], CONFIG_FECHAS["FECHA_HASTA"] or datetime.now().strftime("%Y-%m-%d")
+
+def fecha_hasta_configurada():
+    """CONFIG_FECHAS["FECHA_HASTA"] como datetime (None: hasta hoy)"""
+    if not CONFIG_FECHAS["FECHA_HASTA"]:
+        return None
+    return datetime.strptime(CONFIG_FECHAS["FECHA_HASTA"], "%Y-%m-%d")
+
+def generar_ventanas_mensuales(fecha_desde, end_date=None):
+    """Divide el período en ventanas (inicio, fin) de un mes calendario"""
     start_date = datetime.strptime(fecha_desde, "%Y-%m-%d")
-    end_date = datetime.now()
+    if end_date is None:
+        end_date = datetime.now()
     
+    ventanas = []
     current_date = start_date
     
     while current_date <= end_date:
@@ -80,122 +1601,561 @@ def get_data_monthly_chunks_only(token, endpoint_name, endpoint, fecha_desde=Non
         if month_end > end_date:
             month_end = end_date
         
-        month_start_str = current_date.strftime("%Y-%m-%d")
-        month_end_str = month_end.strftime("%Y-%m-%d")
-        
-        print(f"   📊 {current_date.strftime('%B %Y')}: {month_start_str} → {month_end_str}", end=" ")
-        
-        url = f"{BASE_URL}/{endpoint}"
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/json"
-        }
-        
-        params = {
-            "fechaDesde": month_start_str,
-            "fechaHasta": month_end_str
-        }
-        
-        try:
-            response = requests.get(url, headers=headers, params=params, timeout=90)
-            
-            if response.status_code == 200:
-                try:
-                    data = response.json()
-                    monthly_data = data if isinstance(data, list) else [data] if data else []
-                    
-                    if monthly_data:
-                        all_data.extend(monthly_data)
-                        print(f"→ ✅ {len(monthly_data)} registros")
-                    else:
-                        print(f"→ ⚪ Sin datos")
-                        
-                except json.JSONDecodeError:
-                    print(f"→ ⚠️ JSON inválido")
-            else:
-                print(f"→ ❌ Error {response.status_code}")
-                
-        except requests.exceptions.Timeout:
-            print(f"→ ⏰ Timeout")
-        except Exception as e:
-            print(f"→ ⚠️ Error: {e}")
-        
-        
+        ventanas.append((current_date, month_end))
         current_date = next_month
-        time.sleep(0.5)  
     
-    print(f"   🎯 Total {endpoint_name}: {len(all_data)} registros\n")
-    return all_data
+    return ventanas
 
-def get_data_simple_for_catalogs(token, endpoint_name, endpoint):
-    """Método simple para endpoints que no usan fechas (como clientes, cuentas)"""
-    print(f"📋 Descargando {endpoint_name} (catálogo sin fechas)")
+def _descargar_ventana(url, token, month_start_str, month_end_str, endpoint_name=None, reintentar_timeout=True):
+    """Descarga una ventana de fechas. Devuelve (registros, estado para consola, código)
     
-    url = f"{BASE_URL}/{endpoint}"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/json"
+    El código es el status HTTP, 504 si hubo timeout o 0 ante otros errores.
+    Con reintentar_timeout=False el primer timeout vuelve enseguida como 504,
+    para que el planificador parta la ventana en vez de esperar los reintentos.
+    """
+    import requests
+    params = {
+        "fechaDesde": month_start_str,
+        "fechaHasta": month_end_str
     }
     
     try:
-        response = requests.get(url, headers=headers, timeout=180)
+        response = solicitar_http("GET", url, "ventana", endpoint_name, token=token,
+                                  contexto=f"{month_start_str}..{month_end_str}",
+                                  reintentar_timeout=reintentar_timeout, params=params)
         
         if response.status_code == 200:
             try:
                 data = response.json()
-                result = data if isinstance(data, list) else [data] if data else []
-                print(f"   ✅ {len(result)} registros obtenidos\n")
-                return result
+                monthly_data = data if isinstance(data, list) else [data] if data else []
+                
+                if monthly_data:
+                    return monthly_data, f"→ ✅ {len(monthly_data)} registros", 200
+                return [], f"→ ⚪ Sin datos", 200
+                    
             except json.JSONDecodeError:
-                print(f"   ⚠️ JSON inválido\n")
-                return []
+                return [], f"→ ⚠️ JSON inválido", 0
         else:
-            print(f"   ❌ Error {response.status_code}\n")
-            return []
+            return [], f"→ ❌ Error {response.status_code}", response.status_code
             
+    except requests.exceptions.Timeout:
+        return [], f"→ ⏰ Timeout", 504
+    except CorridaInterrumpida:
+        raise
     except Exception as e:
-        print(f"   ❌ Error: {e}\n")
-        return []
+        return [], f"→ ⚠️ Error: {e}", 0
 
-def get_asientos_contables_con_detalle_mejorado(token, endpoint_name, endpoint):
-    """Método especial para asientos contables con diagnóstico automático del campo ID"""
-    print(f"📊 Descargando {endpoint_name} con detalle completo (DIAGNÓSTICO)")
+class PlanificadorVentanas:
+    """Partición adaptativa de ventanas de fechas para un endpoint
+    
+    Parte de ventanas mensuales y usa el historial de la corrida anterior
+    (registros por ventana) para fusionar meses ralos y dividir de antemano
+    los meses pesados. Durante la descarga, una ventana que da timeout/5xx o
+    que trae UMBRAL_DIVISION registros o más se parte en mitades, hasta
+    llegar a un día. La partición resultante se guarda como historial.
+    """
+
+    def __init__(self, endpoint, almacen=None, corte=None):
+        self.endpoint = endpoint
+        self.almacen = almacen
+        self.corte = corte
+        self.umbral_division = CONFIG_VENTANAS["UMBRAL_DIVISION"]
+        self.umbral_fusion = CONFIG_VENTANAS["UMBRAL_FUSION"]
+        self.max_meses_fusion = CONFIG_VENTANAS["MAX_MESES_FUSION"]
+        historial = almacen.obtener_historial(endpoint) if almacen else []
+        self.historial = [(datetime.strptime(d, "%Y-%m-%d"), datetime.strptime(h, "%Y-%m-%d"), n)
+                          for d, h, n in historial]
+
+    def _estimar(self, inicio, fin):
+        """(registros estimados, ventanas previas dentro del mes) o (None, []) sin historial"""
+        estimado = None
+        hojas = []
+        for h_inicio, h_fin, registros in self.historial:
+            if h_fin < inicio or h_inicio > fin:
+                continue
+            # Prorrateo por días cuando la ventana previa excede el mes
+            solapados = (min(fin, h_fin) - max(inicio, h_inicio)).days + 1
+            estimado = (estimado or 0) + registros * solapados / ((h_fin - h_inicio).days + 1)
+            if h_inicio >= inicio and h_fin <= fin:
+                hojas.append((h_inicio, h_fin))
+        return estimado, hojas
+
+    @staticmethod
+    def _cubre(hojas, inicio, fin):
+        """True si las ventanas (ordenadas) cubren exactamente [inicio, fin]"""
+        cursor = inicio
+        for h_inicio, h_fin in hojas:
+            if h_inicio != cursor:
+                return False
+            cursor = h_fin + timedelta(days=1)
+        return cursor == fin + timedelta(days=1)
+
+    def _cerrada(self, fin):
+        return self.corte is not None and fin < self.corte
+
+    @staticmethod
+    def _partir(inicio, fin, partes):
+        dias = (fin - inicio).days + 1
+        partes = max(1, min(partes, dias))
+        ventanas = []
+        for i in range(partes):
+            desde = inicio + timedelta(days=dias * i // partes)
+            hasta = inicio + timedelta(days=dias * (i + 1) // partes - 1)
+            ventanas.append((desde, hasta))
+        return ventanas
+
+    def planificar(self, fecha_desde, end_date=None):
+        """Devuelve la lista cronológica de ventanas (inicio, fin) a usar"""
+        meses = generar_ventanas_mensuales(fecha_desde, end_date)
+        if not CONFIG_VENTANAS["ADAPTATIVO"]:
+            return meses
+        
+        plan = []
+        grupo = []            # meses ralos consecutivos pendientes de fusionar
+        grupo_registros = 0
+        
+        def cerrar_grupo():
+            nonlocal grupo, grupo_registros
+            if grupo:
+                plan.append((grupo[0][0], grupo[-1][1]))
+            grupo, grupo_registros = [], 0
+        
+        for inicio, fin in meses:
+            estimado, hojas = self._estimar(inicio, fin)
+            
+            if estimado is not None and estimado <= self.umbral_fusion:
+                compatible = (not grupo or
+                              (self._cerrada(grupo[0][1]) == self._cerrada(fin) and
+                               len(grupo) < self.max_meses_fusion and
+                               grupo_registros + estimado <= self.umbral_fusion))
+                if not compatible:
+                    cerrar_grupo()
+                grupo.append((inicio, fin))
+                grupo_registros += estimado
+                continue
+            
+            cerrar_grupo()
+            if len(hojas) > 1 and self._cubre(hojas, inicio, fin):
+                # Se reutiliza la partición anterior: ya probó funcionar y
+                # coincide con lo guardado en el almacén
+                plan.extend(hojas)
+                continue
+            partes = 1
+            if estimado is not None:
+                partes = max(math.ceil(estimado / max(1, self.umbral_division // 2)), len(hojas))
+            plan.extend(self._partir(inicio, fin, partes))
+        
+        cerrar_grupo()
+        return plan
+
+    def descargar(self, inicio, fin, descargar_fn):
+        """Descarga [inicio, fin] dividiendo en mitades si hace falta
+        
+        descargar_fn(desde, hasta, divisible) -> (registros, estado, código);
+        `divisible` indica que un timeout se resuelve partiendo la ventana. Devuelve
+        (registros, estado, hojas) donde hojas son (desde, hasta, registros,
+        duración, código) de las ventanas efectivamente pedidas; `registros` de
+        cada hoja es su propia lista, para poder guardarlas por separado.
+        """
+        desde, hasta = inicio.strftime("%Y-%m-%d"), fin.strftime("%Y-%m-%d")
+        divisible = CONFIG_VENTANAS["ADAPTATIVO"] and inicio < fin
+        t0 = time.monotonic()
+        registros, estado, codigo = descargar_fn(desde, hasta, divisible)
+        duracion = time.monotonic() - t0
+        
+        dividir = (codigo == 504 or codigo >= 500 or
+                   (codigo == 200 and len(registros) >= self.umbral_division))
+        if not divisible or not dividir:
+            return registros, estado, [(desde, hasta, registros, duracion, codigo)]
+        
+        mitad = inicio + timedelta(days=(fin - inicio).days // 2)
+        todos, hojas = [], []
+        for sub_inicio, sub_fin in ((inicio, mitad), (mitad + timedelta(days=1), fin)):
+            sub_registros, _, sub_hojas = self.descargar(sub_inicio, sub_fin, descargar_fn)
+            todos.extend(sub_registros)
+            hojas.extend(sub_hojas)
+        
+        fallidas = sum(1 for hoja in hojas if hoja[4] != 200)
+        estado = f"→ ✂️ {len(todos)} registros en {len(hojas)} ventanas"
+        if fallidas:
+            estado += f" (⚠️ {fallidas} con error)"
+        return todos, estado, hojas
+
+    def registrar(self, inicio, fin, hojas):
+        """Guarda en el historial la partición usada para [inicio, fin]"""
+        if self.almacen and all(hoja[4] == 200 for hoja in hojas):
+            self.almacen.reemplazar_historial(
+                self.endpoint, inicio.strftime("%Y-%m-%d"), fin.strftime("%Y-%m-%d"),
+                [(d, h, len(registros), dur) for d, h, registros, dur, _ in hojas])
+
+def _etiqueta_ventana(inicio, fin):
+    """'Enero 2024' si es un mes calendario; si no, el rango"""
+    siguiente = (fin + timedelta(days=1))
+    if inicio.day == 1 and siguiente.day == 1 and (siguiente - inicio).days <= 31:
+        return inicio.strftime('%B %Y')
+    return f"{inicio.strftime('%d/%m/%Y')}–{fin.strftime('%d/%m/%Y')}"
+
+def get_data_monthly_chunks_only(token, endpoint_name, endpoint, fecha_desde=None, concurrente=None):
+    """MÉTODO ÚNICO: Obtiene datos dividiendo por meses (más efectivo y rápido)"""
+    return list(iterar_ventanas(token, endpoint_name, endpoint, fecha_desde, concurrente))
+
+def iterar_ventanas(token, endpoint_name, endpoint, fecha_desde=None, concurrente=None):
+    """Genera los registros de un endpoint con fechas, ventana por ventana
+    
+    Con concurrente=True (por defecto según CONFIG_CONCURRENCIA) las ventanas se
+    descargan en paralelo con un pool acotado; el resultado y el reporte por mes
+    se mantienen en orden cronológico. Solo hay VENTANAS_ANTICIPADAS ventanas
+    por worker en curso, así la memoria no crece con la cantidad de meses.
+    
+    Los meses cerrados anteriores a calcular_corte_incremental() se sirven desde
+    el almacén local si ya fueron descargados (salvo FULL_REFRESH).
+    
+    Las ventanas las arma PlanificadorVentanas: meses ralos se piden juntos y
+    los pesados (o los que dan timeout) se dividen.
+    
+    Cada ventana descargada sin errores queda en el diario de la corrida; al
+    reanudar se usa el plan de ventanas guardado y las que ya estaban se
+    sirven desde ahí. Si todas las ventanas
+    salen bien, la descarga completa queda también en el archivo crudo.
+    """
+    if fecha_desde is None:
+        fecha_desde = CONFIG_FECHAS["FECHA_DESDE"]
+    if concurrente is None:
+        concurrente = CONFIG_CONCURRENCIA["HABILITADO"]
+    max_workers = max(1, CONFIG_CONCURRENCIA["MAX_WORKERS"]) if concurrente else 1
+        
+    modo = f"{max_workers} en paralelo" if max_workers > 1 else "secuencial"
+    emitir(f"📅 Descargando {endpoint_name} por ventanas desde {fecha_desde} ({modo})")
+    
+    total = 0
+    almacen = obtener_almacen()
+    diario = obtener_diario()
+    corte = calcular_corte_incremental()
+    planificador = PlanificadorVentanas(endpoint, almacen, corte)
+    rango = f"{fecha_desde}..{CONFIG_FECHAS['FECHA_HASTA'] or ''}"
+    plan = diario.plan(endpoint_name, rango) if diario else None
+    if plan is not None:
+        ventanas = [(datetime.strptime(d, "%Y-%m-%d"), datetime.strptime(h, "%Y-%m-%d")) for d, h in plan]
+    else:
+        ventanas = planificador.planificar(fecha_desde, fecha_hasta_configurada())
+        if diario:
+            diario.guardar_plan(endpoint_name, rango, [(i.strftime("%Y-%m-%d"), f.strftime("%Y-%m-%d"))
+                                                       for i, f in ventanas])
     
     url = f"{BASE_URL}/{endpoint}"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/json"
-    }
     
+    def descargar(inicio, fin):
+        desde, hasta = inicio.strftime("%Y-%m-%d"), fin.strftime("%Y-%m-%d")
+        cerrada = fin < corte
+        clave = f"ventana:{desde}..{hasta}"
+        
+        if diario:
+            guardados = diario.obtener(endpoint_name, clave)
+            if guardados is not None:
+                return guardados, f"→ 📓 {len(guardados)} registros (diario)", "diario"
+        
+        if almacen and cerrada and not CONFIG_ALMACEN["FULL_REFRESH"]:
+            guardados = almacen.obtener_rango(endpoint, desde, hasta)
+            if guardados is not None:
+                return guardados, f"→ 💾 {len(guardados)} registros (local)", "almacen"
+        
+        monthly_data, estado, hojas = planificador.descargar(
+            inicio, fin, lambda d, h, divisible: _descargar_ventana(url, token, d, h, endpoint_name,
+                                                                   reintentar_timeout=not divisible))
+        planificador.registrar(inicio, fin, hojas)
+        if almacen and cerrada:
+            # Se guarda cada sub-ventana para poder servirlas con obtener_rango
+            for hoja_desde, hoja_hasta, hoja_registros, _, codigo in hojas:
+                if codigo == 200:
+                    almacen.guardar_ventana(endpoint, hoja_desde, hoja_hasta, hoja_registros)
+        completa = all(hoja[4] == 200 for hoja in hojas)
+        if diario:
+            if completa:
+                diario.guardar(endpoint_name, clave, monthly_data)
+            else:
+                diario.registrar_fallo(endpoint_name, clave, estado)
+        return monthly_data, estado, "api" if completa else "fallo"
+    
+    anticipo = max_workers * max(1, CONFIG_PIPELINE["VENTANAS_ANTICIPADAS"])
+    with escritor_archivo(endpoint_name) as archivo, ThreadPoolExecutor(max_workers=max_workers) as pool:
+        en_curso = deque()
+        pendientes = iter(ventanas)
+        
+        # Se recorren en el orden de envío: cronológico aunque terminen desordenados
+        while True:
+            for inicio, fin in pendientes:
+                en_curso.append((inicio, fin, pool.submit(descargar, inicio, fin)))
+                if len(en_curso) >= anticipo:
+                    break
+            if not en_curso:
+                break
+            inicio, fin, futuro = en_curso.popleft()
+            monthly_data, estado, origen = futuro.result()
+            emitir(f"   📊 {_etiqueta_ventana(inicio, fin)}: {inicio.strftime('%Y-%m-%d')} → {fin.strftime('%Y-%m-%d')} {estado}")
+            if archivo:
+                if origen == "fallo":
+                    archivo.fallo()
+                else:
+                    archivo.registrar(f"ventana:{inicio.strftime('%Y-%m-%d')}..{fin.strftime('%Y-%m-%d')}",
+                                      monthly_data, reutilizable=origen != "api")
+            total += len(monthly_data)
+            yield from monthly_data
+            del monthly_data
+    
+    emitir(f"   🎯 Total {endpoint_name}: {total} registros\n")
+
+_DECODIFICADOR_JSON = json.JSONDecoder()
+_ESPACIOS_JSON = " \t\n\r"
+_DELIMITADORES_JSON = _ESPACIOS_JSON + ",]"
+
+def iterar_json_array(response, tam_bloque=None):
+    """Genera los elementos de un array JSON a medida que llegan del stream
+    
+    Lee el cuerpo por bloques y decodifica cada elemento con raw_decode, así la
+    memoria pico depende de un registro y no del payload entero. Si la respuesta
+    no es un array se comporta como `[data] if data else []`.
+    """
+    tam_bloque = tam_bloque or CONFIG_STREAMING["TAM_BLOQUE"]
+    decodificador = codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+    bloques = response.iter_content(chunk_size=tam_bloque)
+    buffer = ""
+    pos = 0
+    fin_stream = False
+    
+    def leer():
+        nonlocal buffer, pos, fin_stream
+        # Descarta lo ya consumido para que el buffer no crezca
+        buffer = buffer[pos:]
+        pos = 0
+        for bloque in bloques:
+            texto = decodificador.decode(bloque)
+            if texto:
+                buffer += texto
+                return True
+        buffer += decodificador.decode(b"", final=True)
+        fin_stream = True
+        return False
     
-    print(f"   🔄 Paso 1: Obteniendo cabeceras de asientos", end=" ")
+    def saltar_espacios():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in _ESPACIOS_JSON:
+                pos += 1
+            if pos < len(buffer) or fin_stream or not leer():
+                return
     
     try:
-        response = requests.get(url, headers=headers, timeout=120)
+        saltar_espacios()
+        if pos >= len(buffer):
+            return
         
-        if response.status_code != 200:
-            print(f"→ ❌ Error {response.status_code}")
-            return []
+        if buffer[pos] != "[":
+            # No es un array: se parsea entero como antes
+            while leer():
+                pass
+            data = json.loads(buffer[pos:])
+            if data:
+                yield data
+            return
+        pos += 1
+        
+        primero = True
+        while True:
+            saltar_espacios()
+            if pos >= len(buffer):
+                raise json.JSONDecodeError("Array JSON incompleto", buffer, pos)
+            if buffer[pos] == "]":
+                return
+            if not primero:
+                if buffer[pos] != ",":
+                    raise json.JSONDecodeError("Se esperaba ','", buffer, pos)
+                pos += 1
+                saltar_espacios()
+            primero = False
             
-        try:
+            while True:
+                try:
+                    elemento, fin = _DECODIFICADOR_JSON.raw_decode(buffer, pos)
+                    # Un número al final del buffer puede estar cortado ("1.5" de
+                    # "1.5e3"): se exige ver un delimitador antes de aceptarlo
+                    if fin_stream or (fin < len(buffer) and buffer[fin] in _DELIMITADORES_JSON):
+                        break
+                except json.JSONDecodeError:
+                    if fin_stream:
+                        raise
+                if not leer() and fin_stream and pos >= len(buffer):
+                    raise json.JSONDecodeError("Array JSON incompleto", buffer, pos)
+            pos = fin
+            yield elemento
+    finally:
+        response.close()
+
+def iterar_catalogo(token, endpoint_name, endpoint):
+    """Genera los registros de un catálogo sin fechas a medida que se descargan
+    
+    Lanza HTTPError si el status no es 200 y JSONDecodeError si el cuerpo es inválido.
+    Un catálogo completo queda en el diario de la corrida (al reanudar se sirve
+    desde ahí) y en el archivo crudo.
+    """
+    with escritor_archivo(endpoint_name) as archivo:
+        yield from _iterar_catalogo_api(token, endpoint_name, endpoint, archivo)
+
+_CATALOGOS_SIN_CAMBIOS = {}   # {endpoint: "304" | "huella"} de la corrida en curso, para el resumen
+
+def _iterar_catalogo_api(token, endpoint_name, endpoint, archivo):
+    """Catálogo desde la API con detección de cambios
+    
+    Si la corrida anterior guardó validadores (ETag/Last-Modified) el GET es
+    condicional y un 304 se sirve desde el almacén sin bajar el cuerpo. Si la
+    API no los manda, se compara la huella del contenido con la anterior: sin
+    cambios, la unidad del archivo crudo se reutiliza en lugar de reescribirse.
+    
+    Los registros solo se retienen en memoria si la respuesta trae validadores
+    (hay que guardarlos para servir el próximo 304); si no, se archivan a
+    medida que llegan y la huella se calcula en la misma pasada.
+    """
+    import requests
+    diario = obtener_diario()
+    if diario:
+        guardados = diario.obtener(endpoint_name, "catalogo")
+        if guardados is not None:
+            emitir(f"   📓 {len(guardados)} registros desde el diario")
+            if archivo:
+                archivo.registrar("catalogo", guardados, reutilizable=True)
+            yield from guardados
+            return
+    
+    url = f"{BASE_URL}/{endpoint}"
+    almacen = obtener_almacen() if CONFIG_ALMACEN["CATALOGOS_CONDICIONALES"] else None
+    previo = almacen.obtener_catalogo(endpoint_name) if almacen else None
+    headers = {}
+    if previo and previo["con_registros"] and not CONFIG_ALMACEN["FULL_REFRESH"]:
+        if previo["etag"]:
+            headers["If-None-Match"] = previo["etag"]
+        if previo["last_modified"]:
+            headers["If-Modified-Since"] = previo["last_modified"]
+    unidad = diario.unidad(endpoint_name, "catalogo") if diario else None
+    crudo = None
+    contenido = hashlib.sha1() if almacen else None
+    retenidos = None
+    cantidad = 0
+    
+    try:
+        response = solicitar_http("GET", url, "catalogo", endpoint_name, token=token, stream=True,
+                                  headers=headers)
+        if response.status_code == 304 and headers:
+            response.close()
+            guardados = almacen.obtener_registros_catalogo(endpoint_name)
+            _CATALOGOS_SIN_CAMBIOS[endpoint_name] = "304"
+            emitir(f"   ⏭️ Sin cambios (304): {len(guardados)} registros desde {almacen.ruta}")
+            if diario:
+                diario.guardar(endpoint_name, "catalogo", guardados)
+            if archivo:
+                archivo.registrar("catalogo", guardados, reutilizable=True)
+            yield from guardados
+            return
+        if response.status_code != 200:
+            response.close()
+            raise requests.exceptions.HTTPError(f"Error {response.status_code}", response=response)
+        etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+        if almacen and (etag or last_modified):
+            retenidos = []
+        if archivo:
+            crudo = archivo.unidad("catalogo")
+        
+        if CONFIG_STREAMING["JSON_INCREMENTAL"]:
+            registros = iterar_json_array(response)
+        else:
             data = response.json()
-            cabeceras = data if isinstance(data, list) else [data] if data else []
-            print(f"→ ✅ {len(cabeceras)} cabeceras obtenidas")
-            
-            if not cabeceras:
-                print(f"   ⚪ No hay asientos para procesar\n")
-                return []
-                
-        except json.JSONDecodeError:
-            print(f"→ ⚠️ JSON inválido")
-            return []
-            
+            registros = data if isinstance(data, list) else [data] if data else []
+        for registro in registros:
+            if unidad:
+                unidad.agregar(registro)
+            if crudo:
+                crudo.agregar(registro)
+            if contenido:
+                contenido.update(json.dumps(registro, sort_keys=True, ensure_ascii=False,
+                                            default=str).encode("utf-8"))
+            if retenidos is not None:
+                retenidos.append(registro)
+            cantidad += 1
+            yield registro
+    except Exception as e:
+        if diario:
+            diario.registrar_fallo(endpoint_name, "catalogo", str(e))
+        raise
+    if unidad:
+        unidad.confirmar()
+    huella = contenido.hexdigest() if almacen else None
+    sin_cambios = previo is not None and previo["huella"] == huella
+    if crudo:
+        crudo.confirmar(reutilizable=sin_cambios)
+    if sin_cambios:
+        _CATALOGOS_SIN_CAMBIOS[endpoint_name] = "huella"
+        emitir(f"   ⏭️ Sin cambios: misma huella que la corrida anterior")
+    if almacen and (not sin_cambios or (etag, last_modified) != (previo["etag"], previo["last_modified"])
+                    or (retenidos is not None and not previo["con_registros"])):
+        almacen.guardar_catalogo(endpoint_name, etag, last_modified, huella, cantidad, retenidos)
+
+def get_data_simple_for_catalogs(token, endpoint_name, endpoint):
+    """Método simple para endpoints que no usan fechas (como clientes, cuentas)"""
+    import requests
+    emitir(f"📋 Descargando {endpoint_name} (catálogo sin fechas)")
+    
+    try:
+        result = list(iterar_catalogo(token, endpoint_name, endpoint))
+        emitir(f"   ✅ {len(result)} registros obtenidos\n")
+        return result
+    except json.JSONDecodeError:
+        emitir(f"   ⚠️ JSON inválido\n", NIVEL_ERROR)
+        return []
+    except requests.exceptions.HTTPError as e:
+        emitir(f"   ❌ Error {e.response.status_code}\n", NIVEL_ERROR)
+        return []
     except Exception as e:
-        print(f"→ ❌ Error: {e}")
+        emitir(f"   ❌ Error: {e}\n", NIVEL_ERROR)
         return []
+
+def huella_registro(registro):
+    """Huella de contenido de un registro (para detectar cabeceras modificadas)"""
+    contenido = json.dumps(registro, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(contenido.encode("utf-8")).hexdigest()
+
+def _descargar_detalle_asiento(endpoint_name, endpoint, token, asiento, id_field):
+    """Descarga el detalle de un asiento. Devuelve (registro, exito, mensaje de error)
+    
+    Si el detalle no se puede obtener se devuelve la cabecera (fallback original).
+    """
+    import requests
+    transaccion_id = asiento.get(id_field)
+    
+    if not transaccion_id:
+        return asiento, False, None
+    
+    detalle_url = f"{BASE_URL}/{endpoint}/{transaccion_id}"
+    
+    try:
+        detalle_response = solicitar_http("GET", detalle_url, "detalle", endpoint_name, token=token,
+                                          contexto=str(transaccion_id))
+    except requests.exceptions.Timeout:
+        return asiento, False, None
+    except CorridaInterrumpida:
+        raise
+    except Exception as e:
+        return asiento, False, f"⚠️  Error para ID '{transaccion_id}': {str(e)[:50]}..."
+    
+    if detalle_response.status_code == 200:
+        try:
+            return detalle_response.json(), True, None
+        except json.JSONDecodeError:
+            return asiento, False, None
     
+    return asiento, False, f"❌ Error {detalle_response.status_code} para ID '{transaccion_id}'"
+
+def _diagnosticar_campo_id(cabeceras):
+    """Analiza las primeras cabeceras y elige el campo ID para pedir el detalle (o None)"""
     # DIAGNÓSTICO: Analizar estructura de los primeros asientos
-    print(f"   🔍 DIAGNÓSTICO: Analizando estructura de los asientos...")
+    emitir(f"   🔍 DIAGNÓSTICO: Analizando estructura de los asientos...")
     
     campos_por_frecuencia = {}
     posibles_ids = []
@@ -205,7 +2165,7 @@ def get_asientos_contables_con_detalle_mejorado(token, endpoint_name, endpoint):
     
     for i, asiento in enumerate(muestra):
         if isinstance(asiento, dict):
-            print(f"      📋 Asiento {i+1} - Campos disponibles:")
+            emitir(f"      📋 Asiento {i+1} - Campos disponibles:", NIVEL_DETALLE)
             for campo, valor in asiento.items():
                 
                 if campo not in campos_por_frecuencia:
@@ -214,7 +2174,7 @@ def get_asientos_contables_con_detalle_mejorado(token, endpoint_name, endpoint):
                 
                 
                 valor_str = str(valor)[:50] + "..." if len(str(valor)) > 50 else str(valor)
-                print(f"         • {campo}: {valor_str}")
+                emitir(f"         • {campo}: {valor_str}", NIVEL_DETALLE)
                 
                 
                 if ('id' in campo.lower() or 
@@ -223,21 +2183,21 @@ def get_asientos_contables_con_detalle_mejorado(token, endpoint_name, endpoint):
                     'transaccion' in campo.lower()):
                     if campo not in posibles_ids:
                         posibles_ids.append(campo)
-            print()
+            emitir("", NIVEL_DETALLE)
     
-    print(f"   🎯 CAMPOS IDENTIFICADOS COMO POSIBLES IDs:")
+    emitir(f"   🎯 CAMPOS IDENTIFICADOS COMO POSIBLES IDs:")
     if posibles_ids:
         for campo in posibles_ids:
             frecuencia = campos_por_frecuencia.get(campo, 0)
-            print(f"      • {campo} (presente en {frecuencia}/{len(muestra)} asientos)")
+            emitir(f"      • {campo} (presente en {frecuencia}/{len(muestra)} asientos)")
     else:
-        print(f"      ⚠️  No se encontraron campos ID obvios")
-        print(f"      📝 Campos más comunes:")
+        emitir(f"      ⚠️  No se encontraron campos ID obvios")
+        emitir(f"      📝 Campos más comunes:")
         campos_ordenados = sorted(campos_por_frecuencia.items(), 
                                 key=lambda x: x[1], 
                                 reverse=True)[:10]
         for campo, freq in campos_ordenados:
-            print(f"         • {campo}: {freq}/{len(muestra)}")
+            emitir(f"         • {campo}: {freq}/{len(muestra)}")
     
    
     id_field = None
@@ -266,137 +2226,799 @@ def get_asientos_contables_con_detalle_mejorado(token, endpoint_name, endpoint):
     if not id_field and posibles_ids:
         id_field = posibles_ids[0]
     
+    return id_field
+
+def _descargar_cabeceras(url, token, endpoint_name):
+    """Listado completo de cabeceras de asientos, o None si falló (el error ya se informó)"""
+    inicio_cabeceras = time.perf_counter()
+    try:
+        response = solicitar_http("GET", url, "cabeceras", endpoint_name, token=token,
+                                  stream=CONFIG_STREAMING["JSON_INCREMENTAL"])
+        
+        if response.status_code != 200:
+            emitir(f"      → ❌ Error {response.status_code}", NIVEL_ERROR)
+            return None
+            
+        try:
+            if CONFIG_STREAMING["JSON_INCREMENTAL"]:
+                cabeceras = list(iterar_json_array(response))
+            else:
+                data = response.json()
+                cabeceras = data if isinstance(data, list) else [data] if data else []
+        except json.JSONDecodeError:
+            emitir(f"      → ⚠️ JSON inválido", NIVEL_ERROR)
+            return None
+            
+    except CorridaInterrumpida:
+        raise
+    except Exception as e:
+        emitir(f"      → ❌ Error: {e}", NIVEL_ERROR)
+        return None
+    
+    emitir(f"      → ✅ {len(cabeceras)} cabeceras obtenidas")
+    obtener_metricas().registrar_etapa("asientos.cabeceras", time.perf_counter() - inicio_cabeceras,
+                                       endpoint=endpoint_name, registros=len(cabeceras))
+    return cabeceras
+
+def get_asientos_contables_con_detalle_mejorado(token, endpoint_name, endpoint):
+    """Método especial para asientos contables con diagnóstico automático del campo ID"""
+    return list(iterar_asientos_con_detalle(token, endpoint_name, endpoint))
+
+def iterar_asientos_con_detalle(token, endpoint_name, endpoint):
+    """Genera los asientos con su detalle, en el orden de las cabeceras
+    
+    Las cabeceras se bajan completas (hacen falta para elegir el campo ID), pero
+    el detalle se resuelve por bloques de BLOQUE_DETALLE: caché local, descarga
+    en paralelo de lo que falta, y el bloque se entrega y se libera.
+    
+    Las cabeceras y cada bloque sin errores quedan en el diario de la corrida;
+    los bloques, además, en el archivo crudo.
+    """
+    with escritor_archivo(endpoint_name) as archivo:
+        yield from _iterar_asientos(token, endpoint_name, endpoint, archivo)
+
+def _iterar_asientos(token, endpoint_name, endpoint, archivo):
+    emitir(f"📊 Descargando {endpoint_name} con detalle completo (DIAGNÓSTICO)")
+    
+    url = f"{BASE_URL}/{endpoint}"
+    
+    
+    emitir(f"   🔄 Paso 1: Obteniendo cabeceras de asientos")
+    
+    diario = obtener_diario()
+    cabeceras = diario.obtener(endpoint_name, "cabeceras") if diario else None
+    if cabeceras is not None:
+        emitir(f"      → 📓 {len(cabeceras)} cabeceras desde el diario")
+    else:
+        cabeceras = _descargar_cabeceras(url, token, endpoint_name)
+        if cabeceras is None:
+            if diario:
+                diario.registrar_fallo(endpoint_name, "cabeceras")
+            if archivo:
+                archivo.fallo()
+            return
+        if diario:
+            diario.guardar(endpoint_name, "cabeceras", cabeceras)
+    
+    if not cabeceras:
+        emitir(f"   ⚪ No hay asientos para procesar\n")
+        return
+    
+    # El campo ID se reutiliza del registro de esquemas mientras los campos no cambien
+    registro_esquemas = obtener_registro_esquemas()
+    id_field = registro_esquemas.id_field(endpoint_name, cabeceras)
+    if id_field:
+        emitir(f"   🧭 Campos sin cambios desde la última corrida: se omite el diagnóstico")
+    else:
+        id_field = _diagnosticar_campo_id(cabeceras)
+        if id_field:
+            registro_esquemas.guardar_id_field(endpoint_name, cabeceras, id_field)
+    
     if id_field:
-        print(f"   ✅ CAMPO ID SELECCIONADO: '{id_field}'")
+        emitir(f"   ✅ CAMPO ID SELECCIONADO: '{id_field}'")
     else:
-        print(f"   ⚠️  NO SE PUDO IDENTIFICAR CAMPO ID")
-        print(f"      💡 Continuando solo con cabeceras...")
-        print(f"   🎯 Total {endpoint_name}: {len(cabeceras)} registros (solo cabeceras)\n")
-        return cabeceras
+        emitir(f"   ⚠️  NO SE PUDO IDENTIFICAR CAMPO ID")
+        emitir(f"      💡 Continuando solo con cabeceras...")
+        emitir(f"   🎯 Total {endpoint_name}: {len(cabeceras)} registros (solo cabeceras)\n")
+        if archivo:
+            archivo.registrar("cabeceras", cabeceras)
+        yield from cabeceras
+        return
     
     # Paso 2: Obtener el detalle de cada asiento usando el campo ID identificado
-    print(f"   🔄 Paso 2: Obteniendo detalle usando campo '{id_field}'...")
-    asientos_completos = []
-    exitosos = 0
-    errores = 0
+    emitir(f"   🔄 Paso 2: Obteniendo detalle usando campo '{id_field}'...")
     
-    for i, asiento in enumerate(cabeceras, 1):
-        
+    # Caché de detalles: solo se piden IDs nuevos o cabeceras cuya huella cambió.
+    # Acá solo se leen las huellas; los payloads se traen bloque por bloque
+    almacen = obtener_almacen()
+    guardadas = almacen.obtener_huellas_detalles(endpoint) if almacen and not CONFIG_ALMACEN["FULL_REFRESH"] else {}
+    tam_bloque = max(1, CONFIG_PIPELINE["BLOQUE_DETALLE"])
+    
+    def clave_bloque(inicio):
+        return f"detalle:{inicio}+{min(tam_bloque, len(cabeceras) - inicio)}"
+    
+    # Bloques ya resueltos en la corrida que se reanuda
+    en_diario = set()
+    if diario:
+        en_diario = {inicio for inicio in range(0, len(cabeceras), tam_bloque)
+                     if diario.contiene(endpoint_name, clave_bloque(inicio))}
+    desde_diario = sum(min(tam_bloque, len(cabeceras) - inicio) for inicio in en_diario)
+    
+    huellas = [huella_registro(asiento) for asiento in cabeceras]
+    en_cache = set()
+    for i, asiento in enumerate(cabeceras):
         transaccion_id = asiento.get(id_field)
+        if transaccion_id and guardadas.get(str(transaccion_id)) == huellas[i] \
+                and i - i % tam_bloque not in en_diario:
+            en_cache.add(i)
+    del guardadas
+    
+    if desde_diario:
+        emitir(f"      📓 {desde_diario} asientos desde el diario ({len(en_diario)} bloques)")
+    if en_cache:
+        emitir(f"      💾 {len(en_cache)} detalles desde caché local, "
+               f"{len(cabeceras) - desde_diario - len(en_cache)} a descargar")
+    
+    progreso = ContadorProgreso(len(cabeceras) - desde_diario - len(en_cache))
+    max_workers = max(1, CONFIG_CONCURRENCIA["MAX_WORKERS_DETALLE"]) if CONFIG_CONCURRENCIA["HABILITADO"] else 1
+    desde_cache = 0
+    segundos_detalle = 0.0
+    
+    def procesar(i):
+        registro, exito, mensaje = _descargar_detalle_asiento(
+            endpoint_name, endpoint, token, cabeceras[i], id_field)
+        progreso.avanzar(exito, mensaje)
+        return registro, exito
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for inicio in range(0, len(cabeceras), tam_bloque):
+            if inicio in en_diario:
+                guardados = diario.obtener(endpoint_name, clave_bloque(inicio))
+                if archivo:
+                    archivo.registrar(clave_bloque(inicio), guardados, reutilizable=True)
+                yield from guardados
+                continue
+            bloque = range(inicio, min(inicio + tam_bloque, len(cabeceras)))
+            resueltos = {}
+            usados = []
+            
+            cacheados = {str(cabeceras[i].get(id_field)): i for i in bloque if i in en_cache}
+            if cacheados:
+                for id_, (huella, payload) in almacen.obtener_detalles(endpoint, list(cacheados)).items():
+                    i = cacheados[id_]
+                    if huella == huellas[i]:
+                        resueltos[i] = AlmacenLocal._descomprimir(payload)
+                        usados.append(id_)
+            
+            # Lo que no estaba (o se desalojó entre medio) se descarga
+            pendientes = [i for i in bloque if i not in resueltos]
+            nuevos = []
+            fallidos = 0
+            inicio_bloque = time.perf_counter()
+            # Cada resultado va a la posición de su cabecera: se conserva el orden
+            for i, (registro, exito) in zip(pendientes, pool.map(procesar, pendientes)):
+                resueltos[i] = registro
+                if exito:
+                    nuevos.append((cabeceras[i].get(id_field), huellas[i], registro))
+                elif cabeceras[i].get(id_field):
+                    fallidos += 1
+            segundos_detalle += time.perf_counter() - inicio_bloque
+            
+            # Un bloque con detalles fallidos no se da por terminado: --resume lo reintenta
+            if diario:
+                if fallidos:
+                    diario.registrar_fallo(endpoint_name, clave_bloque(inicio), f"{fallidos} detalles")
+                else:
+                    diario.guardar(endpoint_name, clave_bloque(inicio), [resueltos[i] for i in bloque])
+            if archivo:
+                if fallidos:
+                    archivo.fallo()
+                else:
+                    archivo.registrar(clave_bloque(inicio), [resueltos[i] for i in bloque])
+            
+            if almacen:
+                almacen.guardar_detalles(endpoint, nuevos)
+                almacen.marcar_detalles_usados(endpoint, usados)
+            desde_cache += len(usados)
+            del nuevos
+            
+            for i in bloque:
+                yield resueltos[i]
+    
+    obtener_metricas().registrar_etapa("asientos.detalle", segundos_detalle, endpoint=endpoint_name,
+                                       registros=len(cabeceras) - desde_cache - desde_diario)
+    if almacen:
+        podados = almacen.podar_detalles(CONFIG_ALMACEN["DETALLE_MAX_ENTRADAS"],
+                                         CONFIG_ALMACEN["DETALLE_MAX_DIAS"])
+        if podados:
+            emitir(f"      🧹 {podados} detalles desalojados de la caché")
+    
+    exitosos = progreso.exitosos + desde_cache + desde_diario
+    errores = progreso.errores
+    
+    emitir(f"   ✅ Procesamiento completado:")
+    emitir(f"      • Total asientos: {len(cabeceras)}")
+    emitir(f"      • Con detalle completo: {exitosos} ({desde_cache} desde caché, {desde_diario} desde el diario)")
+    emitir(f"      • Solo cabeceras: {errores}")
+    emitir(f"      • Campo ID usado: '{id_field}'")
+    emitir(f"      • Velocidad: {progreso.velocidad():.1f} reg/s")
+    emitir(f"   🎯 Total {endpoint_name}: {len(cabeceras)} registros\n")
+
+def get_asientos_contables_debug_solo(token, endpoint_name, endpoint):
+    """Versión de debugging que SOLO muestra la estructura sin procesar detalles"""
+    emitir(f"🐛 DEBUG: Analizando estructura de {endpoint_name}")
+    
+    url = f"{BASE_URL}/{endpoint}"
+    
+    try:
+        response = solicitar_http("GET", url, "debug", endpoint_name, token=token)
         
-        if not transaccion_id:
-            asientos_completos.append(asiento)
-            errores += 1
-            continue
+        if response.status_code != 200:
+            emitir(f"❌ Error {response.status_code}", NIVEL_ERROR)
+            return []
+            
+        data = response.json()
+        cabeceras = data if isinstance(data, list) else [data] if data else []
         
+        if not cabeceras:
+            emitir(f"⚪ No hay datos")
+            return []
         
-        detalle_url = f"{BASE_URL}/{endpoint}/{transaccion_id}"
+        emitir(f"✅ {len(cabeceras)} registros obtenidos")
+        emitir(f"\n📋 ESTRUCTURA DEL PRIMER ASIENTO:")
+        emitir("-" * 50)
         
-        try:
-            detalle_response = requests.get(detalle_url, headers=headers, timeout=30)
-            
-            if detalle_response.status_code == 200:
-                try:
-                    detalle = detalle_response.json()
-                    
-                    asientos_completos.append(detalle)
-                    exitosos += 1
-                    
-                    if i % 50 == 0:  
-                        print(f"      [{i}/{len(cabeceras)}] ✅ {exitosos} exitosos, {errores} errores")
-                        
-                except json.JSONDecodeError:
-                    asientos_completos.append(asiento)
-                    errores += 1
-            else:
-                
-                if errores < 3:
-                    print(f"      [{i}/{len(cabeceras)}] ❌ Error {detalle_response.status_code} para ID '{transaccion_id}'")
-                asientos_completos.append(asiento)
-                errores += 1
-                
-        except requests.exceptions.Timeout:
-            asientos_completos.append(asiento)
-            errores += 1
-        except Exception as e:
-            if errores < 3:  
-                print(f"      [{i}/{len(cabeceras)}] ⚠️  Error para ID '{transaccion_id}': {str(e)[:50]}...")
-            asientos_completos.append(asiento)
-            errores += 1
+        primer_asiento = cabeceras[0]
+        if isinstance(primer_asiento, dict):
+            for campo, valor in primer_asiento.items():
+                tipo = type(valor).__name__
+                valor_preview = str(valor)[:100] + "..." if len(str(valor)) > 100 else str(valor)
+                emitir(f"• {campo:<25} ({tipo:<10}): {valor_preview}")
+        
+        
+        emitir(f"\n📄 JSON COMPLETO DEL PRIMER ASIENTO:")
+        emitir("-" * 50)
+        emitir(json.dumps(primer_asiento, indent=2, ensure_ascii=False)[:2000] + "...")
         
+        return cabeceras[:10]  
+        
+    except Exception as e:
+        emitir(f"❌ Error: {e}", NIVEL_ERROR)
+        return []
+
+def aplanar_item_final(item):
+    """Convierte cualquier diccionario, lista u objeto anidado a string."""
+    if isinstance(item, dict):
+        return {k: aplanar_item_final(v) for k, v in item.items()}
+    elif isinstance(item, list):
+        return json.dumps([aplanar_item_final(x) for x in item], ensure_ascii=False)
+    elif isinstance(item, (int, float, str, bool)) or item is None:
+        return item
+    else:
+        return str(item)
+
+_VACIO = {}
+
+def _celda(valor):
+    """Valor de una columna sin tipo fijo: objetos y listas como JSON"""
+    if valor.__class__ is dict or valor.__class__ is list:
+        return json.dumps(valor, ensure_ascii=False, default=str)
+    if valor is None or isinstance(valor, (int, float, str, bool)):
+        return valor
+    return str(valor)
+
+def _muestra(registros, tamano):
+    """Hasta `tamano` registros repartidos a lo largo de toda la lista"""
+    if len(registros) <= tamano:
+        return registros
+    paso = len(registros) / tamano
+    return [registros[int(i * paso)] for i in range(tamano)]
+
+def inferir_esquema(registros, profundidad_maxima=None, tablas_hijas=None):
+    """Forma de un conjunto de registros: {campo: tipo}, anidado para objetos
+
+    Tipos: "escalar", "json" (listas u objetos muy profundos), "mixto" (tipos
+    distintos según el registro, o siempre nulo), "hija" (array de objetos que
+    va a una tabla aparte) o un dict con el esquema del objeto anidado.
+    """
+    if profundidad_maxima is None:
+        profundidad_maxima = CONFIG_ESQUEMA["PROFUNDIDAD_MAXIMA"]
+    if tablas_hijas is None:
+        tablas_hijas = CONFIG_ESQUEMA["TABLAS_HIJAS"]
+
+    def fusionar(esquema, registro, profundidad):
+        for clave, valor in registro.items():
+            previo = esquema.get(clave)
+            if valor is None:
+                esquema.setdefault(clave, "nulo")
+            elif isinstance(valor, dict):
+                if valor and profundidad < profundidad_maxima and (previo is None or previo == "nulo"
+                                                                    or isinstance(previo, dict)):
+                    sub = previo if isinstance(previo, dict) else {}
+                    esquema[clave] = sub
+                    fusionar(sub, valor, profundidad + 1)
+                elif previo is None or previo == "nulo":
+                    esquema[clave] = "json"
+                elif previo == "escalar":
+                    esquema[clave] = "mixto"
+            elif isinstance(valor, list):
+                es_hija = (profundidad == 1 and clave in tablas_hijas
+                           and all(isinstance(x, dict) for x in valor))
+                tipo = "hija" if es_hija else "json"
+                if previo is None or previo == "nulo":
+                    esquema[clave] = tipo
+                elif previo != tipo:
+                    esquema[clave] = "json" if previo in ("hija", "json") else "mixto"
+            else:
+                if previo is None or previo == "nulo":
+                    esquema[clave] = "escalar"
+                elif previo != "escalar":
+                    esquema[clave] = "mixto"
+
+    def cerrar(esquema):
+        for clave, tipo in esquema.items():
+            if tipo == "nulo":
+                esquema[clave] = "mixto"
+            elif isinstance(tipo, dict):
+                cerrar(tipo)
+        return esquema
+
+    esquema = {}
+    for registro in registros:
+        if isinstance(registro, dict):
+            fusionar(esquema, registro, 1)
+    return cerrar(esquema)
+
+def _compilar_extractor(nombre, esquema):
+    """Genera una función extraer(registro, faltante) -> tupla para el esquema
+
+    Cada objeto anidado se resuelve una vez por registro y cada columna es un
+    .get() directo: no hay recursión ni chequeo de tipos por valor, salvo en
+    las columnas "json"/"mixto". Devuelve (función, columnas, campos hijos).
+    """
+    lineas = ["def extraer(r, F):"]
+    salidas = []
+    columnas = []
+    hijas = []
+    variables = iter(range(1, 1_000_000))
+
+    def generar(nodo, variable, prefijo):
+        for clave, tipo in nodo.items():
+            columna = ".".join(prefijo + (clave,))
+            if isinstance(tipo, dict):
+                sub = f"n{next(variables)}"
+                lineas.append(f"    {sub} = {variable}.get({clave!r}, _VACIO)")
+                lineas.append(f"    if {sub}.__class__ is not dict: {sub} = _VACIO")
+                generar(tipo, sub, prefijo + (clave,))
+            elif tipo == "hija":
+                hijas.append(clave)
+            elif tipo == "escalar":
+                salidas.append(f"{variable}.get({clave!r}, F)")
+                columnas.append(columna)
+            else:
+                salidas.append(f"_celda({variable}.get({clave!r}, F))")
+                columnas.append(columna)
+
+    generar(esquema, "r", ())
+    lineas.append(f"    return ({', '.join(salidas)}{',' if salidas else ''})")
+    espacio = {"_VACIO": _VACIO, "_celda": _celda}
+    exec(compile("\n".join(lineas), f"<esquema {nombre}>", "exec"), espacio)
+    return espacio["extraer"], columnas, hijas
+
+class EsquemaCompilado:
+    """Esquema de un endpoint con su extractor de filas y los de sus tablas hijas"""
+
+    def __init__(self, nombre, esquema, hijas=None):
+        self.nombre = nombre
+        self.esquema = esquema
+        self.extraer, self.columnas, campos_hijos = _compilar_extractor(nombre, esquema)
+        self.hijas = hijas or {}
+        self.campos_hijos = [campo for campo in campos_hijos if campo in self.hijas]
+        self.clave_padre = next((c for c in CONFIG_ESQUEMA["CAMPOS_CLAVE"] if esquema.get(c) == "escalar"), None)
+
+    @classmethod
+    def desde_registros(cls, nombre, registros, campos=None):
+        """Infiere el esquema de una muestra y lo compila (tablas hijas incluidas)
+
+        `campos` es el conjunto de campos de primer nivel de todos los
+        registros, si ya se calculó (ver campos_primer_nivel).
+        """
+        muestra = _muestra(registros, CONFIG_ESQUEMA["MUESTRA"])
+        esquema = inferir_esquema(muestra)
+        # Campos de primer nivel que no aparecieron en la muestra: se agregan sin tipo fijo
+        presentes = campos if campos is not None else campos_primer_nivel(registros)
+        for clave in sorted(presentes - esquema.keys()):
+            esquema[clave] = "mixto"
+
+        hijas = {}
+        for campo, tipo in esquema.items():
+            if tipo != "hija":
+                continue
+            elementos = [x for r in muestra if isinstance(r, dict)
+                         for x in (r.get(campo) or ()) if isinstance(x, dict)]
+            sub = inferir_esquema(_muestra(elementos, CONFIG_ESQUEMA["MUESTRA"]),
+                                  CONFIG_ESQUEMA["PROFUNDIDAD_MAXIMA"] - 1, tablas_hijas=())
+            hijas[campo] = cls(f"{nombre}.{campo}", sub)
+        return cls(nombre, esquema, hijas)
+
+    @classmethod
+    def desde_contenido(cls, nombre, contenido):
+        """Reconstruye el esquema guardado en el registro (sin volver a inferir)"""
+        hijas = {campo: cls(f"{nombre}.{campo}", sub) for campo, sub in contenido["hijas"].items()}
+        return cls(nombre, contenido["esquema"], hijas)
+
+    def contenido(self):
+        """Forma serializable del esquema para el registro"""
+        return {"esquema": self.esquema,
+                "hijas": {campo: hija.esquema for campo, hija in self.hijas.items()},
+                "config": _huella_config_esquema()}
+
+    def nombre_tabla_hija(self, campo):
+        return f"{self.nombre}_{CONFIG_ESQUEMA['TABLAS_HIJAS'].get(campo, campo)}"
+
+    def filas(self, registros, faltante=""):
+        """Encabezado y una tupla por registro"""
+        yield self.columnas
+        extraer = self.extraer
+        reloj = time.perf_counter
+        aplanado = 0.0
+        for registro in registros:
+            if registro.__class__ is dict:
+                inicio = reloj()
+                fila = extraer(registro, faltante)
+                aplanado += reloj() - inicio
+                yield fila
+        obtener_metricas().registrar_etapa("aplanado", aplanado, endpoint=self.nombre,
+                                           registros=len(registros))
+
+    def columnas_hija(self, campo):
+        clave = self.clave_padre
+        return [f"padre.{clave}" if clave else "padre.fila", "indice"] + self.hijas[campo].columnas
+
+    def filas_de_hija(self, campo, registro, fila_padre, faltante=""):
+        """Filas hijas de un registro: clave del padre (o su número de fila), índice y columnas"""
+        elementos = registro.get(campo)
+        if elementos.__class__ is not list:
+            return
+        padre = registro.get(self.clave_padre, faltante) if self.clave_padre else fila_padre
+        extraer = self.hijas[campo].extraer
+        for indice, elemento in enumerate(elementos):
+            if elemento.__class__ is dict:
+                yield (padre, indice) + extraer(elemento, faltante)
+
+    def filas_hija(self, campo, registros, faltante=""):
+        """Encabezado y filas de la tabla hija de todos los registros"""
+        yield self.columnas_hija(campo)
+        fila_padre = 0
+        for registro in registros:
+            if registro.__class__ is not dict:
+                continue
+            fila_padre += 1
+            yield from self.filas_de_hija(campo, registro, fila_padre, faltante)
+
+def campos_primer_nivel(registros):
+    """Conjunto de campos de primer nivel de todos los registros (una pasada en C)"""
+    return set().union(*(r for r in registros if isinstance(r, dict)))
+
+def _huella_config_esquema():
+    # Si cambia la configuración del aplanado, los esquemas guardados ya no sirven
+    return {"profundidad": CONFIG_ESQUEMA["PROFUNDIDAD_MAXIMA"],
+            "tablas_hijas": sorted(CONFIG_ESQUEMA["TABLAS_HIJAS"])}
+
+class RegistroEsquemas:
+    """Esquemas y campo ID descubiertos por endpoint, persistidos en el almacén local
+
+    Cada entrada guarda el conjunto de campos de primer nivel con que se
+    descubrió. Mientras los datos nuevos traigan exactamente esos campos se
+    reutiliza lo guardado (mismo orden de columnas entre corridas); si
+    aparecen o desaparecen campos se vuelve a diagnosticar y se reemplaza.
+    Sin almacén funciona solo en memoria.
+    """
+
+    ROL_EXPORTACION = "exportacion"
+    ROL_CABECERAS = "cabeceras"
+
+    def __init__(self, almacen=None):
+        self.almacen = almacen
+        self._entradas = almacen.obtener_esquemas() if almacen else {}
+        self._compilados = {}
+        self._lock = threading.Lock()
+
+    def _vigente(self, endpoint, rol, campos):
+        entrada = self._entradas.get((endpoint, rol))
+        if entrada and set(entrada[0]) == campos:
+            return entrada[1]
+        return None
+
+    def _guardar(self, endpoint, rol, campos, contenido):
+        with self._lock:
+            self._entradas[(endpoint, rol)] = (sorted(campos), contenido)
+        if self.almacen:
+            self.almacen.guardar_esquema(endpoint, rol, campos, contenido)
+
+    def esquema(self, nombre, registros):
+        """EsquemaCompilado del endpoint: el guardado si los campos no cambiaron, o uno nuevo"""
+        campos = campos_primer_nivel(registros)
+        clave = (nombre, frozenset(campos))
+        if clave in self._compilados:
+            return self._compilados[clave]
+        contenido = self._vigente(nombre, self.ROL_EXPORTACION, campos)
+        if contenido and contenido.get("config") == _huella_config_esquema():
+            esquema = EsquemaCompilado.desde_contenido(nombre, contenido)
+        else:
+            esquema = EsquemaCompilado.desde_registros(nombre, registros, campos)
+            self._guardar(nombre, self.ROL_EXPORTACION, campos, esquema.contenido())
+        self._compilados[clave] = esquema
+        return esquema
+
+    def esquema_para_muestra(self, nombre, muestra):
+        """Esquema para exportar en streaming, cuando solo se vio una muestra
+
+        Se usa el guardado aunque los campos hayan cambiado (los nuevos van a
+        _columnas_extra y se incorporan con actualizar_campos al terminar).
+        """
+        entrada = self._entradas.get((nombre, self.ROL_EXPORTACION))
+        if entrada and entrada[1].get("config") == _huella_config_esquema():
+            return EsquemaCompilado.desde_contenido(nombre, entrada[1])
+        esquema = EsquemaCompilado.desde_registros(nombre, muestra)
+        self._guardar(nombre, self.ROL_EXPORTACION, campos_primer_nivel(muestra), esquema.contenido())
+        return esquema
+
+    def actualizar_campos(self, nombre, esquema, campos):
+        """Registra los campos vistos en la corrida; los que faltaban se agregan sin tipo fijo"""
+        entrada = self._entradas.get((nombre, self.ROL_EXPORTACION))
+        if entrada and set(entrada[0]) == campos:
+            return
+        contenido = esquema.contenido()
+        contenido["esquema"] = dict(contenido["esquema"])
+        for campo in sorted(campos - contenido["esquema"].keys()):
+            contenido["esquema"][campo] = "mixto"
+        self._guardar(nombre, self.ROL_EXPORTACION, campos, contenido)
+
+    def id_field(self, endpoint, cabeceras):
+        """Campo ID guardado para el endpoint, o None si no hay o los campos cambiaron"""
+        contenido = self._vigente(endpoint, self.ROL_CABECERAS, campos_primer_nivel(cabeceras))
+        return contenido.get("id_field") if contenido else None
+
+    def guardar_id_field(self, endpoint, cabeceras, id_field):
+        self._guardar(endpoint, self.ROL_CABECERAS, campos_primer_nivel(cabeceras),
+                      {"id_field": id_field})
+
+_REGISTRO_ESQUEMAS = None
+_REGISTRO_ESQUEMAS_LOCK = threading.Lock()
+
+def obtener_registro_esquemas():
+    """Registro de esquemas compartido (persistido si el almacén local está habilitado)"""
+    global _REGISTRO_ESQUEMAS
+    with _REGISTRO_ESQUEMAS_LOCK:
+        if _REGISTRO_ESQUEMAS is None:
+            _REGISTRO_ESQUEMAS = RegistroEsquemas(obtener_almacen())
+        return _REGISTRO_ESQUEMAS
+
+def compilar_esquemas(datos_por_recurso):
+    """Un EsquemaCompilado por endpoint con datos; lo comparten todos los exportadores"""
+    registro = obtener_registro_esquemas()
+    return {nombre: registro.esquema(nombre, data)
+            for nombre, data in datos_por_recurso.items() if data}
+
+def tablas_endpoint(nombre, data, faltante="", esquemas=None):
+    """[(tabla, filas)] de un endpoint: la principal y, con esquema, sus tablas hijas
+
+    Con CONFIG_ESQUEMA deshabilitado se usa el aplanado clásico (una tabla, objetos como JSON).
+    """
+    if not CONFIG_ESQUEMA["HABILITADO"]:
+        return [(nombre, _filas_endpoint(data, faltante, nombre))]
+    esquema = (esquemas or {}).get(nombre) or obtener_registro_esquemas().esquema(nombre, data)
+    tablas = [(nombre, esquema.filas(data, faltante))]
+    for campo in esquema.campos_hijos:
+        tablas.append((esquema.nombre_tabla_hija(campo), esquema.filas_hija(campo, data, faltante)))
+    return tablas
+
+def detectar_clave_primaria(nombre, muestra):
+    """Campo que identifica cada registro del endpoint, o None si ninguno es confiable
+    
+    Se prueban CAMPOS_CLAVE y después los campos terminados en "id": el primero
+    presente en toda la muestra, escalar y casi único (UNICIDAD_MINIMA admite
+    los duplicados que justamente se quieren eliminar).
+    """
+    forzada = CONFIG_DEDUP["CLAVES_POR_ENDPOINT"].get(nombre)
+    if forzada:
+        return forzada
+    registros = [r for r in muestra if r.__class__ is dict]
+    if not registros:
+        return None
+    candidatos = list(CONFIG_DEDUP["CAMPOS_CLAVE"])
+    candidatos += sorted(c for c in campos_primer_nivel(registros)
+                         if c.lower().endswith("id") and c not in candidatos)
+    for campo in candidatos:
+        valores = [r.get(campo) for r in registros]
+        if any(v is None or v == "" or isinstance(v, (dict, list)) for v in valores):
+            continue
+        if len(set(map(str, valores))) >= CONFIG_DEDUP["UNICIDAD_MINIMA"] * len(valores):
+            return campo
+    return None
+
+def completitud_registro(registro):
+    """Campos con valor (y elementos de sus listas): el detalle de un asiento supera a su cabecera"""
+    total = 0
+    for valor in registro.values():
+        if valor is None or valor == "":
+            continue
+        total += len(valor) + 1 if isinstance(valor, (list, dict)) else 1
+    return total
+
+class IndiceClaves:
+    """Índice clave primaria → posición del registro (fila del spool o de la lista)
+    
+    No retiene registros: por clave guarda un hash de 64 bits y un entero con
+    la posición y la completitud empaquetadas, así escala a cientos de miles
+    de comprobantes. Cada hash lleva además una firma independiente: si dos
+    claves distintas comparten hash, la segunda se resuelve por su texto
+    completo en vez de descartarse como duplicada.
+    """
+
+    def __init__(self, campo):
+        self.campo = campo
+        self.duplicados = 0
+        self.reemplazados = 0
+        self._posiciones = {}
+        self._firmas = {}
+        self._colisiones = {}      # Texto de la clave → posición, solo para hashes repetidos
+
+    @staticmethod
+    def _hash(valor):
+        return int.from_bytes(hashlib.blake2b(str(valor).encode("utf-8"), digest_size=8).digest(), "little")
+
+    @staticmethod
+    def _firma(texto):
+        return hashlib.blake2b(texto.encode("utf-8"), digest_size=8, person=b"firma").digest()
+
+    def registrar(self, registro, posicion, en_lugar=False):
+        """None si la clave es nueva (o falta); si no (posición anterior, el nuevo es más completo)
         
-        if i % 10 == 0:
-            time.sleep(0.5)
-    
-    print(f"   ✅ Procesamiento completado:")
-    print(f"      • Total asientos: {len(asientos_completos)}")
-    print(f"      • Con detalle completo: {exitosos}")
-    print(f"      • Solo cabeceras: {errores}")
-    print(f"      • Campo ID usado: '{id_field}'")
-    print(f"   🎯 Total {endpoint_name}: {len(asientos_completos)} registros\n")
-    
-    return asientos_completos
+        Con en_lugar=True el reemplazo ocupa la posición anterior (listas); si no,
+        la nueva (spool, donde la fila anterior se descarta).
+        """
+        valor = registro.get(self.campo)
+        if valor is None or valor == "":
+            return None
+        texto = str(valor)
+        clave = self._hash(texto)
+        firma = self._firma(texto)
+        completitud = min(completitud_registro(registro), 0xFFFF)
+        posiciones = self._posiciones
+        previo = posiciones.get(clave)
+        if previo is None:
+            posiciones[clave] = posicion << 16 | completitud
+            self._firmas[clave] = firma
+            return None
+        if self._firmas[clave] != firma:
+            # Colisión de hash: otra clave ocupa la entrada, se compara por el texto
+            posiciones, clave = self._colisiones, texto
+            previo = posiciones.get(clave)
+            if previo is None:
+                posiciones[clave] = posicion << 16 | completitud
+                return None
+        anterior = previo >> 16
+        if completitud > previo & 0xFFFF:
+            posiciones[clave] = (anterior if en_lugar else posicion) << 16 | completitud
+            self.reemplazados += 1
+            return anterior, True
+        self.duplicados += 1
+        return anterior, False
 
-def get_asientos_contables_debug_solo(token, endpoint_name, endpoint):
-    """Versión de debugging que SOLO muestra la estructura sin procesar detalles"""
-    print(f"🐛 DEBUG: Analizando estructura de {endpoint_name}")
+    def informar(self, nombre):
+        if self.duplicados or self.reemplazados:
+            emitir(f"   🧬 {nombre}: {self.duplicados} duplicados descartados, {self.reemplazados} "
+                   f"reemplazados por una versión más completa (clave '{self.campo}')")
+
+def deduplicar_registros(nombre, registros):
+    """Una entrada por clave primaria, en el orden de llegada (versión en lista del índice)"""
+    if not CONFIG_DEDUP["HABILITADO"] or not registros:
+        return registros
+    campo = detectar_clave_primaria(nombre, _muestra(registros, CONFIG_ESQUEMA["MUESTRA"]))
+    if not campo:
+        return registros
+    indice = IndiceClaves(campo)
+    resultado = []
+    for registro in registros:
+        if registro.__class__ is dict:
+            previo = indice.registrar(registro, len(resultado), en_lugar=True)
+            if previo is not None:
+                anterior, mas_completo = previo
+                if mas_completo:
+                    resultado[anterior] = registro
+                continue
+        resultado.append(registro)
+    indice.informar(nombre)
+    return resultado
+
+_DIAS_POR_MES = (0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+def _parsear_fecha_rapida(valor):
+    """Valida el prefijo 'YYYY-MM-DD' sin strptime y lo devuelve (o None)
     
-    url = f"{BASE_URL}/{endpoint}"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/json"
-    }
+    Las fechas ISO se comparan bien como texto, así que min/max y la clave de
+    mes ('YYYY-MM') salen directo del string.
+    """
+    if len(valor) < 10 or valor[4] != '-' or valor[7] != '-':
+        return None
+    anio, mes, dia = valor[0:4], valor[5:7], valor[8:10]
+    if not (anio.isdigit() and mes.isdigit() and dia.isdigit() and valor[:10].isascii()):
+        return None
+    mes_int, dia_int = int(mes), int(dia)
+    if not (1 <= mes_int <= 12 and 1 <= dia_int <= _DIAS_POR_MES[mes_int]):
+        return None
+    return valor[:10]
+
+class EstadisticasFechas:
+    """Rango de fechas y registros por mes de un endpoint, acumulados en una pasada
     
-    try:
-        response = requests.get(url, headers=headers, timeout=30)
-        
-        if response.status_code != 200:
-            print(f"❌ Error {response.status_code}")
-            return []
-            
-        data = response.json()
-        cabeceras = data if isinstance(data, list) else [data] if data else []
-        
-        if not cabeceras:
-            print(f"⚪ No hay datos")
-            return []
-        
-        print(f"✅ {len(cabeceras)} registros obtenidos")
-        print(f"\n📋 ESTRUCTURA DEL PRIMER ASIENTO:")
-        print("-" * 50)
-        
-        primer_asiento = cabeceras[0]
-        if isinstance(primer_asiento, dict):
-            for campo, valor in primer_asiento.items():
-                tipo = type(valor).__name__
-                valor_preview = str(valor)[:100] + "..." if len(str(valor)) > 100 else str(valor)
-                print(f"• {campo:<25} ({tipo:<10}): {valor_preview}")
-        
-        
-        print(f"\n📄 JSON COMPLETO DEL PRIMER ASIENTO:")
-        print("-" * 50)
-        print(json.dumps(primer_asiento, indent=2, ensure_ascii=False)[:2000] + "...")
-        
-        return cabeceras[:10]  
-        
-    except Exception as e:
-        print(f"❌ Error: {e}")
-        return []
+    Usa memoria O(meses): no guarda la lista de fechas, solo min/max y un
+    contador por 'YYYY-MM'.
+    """
 
-def aplanar_item_final(item):
-    """Convierte cualquier diccionario, lista u objeto anidado a string."""
-    if isinstance(item, dict):
-        return {k: aplanar_item_final(v) for k, v in item.items()}
-    elif isinstance(item, list):
-        return json.dumps([aplanar_item_final(x) for x in item], ensure_ascii=False)
-    elif isinstance(item, (int, float, str, bool)) or item is None:
-        return item
-    else:
-        return str(item)
+    def __init__(self):
+        self.registros = 0
+        self.fecha_min = None
+        self.fecha_max = None
+        self.por_mes = {}
+        self._es_fecha = {}    # caché de claves: 'fecha' in key.lower()
+
+    def agregar(self, item):
+        self.registros += 1
+        if not isinstance(item, dict):
+            return
+        es_fecha = self._es_fecha
+        meses_item = None
+        for key, value in item.items():
+            marca = es_fecha.get(key)
+            if marca is None:
+                marca = es_fecha[key] = 'fecha' in key.lower()
+            if not marca or not isinstance(value, str):
+                continue
+            fecha = _parsear_fecha_rapida(value)
+            if fecha is None:
+                continue
+            if self.fecha_min is None or fecha < self.fecha_min:
+                self.fecha_min = fecha
+            if self.fecha_max is None or fecha > self.fecha_max:
+                self.fecha_max = fecha
+            mes = fecha[:7]
+            if meses_item is None:
+                meses_item = {mes}
+            else:
+                meses_item.add(mes)
+        # Cada registro cuenta una vez por mes aunque tenga varias fechas
+        if meses_item:
+            por_mes = self.por_mes
+            for mes in meses_item:
+                por_mes[mes] = por_mes.get(mes, 0) + 1
+
+    def agregar_todos(self, data):
+        for item in data or []:
+            self.agregar(item)
+        return self
 
-def exportar_a_excel_simple(datos_por_recurso, filename="xubio_mensual.xlsx"):
+    @property
+    def meses_cubiertos(self):
+        return len(self.por_mes)
+
+    def meses_ordenados(self):
+        return sorted(self.por_mes)
+
+def calcular_estadisticas(datos_por_recurso):
+    """Una pasada por endpoint; el resultado lo consumen el Excel y el reporte"""
+    return {nombre: EstadisticasFechas().agregar_todos(data)
+            for nombre, data in datos_por_recurso.items()}
+
+def exportar_a_excel_simple(datos_por_recurso, filename="xubio_mensual.xlsx", estadisticas=None, esquemas=None,
+                            analisis=None):
     """Exporta datos con análisis simple de fechas"""
-    print(f"💾 Exportando a {filename}...")
+    import openpyxl
+    emitir(f"💾 Exportando a {filename}...")
+    if estadisticas is None:
+        estadisticas = calcular_estadisticas(datos_por_recurso)
     wb = openpyxl.Workbook()
     wb.remove(wb.active)
 
@@ -405,66 +3027,35 @@ def exportar_a_excel_simple(datos_por_recurso, filename="xubio_mensual.xlsx"):
     summary_ws.append(["Endpoint", "Registros", "Fecha Más Antigua", "Fecha Más Reciente", "Meses Cubiertos"])
     
     for nombre, data in datos_por_recurso.items():
-        sheet_name = nombre.replace('_', ' ').title()[:31]
-        ws = wb.create_sheet(title=sheet_name)
-        
         if not data:
+            ws = wb.create_sheet(title=nombre.replace('_', ' ').title()[:31])
             ws.append(["Sin datos disponibles"])
             summary_ws.append([nombre, 0, "", "", 0])
             continue
 
-        # Analizar fechas
-        fechas_encontradas = []
-        for item in data:
-            if isinstance(item, dict):
-                for key, value in item.items():
-                    if 'fecha' in key.lower() and isinstance(value, str):
-                        try:
-                            fecha = datetime.strptime(value[:10], "%Y-%m-%d")
-                            fechas_encontradas.append(fecha)
-                        except:
-                            pass
-        
-        fecha_min = min(fechas_encontradas).strftime("%Y-%m-%d") if fechas_encontradas else ""
-        fecha_max = max(fechas_encontradas).strftime("%Y-%m-%d") if fechas_encontradas else ""
-        
-        # Calcular meses cubiertos
-        meses_cubiertos = 0
-        if fechas_encontradas:
-            meses_set = set()
-            for fecha in fechas_encontradas:
-                meses_set.add(fecha.strftime("%Y-%m"))
-            meses_cubiertos = len(meses_set)
-        
-        # Datos
-        data_aplanada = [aplanar_item_final(item) for item in data]
-        headers = list(data_aplanada[0].keys())
-        ws.append(headers)
-        
-        for item in data_aplanada:
-            fila = []
-            for col in headers:
-                val = item.get(col, "")
-                if isinstance(val, (dict, list)):
-                    val = json.dumps(val, ensure_ascii=False)
-                fila.append(val)
-            ws.append(fila)
+        stats = estadisticas[nombre]
         
-        # Auto-ajustar columnas
-        for col in ws.columns:
-            max_length = 0
-            column = col[0].column_letter
-            for cell in col:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            ws.column_dimensions[column].width = adjusted_width
+        # Datos: la tabla del endpoint y sus tablas hijas, una hoja cada una
+        for tabla, filas in tablas_endpoint(nombre, data, "", esquemas):
+            ws = wb.create_sheet(title=tabla.replace('_', ' ').title()[:31])
+            for fila in filas:
+                ws.append(list(fila))
+            
+            # Auto-ajustar columnas
+            for col in ws.columns:
+                max_length = 0
+                column = col[0].column_letter
+                for cell in col:
+                    try:
+                        if len(str(cell.value)) > max_length:
+                            max_length = len(str(cell.value))
+                    except:
+                        pass
+                adjusted_width = min(max_length + 2, 50)
+                ws.column_dimensions[column].width = adjusted_width
         
         # Agregar a resumen
-        summary_ws.append([nombre, len(data), fecha_min, fecha_max, meses_cubiertos])
+        summary_ws.append([nombre, len(data), stats.fecha_min or "", stats.fecha_max or "", stats.meses_cubiertos])
 
     # Auto-ajustar resumen
     for col in summary_ws.columns:
@@ -479,129 +3070,1378 @@ def exportar_a_excel_simple(datos_por_recurso, filename="xubio_mensual.xlsx"):
         adjusted_width = max_length + 2
         summary_ws.column_dimensions[column].width = adjusted_width
 
+    # Hojas de análisis (AnaliticaCorrida.hojas) al final
+    for titulo, _, filas in analisis or []:
+        ws = wb.create_sheet(title=titulo)
+        for fila in filas:
+            ws.append(fila)
+
+    wb.save(filename)
+    emitir(f"✅ Exportado: {filename}")
+    return filename
+
+_LARGO_FILA = struct.Struct("<I")
+_BLOQUE_SPOOL = 1 << 20
+
+class TablaSpool:
+    """Filas de una tabla volcadas a un archivo temporal (marshal) mientras se miden anchos
+    
+    Las hojas write-only exigen fijar los anchos antes de la primera fila, así
+    que las filas se guardan en disco a medida que llegan y se reproducen al
+    escribir. La memoria no crece con el tamaño de la tabla. Se pueden agregar
+    columnas en la marcha: las filas anteriores se completan al leerlas.
+    
+    `descartadas` (compartido entre la tabla principal y sus hijas) tiene las
+    filas principales reemplazadas por otra versión: se saltean al leer. Las
+    tablas hijas guardan la fila padre de cada fila (con_padre) y, si se
+    vinculan por número de fila (renumerar), lo corrigen al leer.
+    
+    Cada fila va precedida de su largo: al leer se decodifica con marshal.loads
+    sobre bloques de _BLOQUE_SPOOL bytes, mucho más rápido que un marshal.load
+    por fila contra el archivo.
+    """
+
+    def __init__(self, nombre, columnas, descartadas=None, con_padre=False, renumerar=False):
+        self.nombre = nombre
+        self.columnas = list(columnas)
+        self.anchos = [len(str(c)) for c in self.columnas]
+        self.cantidad = 0
+        self.descartadas = descartadas if descartadas is not None else set()
+        self.renumerar = renumerar
+        self._padres = array("I") if con_padre else None
+        self._archivo = tempfile.TemporaryFile()
+
+    def agregar_columna(self, columna):
+        self.columnas.append(columna)
+        self.anchos.append(len(str(columna)))
+        return len(self.columnas) - 1
+
+    def agregar(self, fila, padre=None):
+        if self._padres is not None:
+            self._padres.append(padre)
+        anchos = self.anchos
+        for idx, val in enumerate(fila):
+            largo = len(str(val)) if val is not None else 0
+            if idx >= len(anchos):
+                anchos.append(largo)
+            elif largo > anchos[idx]:
+                anchos[idx] = largo
+        datos = marshal.dumps(fila)
+        self._archivo.write(_LARGO_FILA.pack(len(datos)) + datos)
+        self.cantidad += 1
+
+    def _filas_guardadas(self):
+        """Filas en el orden en que se agregaron, leyendo el archivo por bloques"""
+        self._archivo.seek(0)
+        prefijo = _LARGO_FILA.size
+        leer_largo = _LARGO_FILA.unpack_from
+        cargar = marshal.loads
+        pendiente = b""
+        while True:
+            bloque = self._archivo.read(_BLOQUE_SPOOL)
+            if not bloque:
+                return
+            datos = pendiente + bloque if pendiente else bloque
+            pos, fin = 0, len(datos)
+            while pos + prefijo <= fin:
+                (largo,) = leer_largo(datos, pos)
+                inicio = pos + prefijo
+                if inicio + largo > fin:
+                    break
+                yield cargar(datos[inicio:inicio + largo])
+                pos = inicio + largo
+            pendiente = datos[pos:]
+
+    def filas(self, faltante=None):
+        """Encabezado y filas (las cortas se completan con `faltante`)"""
+        yield self.columnas
+        total = len(self.columnas)
+        descartadas = self.descartadas
+        padres = self._padres
+        ordenadas = sorted(descartadas) if self.renumerar else None
+        for i, fila in enumerate(self._filas_guardadas()):
+            if descartadas:
+                padre = padres[i] if padres is not None else i
+                if padre in descartadas:
+                    continue
+                if ordenadas:
+                    # padre.fila es 1-based y no cuenta las filas descartadas
+                    fila = (padre + 1 - bisect_right(ordenadas, padre),) + tuple(fila[1:])
+            if len(fila) < total:
+                fila = tuple(fila) + (faltante,) * (total - len(fila))
+            yield fila
+
+    def escribir_hoja(self, ws, ancho_maximo):
+        from openpyxl.utils import get_column_letter
+        for idx, ancho in enumerate(self.anchos, 1):
+            ws.column_dimensions[get_column_letter(idx)].width = min(ancho + 2, ancho_maximo)
+        filas = self.filas()
+        if self.columnas:
+            ws.append(next(filas))
+        else:
+            next(filas)
+        for fila in filas:
+            ws.append(fila)
+
+    def cerrar(self):
+        self._archivo.close()
+
+def _escribir_hoja_streaming(ws, filas, ancho_maximo):
+    """Escribe filas en una hoja write-only calculando anchos en la misma pasada"""
+    filas = iter(filas)
+    primera = next(filas, None)
+    if primera is None:
+        return
+    spool = TablaSpool(ws.title, [])
+    try:
+        spool.agregar(primera)
+        for fila in filas:
+            spool.agregar(fila)
+        spool.escribir_hoja(ws, ancho_maximo)
+    finally:
+        spool.cerrar()
+
+def columnas_union(registros):
+    """Columnas de todos los registros, en orden de primera aparición
+    
+    Reemplaza a `list(data[0].keys())`, que perdía los campos ausentes en el
+    primer registro. aplanar_item_final conserva las claves de primer nivel,
+    así que sirve tanto para registros crudos como aplanados.
+    """
+    columnas = {}
+    for item in registros:
+        if isinstance(item, dict):
+            for key in item:
+                if key not in columnas:
+                    columnas[key] = None
+    return list(columnas)
+
+def _filas_endpoint(data, faltante="", nombre=None):
+    """Genera encabezado y filas aplanadas de un endpoint, registro por registro
+    
+    El aplanado se intercala con la escritura, así que su tiempo se acumula
+    aparte y se registra como etapa "aplanado" al terminar.
+    """
+    headers = columnas_union(data)
+    yield headers
+    reloj = time.perf_counter
+    aplanado = 0.0
+    for item in data:
+        inicio = reloj()
+        item = aplanar_item_final(item)
+        aplanado += reloj() - inicio
+        if not isinstance(item, dict):
+            continue
+        fila = []
+        for col in headers:
+            val = item.get(col, faltante)
+            if isinstance(val, (dict, list)):
+                val = json.dumps(val, ensure_ascii=False)
+            fila.append(val)
+        yield fila
+    obtener_metricas().registrar_etapa("aplanado", aplanado, endpoint=nombre, registros=len(data))
+
+def exportar_a_excel_streaming(datos_por_recurso, filename="xubio_mensual.xlsx", estadisticas=None, esquemas=None,
+                               analisis=None):
+    """Exporta igual que exportar_a_excel_simple pero con un workbook write-only"""
+    import openpyxl
+    emitir(f"💾 Exportando a {filename} (streaming)...")
+    if estadisticas is None:
+        estadisticas = calcular_estadisticas(datos_por_recurso)
+    ancho_maximo = CONFIG_EXPORTACION["ANCHO_MAXIMO"]
+    wb = openpyxl.Workbook(write_only=True)
+    
+    # Se crea primero para que quede como primera hoja; se completa al final
+    summary_ws = wb.create_sheet(title="Resumen")
+    resumen = [["Endpoint", "Registros", "Fecha Más Antigua", "Fecha Más Reciente", "Meses Cubiertos"]]
+    
+    for nombre, data in datos_por_recurso.items():
+        if not data:
+            ws = wb.create_sheet(title=nombre.replace('_', ' ').title()[:31])
+            ws.append(["Sin datos disponibles"])
+            resumen.append([nombre, 0, "", "", 0])
+            continue
+        
+        stats = estadisticas[nombre]
+        for tabla, filas in tablas_endpoint(nombre, data, "", esquemas):
+            ws = wb.create_sheet(title=tabla.replace('_', ' ').title()[:31])
+            _escribir_hoja_streaming(ws, filas, ancho_maximo)
+        resumen.append([nombre, len(data), stats.fecha_min or "", stats.fecha_max or "", stats.meses_cubiertos])
+    
+    for titulo, _, filas in analisis or []:
+        _escribir_hoja_streaming(wb.create_sheet(title=titulo), filas, ancho_maximo)
+    
+    # El resumen no tiene tope de ancho, igual que en el modo clásico
+    _escribir_hoja_streaming(summary_ws, resumen, float("inf"))
+    
     wb.save(filename)
-    print(f"✅ Exportado: {filename}")
+    emitir(f"✅ Exportado: {filename}")
     return filename
 
-def generar_reporte_mensual(datos, filename="reporte_mensual.txt"):
-    """Genera reporte enfocado en cobertura mensual"""
+def _exportar_csv(nombre, filas, ruta):
+    with open(ruta, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f)
+        for fila in filas:
+            writer.writerow(fila)
+
+def _dataframe_desde_filas(filas):
+    """Arma un DataFrame con tipos compatibles con Arrow (columnas mixtas → texto)"""
+    import pandas as pd
+    headers = next(filas)
+    df = pd.DataFrame.from_records(list(filas), columns=headers)
+    for col in df.columns:
+        if df[col].dtype == object:
+            tipo = pd.api.types.infer_dtype(df[col], skipna=True)
+            if tipo not in ("string", "empty", "boolean", "integer", "floating"):
+                df[col] = df[col].map(lambda v: v if v is None else str(v))
+    return df
+
+def _exportar_parquet(nombre, filas, ruta):
+    _dataframe_desde_filas(filas).to_parquet(ruta, index=False)
+
+def _exportar_feather(nombre, filas, ruta):
+    _dataframe_desde_filas(filas).to_feather(ruta)
+
+# Backends columnares: extensión y función (nombre, filas, ruta)
+EXPORTADORES_COLUMNARES = {
+    "csv": (".csv", _exportar_csv),
+    "parquet": (".parquet", _exportar_parquet),
+    "feather": (".feather", _exportar_feather),
+}
+
+def exportar_columnar(datos_por_recurso, formato, directorio, esquemas=None):
+    """Exporta un archivo por tabla (endpoint y tablas hijas) en `directorio` con el backend elegido"""
+    extension, exportador = EXPORTADORES_COLUMNARES[formato]
+    emitir(f"💾 Exportando {formato.upper()} en {directorio}/...")
+    os.makedirs(directorio, exist_ok=True)
+    archivos = []
+    
+    for nombre, data in datos_por_recurso.items():
+        if not data:
+            continue
+        # Para CSV los faltantes van vacíos; en Parquet/Feather como nulos
+        faltante = "" if formato == "csv" else None
+        try:
+            for tabla, filas in tablas_endpoint(nombre, data, faltante, esquemas):
+                ruta = os.path.join(directorio, f"{tabla}{extension}")
+                exportador(tabla, filas, ruta)
+                archivos.append(ruta)
+        except ImportError as e:
+            emitir(f"   ❌ {formato} requiere pandas y pyarrow ({e})", NIVEL_ERROR)
+            break
+    
+    emitir(f"✅ Exportados {len(archivos)} archivos {formato}")
+    return archivos
+
+# Totales por mes: endpoint → columna del análisis mensual
+TOTALES_MENSUALES = {
+    "factura_venta": "Facturado",
+    "cobros": "Cobrado",
+    "factura_compra": "Comprado",
+    "pagos": "Pagado",
+    "retenciones": "Retenido",
+}
+
+# Datos que se toman de la tabla principal de cada endpoint
+ROLES_PRINCIPAL = {
+    "factura_venta": ["id", "numero", "fecha", "fecha_vto", "importe", "cliente", "cliente_nombre"],
+    "cobros": ["id", "fecha", "importe", "cliente", "cliente_nombre"],
+    "factura_compra": ["id", "numero", "fecha", "fecha_vto", "importe", "proveedor", "proveedor_nombre"],
+    "pagos": ["id", "fecha", "importe", "proveedor", "proveedor_nombre"],
+    "retenciones": ["fecha", "importe"],
+}
+
+# Conciliaciones: hoja → (comprobantes, cobros/pagos que los cancelan, contraparte, archivo)
+CONCILIACIONES = {
+    "Conciliación Ventas": ("factura_venta", "cobros", "cliente", "conciliacion_ventas"),
+    "Conciliación Compras": ("factura_compra", "pagos", "proveedor", "conciliacion_compras"),
+}
+
+class AnaliticaCorrida:
+    """Agregados de gestión con pandas: totales por mes, top clientes y saldos por cuenta
+    
+    De cada endpoint se proyectan solo las columnas que usan los análisis
+    (según CONFIG_ANALITICA["CAMPOS"]) a un DataFrame; los agregados salen de
+    groupby vectorizados al final. Recibe tablas ya aplanadas, así que sirve
+    igual para el pipeline (TablaSpool) y para el modo clásico (tablas_endpoint).
+    
+    También concilia cobros contra facturas de venta y pagos contra facturas
+    de compra (ver conciliar).
+    """
+
+    def __init__(self):
+        self.marcos = {}    # (endpoint, "principal" | "aplicaciones" | "movimientos") → DataFrame
+
+    def _proyectar(self, filas, roles, requeridos):
+        """DataFrame con las columnas de `roles` presentes en la tabla (None si falta alguna requerida)"""
+        import pandas as pd
+        encabezado = next(filas, None) or []
+        posiciones = {}
+        for rol in roles:
+            columna = next((c for c in CONFIG_ANALITICA["CAMPOS"][rol] if c in encabezado), None)
+            if columna is not None:
+                posiciones[rol] = encabezado.index(columna)
+        if not requeridos <= posiciones.keys():
+            return None
+        indices = list(posiciones.values())
+        # itemgetter de un índice devuelve el valor suelto, no una tupla
+        proyectar = itemgetter(*indices) if len(indices) > 1 else (lambda fila: (fila[indices[0]],))
+        df = pd.DataFrame.from_records(map(proyectar, filas), columns=list(posiciones))
+        for rol in ("importe", "aplicado", "debe", "haber"):
+            if rol in df:
+                df[rol] = pd.to_numeric(df[rol], errors="coerce").fillna(0.0)
+        # Las claves se comparan como texto: 123 y "123" son el mismo comprobante
+        for rol in ("id", "padre", "comprobante", "cliente", "proveedor", "cuenta"):
+            if rol in df:
+                df[rol] = df[rol].astype("string")
+        for rol in ("fecha", "fecha_vto"):
+            if rol in df:
+                # Fechas ISO: se parsea el prefijo 'YYYY-MM-DD'; las inválidas quedan NaT y fuera de los meses
+                df[rol] = pd.to_datetime(df[rol].astype("string").str.slice(0, 10),
+                                         format="%Y-%m-%d", errors="coerce")
+        if "fecha" in df:
+            df["mes"] = df["fecha"].dt.to_period("M")
+        return df
+
+    def agregar(self, nombre, tablas):
+        """`tablas`: [(nombre_tabla, filas)] con el encabezado como primera fila"""
+        aplican = {cobros for _, cobros, _, _ in CONCILIACIONES.values()}
+        for posicion, (_, filas) in enumerate(tablas):
+            if posicion == 0 and nombre in ROLES_PRINCIPAL:
+                df = self._proyectar(filas, ROLES_PRINCIPAL[nombre], {"fecha", "importe"})
+                if df is not None:
+                    self.marcos[(nombre, "principal")] = df
+            elif posicion > 0 and nombre in aplican:
+                # La tabla hija con el comprobante cancelado y el importe aplicado
+                df = self._proyectar(filas, ["padre", "comprobante", "aplicado"], {"comprobante", "aplicado"})
+                if df is not None:
+                    self.marcos[(nombre, "aplicaciones")] = df
+            elif nombre in ENDPOINTS_ESPECIALES:
+                # Las líneas del asiento: la tabla que tenga debe y haber
+                df = self._proyectar(filas, ["cuenta", "cuenta_codigo", "cuenta_nombre", "debe", "haber"],
+                                     {"debe", "haber"})
+                if df is not None and ({"cuenta", "cuenta_codigo", "cuenta_nombre"} & set(df.columns)):
+                    self.marcos[(nombre, "movimientos")] = df
+
+    def mensual(self):
+        import pandas as pd
+        columnas = {}
+        for nombre, titulo in TOTALES_MENSUALES.items():
+            df = self.marcos.get((nombre, "principal"))
+            if df is None or df.empty:
+                continue
+            por_mes = df.groupby("mes")["importe"].agg(["sum", "size"])
+            columnas[titulo] = por_mes["sum"]
+            columnas[f"{titulo} (cant.)"] = por_mes["size"]
+        if not columnas:
+            return None
+        tabla = pd.concat(columnas, axis=1).fillna(0).sort_index()
+        if "Cobrado" in tabla and "Pagado" in tabla:
+            tabla["Cobrado - Pagado"] = tabla["Cobrado"] - tabla["Pagado"]
+        tabla.index = tabla.index.astype(str)
+        return tabla.rename_axis("Mes").reset_index()
+
+    def top_clientes(self):
+        ventas = self.marcos.get(("factura_venta", "principal"))
+        if ventas is None or "cliente" not in ventas or ventas.empty:
+            return None
+        tabla = ventas.groupby("cliente").agg(Facturado=("importe", "sum"), Facturas=("importe", "size"),
+                                              Primera=("fecha", "min"), Ultima=("fecha", "max"))
+        if "cliente_nombre" in ventas:
+            tabla.insert(0, "Nombre", ventas.groupby("cliente")["cliente_nombre"].last())
+        cobros = self.marcos.get(("cobros", "principal"))
+        if cobros is not None and "cliente" in cobros:
+            tabla["Cobrado"] = cobros.groupby("cliente")["importe"].sum().reindex(tabla.index).fillna(0)
+            tabla["Saldo"] = tabla["Facturado"] - tabla["Cobrado"]
+        tabla["% Facturado"] = tabla["Facturado"] / tabla["Facturado"].sum() * 100
+        tabla = tabla.nlargest(CONFIG_ANALITICA["TOP_CLIENTES"], "Facturado")
+        for columna in ("Primera", "Ultima"):
+            tabla[columna] = tabla[columna].dt.strftime("%Y-%m-%d")
+        return tabla.rename(columns={"Ultima": "Última"}).rename_axis("Cliente").reset_index()
+
+    def saldos_cuentas(self):
+        movimientos = self.marcos.get(("asiento_contable", "movimientos"))
+        if movimientos is None or movimientos.empty:
+            return None
+        clave = next(c for c in ("cuenta", "cuenta_codigo", "cuenta_nombre") if c in movimientos)
+        agrupado = movimientos.groupby(clave)
+        tabla = agrupado.agg(Debe=("debe", "sum"), Haber=("haber", "sum"), Movimientos=("debe", "size"))
+        tabla["Saldo"] = tabla["Debe"] - tabla["Haber"]
+        for columna, titulo in (("cuenta_nombre", "Nombre"), ("cuenta_codigo", "Código")):
+            if columna in movimientos and columna != clave:
+                tabla.insert(0, titulo, agrupado[columna].last())
+        if "Código" in tabla:
+            tabla = tabla.sort_values("Código")
+        return tabla.rename_axis("Cuenta").reset_index()
+
+    def conciliar(self, titulo):
+        """Comprobantes contra los cobros/pagos que los cancelan, con estado y saldo pendiente
+        
+        Las líneas de cobro se agrupan por comprobante referenciado (un índice
+        hash: una pasada) y se cruzan con los comprobantes por ID con un join
+        externo, así el costo es lineal en comprobantes + líneas. Estados:
+        Cancelada, Parcial, Excedida (se aplicó más que el total), Sin aplicar
+        y Sin comprobante (la línea referencia un ID que no está en la descarga).
+        """
+        import numpy as np
+        import pandas as pd
+        nombre_comprobantes, nombre_cobros, contraparte, _ = CONCILIACIONES[titulo]
+        comprobantes = self.marcos.get((nombre_comprobantes, "principal"))
+        aplicaciones = self.marcos.get((nombre_cobros, "aplicaciones"))
+        if comprobantes is None or aplicaciones is None or "id" not in comprobantes:
+            return None
+        tolerancia = CONFIG_ANALITICA["TOLERANCIA"]
+        
+        aplicaciones = aplicaciones.dropna(subset=["comprobante"])
+        recibos = self.marcos.get((nombre_cobros, "principal"))
+        if recibos is not None and "id" in recibos and "padre" in aplicaciones:
+            fechas = recibos.drop_duplicates("id", keep="last").set_index("id")["fecha"]
+            aplicaciones = aplicaciones.assign(fecha_recibo=aplicaciones["padre"].map(fechas))
+        # Los IDs llegan como texto: se factorizan juntos a enteros para que el
+        # agrupamiento y el join trabajen sobre índices enteros y no de cadenas
+        comprobantes = comprobantes.dropna(subset=["id"]).drop_duplicates("id", keep="last")
+        codigos, claves = pd.factorize(pd.concat([comprobantes["id"], aplicaciones["comprobante"]], ignore_index=True))
+        comprobantes = comprobantes.assign(id=codigos[:len(comprobantes)])
+        aplicaciones = aplicaciones.assign(comprobante=codigos[len(comprobantes):])
+        agregados = {"Aplicado": ("aplicado", "sum"), "Líneas": ("aplicado", "size")}
+        if "fecha_recibo" in aplicaciones:
+            agregados["Última aplicación"] = ("fecha_recibo", "max")
+        por_comprobante = aplicaciones.groupby("comprobante").agg(**agregados)
+        
+        columnas = {"numero": "Número", "fecha": "Fecha", "fecha_vto": "Vencimiento",
+                    contraparte: contraparte.title(), f"{contraparte}_nombre": "Nombre", "importe": "Total"}
+        comprobantes = comprobantes.set_index("id")[[c for c in columnas if c in comprobantes]].rename(columns=columnas)
+        tabla = comprobantes.join(por_comprobante, how="outer")
+        tabla["Aplicado"] = tabla["Aplicado"].fillna(0.0)
+        tabla["Líneas"] = tabla["Líneas"].fillna(0).astype(int)
+        tabla["Pendiente"] = tabla["Total"] - tabla["Aplicado"]
+        estado = np.select(
+            [tabla["Total"].isna(), tabla["Aplicado"].abs() <= tolerancia,
+             tabla["Pendiente"].abs() <= tolerancia, tabla["Pendiente"] > 0],
+            ["Sin comprobante", "Sin aplicar", "Cancelada", "Parcial"], default="Excedida")
+        orden = ["Parcial", "Sin aplicar", "Excedida", "Sin comprobante", "Cancelada"]
+        tabla["Estado"] = pd.Categorical(estado, categories=orden, ordered=True)
+        tabla = tabla.sort_values(["Estado", "Fecha"] if "Fecha" in tabla else ["Estado"])
+        
+        conteo = tabla["Estado"].value_counts()
+        pendiente = tabla.loc[tabla["Estado"].isin(["Parcial", "Sin aplicar"]), "Pendiente"].sum()
+        emitir(f"🔗 {titulo}: " + ", ".join(f"{conteo[e]:,} {e.lower()}" for e in orden if conteo.get(e)) +
+               f" · pendiente {pendiente:,.2f}")
+        
+        for columna in ("Fecha", "Vencimiento", "Última aplicación"):
+            if columna in tabla:
+                tabla[columna] = tabla[columna].dt.strftime("%Y-%m-%d")
+        tabla["Estado"] = tabla["Estado"].astype(str)
+        primeras = [c for c in ("Número", "Fecha", "Vencimiento", contraparte.title(), "Nombre", "Total") if c in tabla]
+        tabla = tabla[primeras + ["Aplicado", "Pendiente", "Estado", "Líneas"] +
+                      (["Última aplicación"] if "Última aplicación" in tabla else [])]
+        tabla.index = np.asarray(claves, dtype=object)[tabla.index]
+        return tabla.rename_axis("Comprobante").reset_index()
+
+    def hojas(self):
+        """[(título de hoja, nombre de archivo, filas)] de los análisis con datos, con tipos nativos"""
+        analisis = [("Análisis Mensual", "analisis_mensual", self.mensual),
+                    ("Top Clientes", "analisis_top_clientes", self.top_clientes),
+                    ("Saldos Por Cuenta", "analisis_saldos_cuentas", self.saldos_cuentas)]
+        for titulo, (_, _, _, archivo) in CONCILIACIONES.items():
+            analisis.append((titulo, archivo, lambda titulo=titulo: self.conciliar(titulo)))
+        hojas = []
+        for titulo, archivo, calcular in analisis:
+            with obtener_metricas().medir_etapa(f"analitica.{archivo}"):
+                tabla = calcular()
+            if tabla is None:
+                continue
+            tabla = tabla.round(2).astype(object)
+            filas = [list(tabla.columns)] + tabla.where(tabla.notna(), None).values.tolist()
+            hojas.append((titulo, archivo, filas))
+        return hojas
+
+def nueva_analitica():
+    """AnaliticaCorrida si está habilitada y pandas está instalado, si no None"""
+    if not CONFIG_ANALITICA["HABILITADO"]:
+        return None
+    try:
+        import pandas  # noqa: F401
+    except ImportError:
+        emitir("⚠️ Análisis omitidos: requieren pandas", NIVEL_ERROR)
+        return None
+    return AnaliticaCorrida()
+
+def exportar_analitica(hojas, formato, directorio):
+    """Un archivo por análisis (analisis_mensual.csv, ...) con el backend columnar elegido"""
+    extension, exportador = EXPORTADORES_COLUMNARES[formato]
+    os.makedirs(directorio, exist_ok=True)
+    archivos = []
+    for _, tabla, filas in hojas:
+        ruta = os.path.join(directorio, f"{tabla}{extension}")
+        try:
+            exportador(tabla, iter(filas), ruta)
+        except ImportError as e:
+            emitir(f"   ❌ {formato} requiere pandas y pyarrow ({e})", NIVEL_ERROR)
+            break
+        archivos.append(ruta)
+    return archivos
+
+def generar_reporte_mensual(datos, filename="reporte_mensual.txt", estadisticas=None):
+    """Genera reporte enfocado en cobertura mensual
+    
+    Con `datos=None` (pipeline en streaming) todo sale de `estadisticas`.
+    """
+    if estadisticas is None:
+        estadisticas = calcular_estadisticas(datos)
+    if datos is None:
+        datos = {nombre: stats.registros for nombre, stats in estadisticas.items()}
     with open(filename, "w", encoding="utf-8") as f:
         f.write("REPORTE MENSUAL - XUBIO API\n")
         f.write("=" * 50 + "\n\n")
         f.write(f"Fecha de extracción: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write(f"Período: {CONFIG_FECHAS['FECHA_DESDE']} → {datetime.now().strftime('%Y-%m-%d')}\n")
+        f.write("Período: {} → {}\n".format(*periodo_configurado()))
         f.write(f"Método: Chunks mensuales + diagnóstico asientos\n\n")
         
         f.write("RESULTADOS POR ENDPOINT:\n")
         f.write("-" * 30 + "\n")
         
         for nombre, data in datos.items():
-            count = len(data) if data else 0
+            count = data if isinstance(data, int) else len(data) if data else 0
             f.write(f"\n{nombre.upper()}: {count} registros\n")
             
             if data:
-                # Analizar cobertura mensual
-                meses_con_datos = set()
-                fechas = []
+                # Cobertura mensual (precalculada en una sola pasada)
+                stats = estadisticas[nombre]
                 
-                for item in data:
-                    if isinstance(item, dict):
-                        for key, value in item.items():
-                            if 'fecha' in key.lower() and isinstance(value, str):
-                                try:
-                                    fecha = datetime.strptime(value[:10], "%Y-%m-%d")
-                                    fechas.append(fecha)
-                                    meses_con_datos.add(fecha.strftime("%Y-%m"))
-                                except:
-                                    pass
-                
-                if fechas:
-                    fecha_min = min(fechas)
-                    fecha_max = max(fechas)
-                    f.write(f"  Rango: {fecha_min.strftime('%Y-%m-%d')} → {fecha_max.strftime('%Y-%m-%d')}\n")
-                    f.write(f"  Meses con datos: {len(meses_con_datos)}\n")
+                if stats.por_mes:
+                    f.write(f"  Rango: {stats.fecha_min} → {stats.fecha_max}\n")
+                    f.write(f"  Meses con datos: {stats.meses_cubiertos}\n")
                     
-                    # Listar meses
-                    meses_ordenados = sorted(list(meses_con_datos))
-                    f.write(f"  Meses: {', '.join(meses_ordenados)}\n")
+                    # Listar meses con su cantidad de registros
+                    meses = [f"{mes} ({stats.por_mes[mes]})" for mes in stats.meses_ordenados()]
+                    f.write(f"  Meses: {', '.join(meses)}\n")
                 else:
                     f.write(f"  Sin fechas detectadas en los datos\n")
             else:
                 f.write(f"  Sin datos obtenidos\n")
 
-    print(f"📄 Reporte guardado: {filename}")
+    emitir(f"📄 Reporte guardado: {filename}")
+
+# Duración supuesta (segundos) cuando un endpoint todavía no tiene historial
+DURACION_ESTIMADA_POR_TIPO = {
+    "especial": 600,
+    "con_fechas": 120,
+    "sin_fechas": 30,
+}
+
+def iterar_archivado(endpoint_name):
+    """Registros de la última descarga completa del endpoint, desde el archivo crudo (--offline)"""
+    archivo = obtener_archivo()
+    manifiesto = archivo.manifiesto(endpoint_name)
+    if manifiesto is None:
+        emitir(f"📦 {endpoint_name}: ❌ no está en el archivo ({archivo.directorio}/)", NIVEL_ERROR)
+        return
+    emitir(f"📦 {endpoint_name}: {manifiesto['registros']} registros archivados el {manifiesto['actualizado']}")
+    desde, hasta = CONFIG_ARCHIVO["DESDE"], CONFIG_ARCHIVO["HASTA"]
+    cobertura = archivo.cobertura(endpoint_name) if desde or hasta else None
+    if cobertura and ((desde and desde < cobertura[0]) or (hasta and hasta > cobertura[1])):
+        emitir(f"   ⚠️ El archivo de {endpoint_name} cubre {cobertura[0]} → {cobertura[1]}: "
+               f"fuera de eso no hay datos", NIVEL_ERROR)
+    yield from archivo.iterar(endpoint_name, desde, hasta)
+
+def ejecutar_endpoint(token, nombre, endpoint, modo_completo_asientos=True):
+    """Descarga un endpoint con el método que le corresponde"""
+    if CONFIG_ARCHIVO["OFFLINE"]:
+        return list(iterar_archivado(nombre))
+    if nombre in ENDPOINTS_CON_FECHAS:
+        return get_data_monthly_chunks_only(token, nombre, endpoint)
+    elif nombre in ENDPOINTS_ESPECIALES:
+        if modo_completo_asientos:
+            return get_asientos_contables_con_detalle_mejorado(token, nombre, endpoint)
+        return get_asientos_contables_debug_solo(token, nombre, endpoint)
+    return get_data_simple_for_catalogs(token, nombre, endpoint)
+
+def _tipo_endpoint(nombre):
+    if nombre in ENDPOINTS_ESPECIALES:
+        return "especial"
+    if nombre in ENDPOINTS_CON_FECHAS:
+        return "con_fechas"
+    return "sin_fechas"
+
+def _estimar_duracion(nombre, duraciones):
+    if nombre in duraciones:
+        return duraciones[nombre]
+    return DURACION_ESTIMADA_POR_TIPO[_tipo_endpoint(nombre)]
+
+def _planificar_jobs(endpoints, max_paralelo=None):
+    """(paralelismo, endpoints ordenados del más largo al más corto según la corrida anterior)"""
+    if max_paralelo is None:
+        max_paralelo = CONFIG_CONCURRENCIA["MAX_ENDPOINTS_PARALELO"] if CONFIG_CONCURRENCIA["HABILITADO"] else 1
+    almacen = obtener_almacen()
+    duraciones = almacen.obtener_duraciones() if almacen else {}
+    orden = sorted(endpoints, key=lambda nombre: _estimar_duracion(nombre, duraciones), reverse=True)
+    return max(1, max_paralelo), orden
+
+def _registrar_fallo_endpoint(nombre, error):
+    diario = obtener_diario()
+    if diario:
+        diario.registrar_fallo(nombre, "endpoint", str(error))
+
+def _cancelar_jobs(pool):
+    """Ctrl-C o error del escritor: los jobs sin empezar se descartan y los demás cortan en su próximo request"""
+    _CANCELACION.set()
+    pool.shutdown(wait=False, cancel_futures=True)
 
-def main():
-    """Función principal con diagnóstico para asientos contables"""
+def orquestar_endpoints(token, endpoints, modo_completo_asientos=True, max_paralelo=None):
+    """Descarga varios endpoints a la vez bajo el presupuesto global de requests
+    
+    Todos los jobs comparten el limitador (requests/segundo) y el semáforo de
+    requests en vuelo. Se lanzan primero los más largos según la duración de
+    la corrida anterior, así el tiempo total se acerca al del job más largo.
+    Devuelve {nombre: registros} en el orden de `endpoints`.
+    """
+    max_paralelo, orden = _planificar_jobs(endpoints, max_paralelo)
+    almacen = obtener_almacen()
+    total = len(orden)
+    
+    def job(posicion, nombre):
+        emitir(f"[{posicion}/{total}] 🎯 {nombre.upper()}")
+        inicio = time.monotonic()
+        try:
+            data = deduplicar_registros(nombre, ejecutar_endpoint(token, nombre, endpoints[nombre],
+                                                                  modo_completo_asientos))
+        except Exception as e:
+            emitir(f"❌ {nombre}: {e}", NIVEL_ERROR)
+            _registrar_fallo_endpoint(nombre, e)
+            data = []
+        duracion = time.monotonic() - inicio
+        obtener_metricas().registrar_etapa(f"descarga.{nombre}", duracion,
+                                           tipo=_tipo_endpoint(nombre), registros=len(data))
+        if almacen and not CONFIG_ARCHIVO["OFFLINE"]:
+            almacen.guardar_duracion(nombre, duracion)
+        return data, duracion
+    
+    resultados = {}
+    with ThreadPoolExecutor(max_workers=max_paralelo) as pool:
+        futuros = {pool.submit(job, i, nombre): nombre for i, nombre in enumerate(orden, 1)}
+        try:
+            for futuro in as_completed(futuros):
+                nombre = futuros[futuro]
+                data, duracion = futuro.result()
+                resultados[nombre] = data
+                emitir(f"   ⏱️ {nombre} terminado en {duracion:.1f}s ({len(data)} registros)")
+        except BaseException:
+            _cancelar_jobs(pool)
+            raise
+    
+    return {nombre: resultados[nombre] for nombre in endpoints}
+
+def iterar_endpoint(token, nombre, endpoint, modo_completo_asientos=True):
+    """Como ejecutar_endpoint, pero generando los registros a medida que llegan"""
+    if CONFIG_ARCHIVO["OFFLINE"]:
+        return iterar_archivado(nombre)
+    if nombre in ENDPOINTS_CON_FECHAS:
+        return iterar_ventanas(token, nombre, endpoint)
+    elif nombre in ENDPOINTS_ESPECIALES:
+        if modo_completo_asientos:
+            return iterar_asientos_con_detalle(token, nombre, endpoint)
+        return iter(get_asientos_contables_debug_solo(token, nombre, endpoint))
+    return _iterar_catalogo_reportado(token, nombre, endpoint)
+
+def _iterar_catalogo_reportado(token, endpoint_name, endpoint):
+    """iterar_catalogo con el reporte de consola de get_data_simple_for_catalogs"""
+    import requests
+    emitir(f"📋 Descargando {endpoint_name} (catálogo sin fechas)")
+    cantidad = 0
     try:
-        print("🚀 XUBIO API - DESCARGA CON DIAGNÓSTICO DE ASIENTOS")
-        print("=" * 60)
-        print("📅 MÉTODO: Chunks mensuales + diagnóstico automático")
-        print(f"🎯 PERÍODO: Enero 2024 → Septiembre 2025")
-        
-        if not CLIENT_ID or not SECRET_ID:
-            print("❌ Credenciales no configuradas en .env")
+        for registro in iterar_catalogo(token, endpoint_name, endpoint):
+            cantidad += 1
+            yield registro
+        emitir(f"   ✅ {cantidad} registros obtenidos\n")
+    except json.JSONDecodeError:
+        emitir(f"   ⚠️ JSON inválido (tras {cantidad} registros)\n", NIVEL_ERROR)
+    except requests.exceptions.HTTPError as e:
+        emitir(f"   ❌ Error {e.response.status_code}\n", NIVEL_ERROR)
+
+class ProcesadorEndpoint:
+    """Consume los registros de un endpoint sin retenerlos: estadísticas, esquema y spool por tabla
+
+    Los primeros MUESTRA registros se retienen para elegir el esquema (el del
+    registro de esquemas si existe); después cada registro se aplana y se
+    vuelca al spool apenas llega. Campos de primer nivel que el esquema no
+    conoce van como JSON a la columna _columnas_extra.
+    
+    Con la muestra también se detecta la clave primaria: cada registro pasa por
+    un IndiceClaves y una clave repetida se descarta o, si la nueva versión es
+    más completa, reemplaza a la anterior (cuya fila queda descartada en el spool).
+
+    Con volcar=False (fetch y report: no hay salidas que escribir) solo se
+    deduplica y se acumulan las estadísticas; no hay esquema, aplanado ni spool.
+    """
+
+    COLUMNA_EXTRA = "_columnas_extra"
+
+    def __init__(self, nombre, volcar=True):
+        self.nombre = nombre
+        self.volcar = volcar
+        self._aceptados = 0        # Registros aceptados sin spool (volcar=False)
+        self.estadisticas = EstadisticasFechas()
+        self.esquema = None
+        self.tablas = []           # [TablaSpool]: la principal y las hijas
+        self.campos = set()
+        self.segundos_aplanado = 0.0
+        self.indice = None
+        self._muestra = []
+        self._claves = frozenset()
+        self._descartadas = set()
+        self._columna_extra = None
+
+    def agregar(self, registro):
+        if self._muestra is not None:
+            self._muestra.append(registro)
+            if len(self._muestra) >= CONFIG_ESQUEMA["MUESTRA"]:
+                self._iniciar_esquema()
             return
+        self._aceptar(registro)
+
+    def _iniciar_esquema(self):
+        muestra, self._muestra = self._muestra, None
+        if self.volcar and CONFIG_ESQUEMA["HABILITADO"]:
+            self.esquema = obtener_registro_esquemas().esquema_para_muestra(self.nombre, muestra)
+            self._claves = frozenset(self.esquema.esquema)
+            self.tablas = [TablaSpool(self.nombre, self.esquema.columnas, self._descartadas)]
+            self.tablas += [TablaSpool(self.esquema.nombre_tabla_hija(campo), self.esquema.columnas_hija(campo),
+                                       self._descartadas, con_padre=True,
+                                       renumerar=self.esquema.clave_padre is None)
+                            for campo in self.esquema.campos_hijos]
+        elif self.volcar:
+            # Aplanado clásico: las columnas salen de la muestra
+            self._claves = frozenset(columnas_union(muestra))
+            self.tablas = [TablaSpool(self.nombre, columnas_union(muestra), self._descartadas)]
+        if CONFIG_DEDUP["HABILITADO"]:
+            campo = detectar_clave_primaria(self.nombre, muestra)
+            self.indice = IndiceClaves(campo) if campo else None
+        for registro in muestra:
+            self._aceptar(registro)
+
+    def _aceptar(self, registro):
+        """Deduplica contra el índice y vuelca; un reemplazo descarta la fila anterior y sus hijas"""
+        if self.indice is not None and registro.__class__ is dict:
+            previo = self.indice.registrar(registro, self.tablas[0].cantidad if self.volcar else self._aceptados)
+            if previo is not None:
+                anterior, mas_completo = previo
+                if mas_completo:
+                    self._descartadas.add(anterior)
+                    self._volcar(registro)
+                return
+        self.estadisticas.agregar(registro)
+        self._volcar(registro)
+
+    def _volcar(self, registro):
+        if registro.__class__ is not dict:
+            return
+        if not self.volcar:
+            self._aceptados += 1
+            return
+        inicio = time.perf_counter()
+        self.campos |= registro.keys()
+        if self.esquema:
+            fila = self.esquema.extraer(registro, None)
+        else:
+            plano = aplanar_item_final(registro)
+            fila = tuple(_celda(plano.get(col)) for col in self.tablas[0].columnas[:len(self._claves)])
+        extra = registro.keys() - self._claves
+        if extra:
+            if self._columna_extra is None:
+                principal = self.tablas[0]
+                # Las filas previas quedan más cortas y se completan al escribir
+                self._columna_extra = principal.agregar_columna(self.COLUMNA_EXTRA)
+            relleno = (None,) * (self._columna_extra - len(fila))
+            fila = fila + relleno + (json.dumps({k: registro[k] for k in sorted(extra)},
+                                                 ensure_ascii=False, default=str),)
+        posicion = self.tablas[0].cantidad
+        self.tablas[0].agregar(fila)
+        if self.esquema:
+            for campo, tabla in zip(self.esquema.campos_hijos, self.tablas[1:]):
+                for fila_hija in self.esquema.filas_de_hija(campo, registro, posicion + 1, None):
+                    tabla.agregar(fila_hija, posicion)
+        self.segundos_aplanado += time.perf_counter() - inicio
+
+    def cerrar(self):
+        """Vuelca lo que quedó en la muestra y registra los campos vistos"""
+        if self._muestra:
+            self._iniciar_esquema()
+        self._muestra = None
+        if self.esquema and self.campos:
+            obtener_registro_esquemas().actualizar_campos(self.nombre, self.esquema, self.campos)
+        duplicados = 0
+        if self.indice:
+            self.indice.informar(self.nombre)
+            duplicados = self.indice.duplicados + self.indice.reemplazados
+        obtener_metricas().registrar_etapa("aplanado", self.segundos_aplanado, endpoint=self.nombre,
+                                           registros=self.estadisticas.registros, duplicados=duplicados)
+        return self
+
+    def liberar(self):
+        for tabla in self.tablas:
+            tabla.cerrar()
+        self.tablas = []
+
+class EscritorSalidas:
+    """Único escritor de la corrida: Excel write-only y archivos columnares, endpoint por endpoint"""
+
+    def __init__(self, excel_filename, formatos, directorio):
+        self.excel_filename = excel_filename
+        self.formatos = [f for f in formatos if f in EXPORTADORES_COLUMNARES]
+        self.directorio = directorio
+        self.archivos = []
+        self.wb = None
+        self._resumen = [["Endpoint", "Registros", "Fecha Más Antigua", "Fecha Más Reciente", "Meses Cubiertos"]]
+        if excel_filename:
+            import openpyxl
+            self.wb = openpyxl.Workbook(write_only=True)
+            # Se crea primero para que quede como primera hoja; se completa al final
+            self._hoja_resumen = self.wb.create_sheet(title="Resumen")
+        self.analitica = nueva_analitica() if excel_filename or self.formatos else None
+        # Sin Excel ni columnar (fetch, report) los endpoints no necesitan aplanado ni spool
+        self.necesita_filas = self.wb is not None or bool(self.formatos)
+
+    def escribir(self, procesador):
+        nombre = procesador.nombre
+        stats = procesador.estadisticas
+        metricas = obtener_metricas()
+        tablas = [t for t in procesador.tablas if t.cantidad or t is procesador.tablas[0]]
         
-        fecha_hasta = datetime.now().strftime("%Y-%m-%d")
-        print(f"🔧 Configuración:")
-        print(f"   • Desde: {CONFIG_FECHAS['FECHA_DESDE']}")
-        print(f"   • Hasta: {fecha_hasta}")
-        print(f"   • Cliente: {CLIENT_ID[:15]}...")
-        
+        if self.wb is not None:
+            with metricas.medir_etapa("exportar.excel", endpoint=nombre):
+                if not stats.registros:
+                    ws = self.wb.create_sheet(title=nombre.replace('_', ' ').title()[:31])
+                    ws.append(["Sin datos disponibles"])
+                for tabla in tablas if stats.registros else []:
+                    ws = self.wb.create_sheet(title=tabla.nombre.replace('_', ' ').title()[:31])
+                    tabla.escribir_hoja(ws, CONFIG_EXPORTACION["ANCHO_MAXIMO"])
         
-        token = get_token()
-        print("✅ Token obtenido\n")
+        for formato in list(self.formatos):
+            if not stats.registros:
+                continue
+            extension, exportador = EXPORTADORES_COLUMNARES[formato]
+            os.makedirs(self.directorio, exist_ok=True)
+            # Para CSV los faltantes van vacíos; en Parquet/Feather como nulos
+            faltante = "" if formato == "csv" else None
+            try:
+                with metricas.medir_etapa(f"exportar.{formato}", endpoint=nombre):
+                    for tabla in tablas:
+                        ruta = os.path.join(self.directorio, f"{tabla.nombre}{extension}")
+                        exportador(tabla.nombre, tabla.filas(faltante), ruta)
+                        self.archivos.append(ruta)
+            except ImportError as e:
+                emitir(f"   ❌ {formato} requiere pandas y pyarrow ({e})", NIVEL_ERROR)
+                self.formatos.remove(formato)
         
-        datos = {}
+        if self.analitica and stats.registros:
+            with metricas.medir_etapa("analitica.carga", endpoint=nombre):
+                self.analitica.agregar(nombre, [(tabla.nombre, tabla.filas()) for tabla in tablas])
         
-        print("📥 DESCARGA CON MÉTODOS OPTIMIZADOS:")
-        print("=" * 45)
+        self._resumen.append([nombre, stats.registros, stats.fecha_min or "", stats.fecha_max or "",
+                              stats.meses_cubiertos])
+
+    def cerrar(self):
+        """Calcula los análisis, completa el resumen y guarda el Excel"""
+        hojas = self.analitica.hojas() if self.analitica else []
+        if self.wb is not None:
+            with obtener_metricas().medir_etapa("exportar.excel"):
+                for titulo, _, filas in hojas:
+                    _escribir_hoja_streaming(self.wb.create_sheet(title=titulo), filas,
+                                             CONFIG_EXPORTACION["ANCHO_MAXIMO"])
+                # El resumen no tiene tope de ancho, igual que en el modo clásico
+                _escribir_hoja_streaming(self._hoja_resumen, self._resumen, float("inf"))
+                self.wb.save(self.excel_filename)
+            emitir(f"✅ Exportado: {self.excel_filename}")
+        for formato in self.formatos:
+            with obtener_metricas().medir_etapa(f"exportar.{formato}"):
+                self.archivos.extend(exportar_analitica(hojas, formato, self.directorio))
+        if hojas:
+            emitir(f"📈 Análisis: {', '.join(titulo for titulo, _, _ in hojas)}")
+        if self.archivos:
+            emitir(f"✅ Exportados {len(self.archivos)} archivos en {self.directorio}/")
+
+def ejecutar_pipeline(token, endpoints, escritor, modo_completo_asientos=True, max_paralelo=None):
+    """Descarga, aplana, resume y escribe cada endpoint sin juntar el historial en memoria
+
+    Los endpoints se descargan en paralelo (como orquestar_endpoints) y cada
+    job pasa sus registros por un ProcesadorEndpoint a medida que llegan. Este
+    hilo es el único escritor: toma los endpoints en el orden de `endpoints`
+    y escribe cada uno apenas termina, mientras el resto sigue bajando.
+    Devuelve {nombre: EstadisticasFechas}.
+    """
+    max_paralelo, orden = _planificar_jobs(endpoints, max_paralelo)
+    almacen = obtener_almacen()
+    total = len(orden)
+    posiciones = {nombre: i for i, nombre in enumerate(orden, 1)}
+    
+    def job(nombre):
+        emitir(f"[{posiciones[nombre]}/{total}] 🎯 {nombre.upper()}")
+        procesador = ProcesadorEndpoint(nombre, volcar=escritor.necesita_filas)
+        inicio = time.monotonic()
+        try:
+            for registro in iterar_endpoint(token, nombre, endpoints[nombre], modo_completo_asientos):
+                procesador.agregar(registro)
+        except Exception as e:
+            emitir(f"❌ {nombre}: {e}", NIVEL_ERROR)
+            _registrar_fallo_endpoint(nombre, e)
+        procesador.cerrar()
+        duracion = time.monotonic() - inicio
+        obtener_metricas().registrar_etapa(f"descarga.{nombre}", duracion, tipo=_tipo_endpoint(nombre),
+                                           registros=procesador.estadisticas.registros)
+        if almacen and not CONFIG_ARCHIVO["OFFLINE"]:
+            almacen.guardar_duracion(nombre, duracion)
+        emitir(f"   ⏱️ {nombre} terminado en {duracion:.1f}s ({procesador.estadisticas.registros} registros)")
+        return procesador
+    
+    estadisticas = {}
+    with ThreadPoolExecutor(max_workers=max_paralelo) as pool:
+        futuros = {nombre: pool.submit(job, nombre) for nombre in orden}
+        try:
+            for nombre in endpoints:
+                procesador = futuros.pop(nombre).result()
+                try:
+                    escritor.escribir(procesador)
+                finally:
+                    procesador.liberar()
+                estadisticas[nombre] = procesador.estadisticas
+        except BaseException:
+            _cancelar_jobs(pool)
+            raise
+    return estadisticas
+
+COMANDOS = {
+    "fetch": "Solo descarga: llena archivo crudo, almacén y diario, sin generar salidas",
+    "export": "Genera Excel/columnar y reporte desde el archivo crudo, sin requests",
+    "report": "Genera solo el reporte mensual desde el archivo crudo, sin requests",
+    "diagnose": "Estado del archivo crudo, diario y almacén, y estructura de los asientos",
+}
+
+def _fecha_argumento(valor):
+    try:
+        datetime.strptime(valor, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"fecha inválida: {valor} (usar AAAA-MM-DD)")
+    return valor
+
+def _agregar_opciones(parser, suprimir=False):
+    """Opciones comunes a la corrida sin subcomando y a cada subcomando
+    
+    En los subcomandos (suprimir=True) no tienen default, así no pisan las que
+    se pasaron antes del nombre del subcomando.
+    """
+    defecto = (lambda valor: argparse.SUPPRESS) if suprimir else (lambda valor: valor)
+    
+    seleccion = parser.add_argument_group("período y endpoints")
+    seleccion.add_argument("--desde", type=_fecha_argumento, metavar="AAAA-MM-DD", default=defecto(None),
+                           help=f"Inicio del período (por defecto: {CONFIG_FECHAS['FECHA_DESDE']}; "
+                                "offline, export y report filtran el archivo crudo)")
+    seleccion.add_argument("--hasta", type=_fecha_argumento, metavar="AAAA-MM-DD", default=defecto(None),
+                           help="Fin del período (por defecto: hoy; offline, hasta el final del archivo)")
+    seleccion.add_argument("--endpoints", nargs="+", choices=list(ENDPOINTS_FUNCIONALES), metavar="ENDPOINT",
+                           default=defecto(None),
+                           help=f"Endpoints a procesar (por defecto todos: {', '.join(ENDPOINTS_FUNCIONALES)})")
+    seleccion.add_argument("--full-refresh", action="store_true", default=defecto(False),
+                           help="Ignora el almacén local y descarga todo el historial")
+    seleccion.add_argument("--solo-estructura", action="store_true", default=defecto(False),
+                           help="Asientos: solo muestra la estructura del primero, sin descargar detalles")
+    
+    concurrencia = parser.add_argument_group("concurrencia")
+    concurrencia.add_argument("--workers", type=int, metavar="N", default=defecto(None),
+                              help=f"Ventanas descargadas en paralelo por endpoint "
+                                   f"(por defecto: {CONFIG_CONCURRENCIA['MAX_WORKERS']})")
+    concurrencia.add_argument("--endpoints-paralelo", type=int, metavar="N", default=defecto(None),
+                              help=f"Endpoints descargados a la vez "
+                                   f"(por defecto: {CONFIG_CONCURRENCIA['MAX_ENDPOINTS_PARALELO']})")
+    concurrencia.add_argument("--rps", type=float, metavar="TASA", default=defecto(None),
+                              help=f"Requests por segundo del limitador "
+                                   f"(por defecto: {CONFIG_CONCURRENCIA['REQUESTS_POR_SEGUNDO']})")
+    
+    salida = parser.add_argument_group("salidas")
+    salida.add_argument("--formato", nargs="+", default=defecto(["excel"]),
+                        choices=["excel"] + list(EXPORTADORES_COLUMNARES),
+                        help="Formatos de salida (por defecto: excel)")
+    salida.add_argument("--excel-clasico", action="store_true", default=defecto(False),
+                        help="Exporta con workbook en memoria en lugar del modo streaming")
+    
+    corrida = parser.add_argument_group("corrida")
+    corrida.add_argument("--cache-token", action="store_true", default=defecto(False),
+                         help=f"Guarda el token en {CONFIG_TOKEN['RUTA_CACHE']} y lo reutiliza mientras esté vigente")
+    corrida.add_argument("-v", "--verbose", action="count", default=defecto(0),
+                         help="Más detalle en consola (-vv muestra cada request HTTP)")
+    corrida.add_argument("-q", "--silencioso", action="store_true", default=defecto(False),
+                         help="Solo muestra errores")
+    corrida.add_argument("--perfilar", action="store_true", default=defecto(False),
+                         help="Perfila la exportación con cProfile (.prof y .txt junto a las métricas)")
+    corrida.add_argument("--sin-metricas", action="store_true", default=defecto(False),
+                         help="No escribe los archivos de métricas de la corrida")
+    corrida.add_argument("--lote", nargs="*", metavar="PERFIL", default=defecto(None),
+                         help="Corre varias empresas en paralelo, una por proceso (sin nombres: XUBIO_PERFILES); "
+                              "va después del subcomando")
+    corrida.add_argument("--procesos", type=int, default=defecto(None),
+                         help="Procesos simultáneos del modo lote (por defecto: uno por núcleo)")
+    corrida.add_argument("--offline", action="store_true", default=defecto(False),
+                         help=f"Regenera Excel y reporte solo desde el archivo crudo ({CONFIG_ARCHIVO['DIRECTORIO']}/), sin requests")
+    corrida.add_argument("--resume", action="store_true", default=defecto(False),
+                         help=f"Retoma la última corrida sin terminar desde {CONFIG_DIARIO['RUTA']}: "
+                              "solo descarga lo que faltaba y vuelve a generar las salidas")
+
+def parsear_argumentos(argv=None):
+    """Opciones de línea de comandos
+    
+    Sin subcomando se hace la corrida completa (descarga y salidas); los
+    subcomandos separan las etapas.
+    """
+    parser = argparse.ArgumentParser(description="Descarga de datos de Xubio a Excel")
+    _agregar_opciones(parser)
+    subcomandos = parser.add_subparsers(dest="comando", metavar="COMANDO",
+                                        help="Etapa a ejecutar (sin comando: descarga y salidas)")
+    for nombre, ayuda in COMANDOS.items():
+        _agregar_opciones(subcomandos.add_parser(nombre, help=ayuda, description=ayuda), suprimir=True)
+    args = parser.parse_args(argv)
+    if args.comando == "fetch" and args.offline:
+        parser.error("fetch descarga desde la API: no se puede combinar con --offline")
+    return args
+
+def mostrar_resumen_metricas(resumen):
+    """Tiempo por etapa y latencias HTTP de la corrida"""
+    http = resumen["http"]
+    emitir(f"\n📏 MÉTRICAS ({resumen['duracion_total']:.1f}s)")
+    if http["requests"]:
+        emitir(f"   • HTTP: {http['requests']} requests, {http['reintentos']} reintentos, "
+               f"{http['bytes'] / 1_048_576:.1f} MB, latencia p50 {http['latencia_p50'] * 1000:.0f}ms "
+               f"/ p90 {http['latencia_p90'] * 1000:.0f}ms / p99 {http['latencia_p99'] * 1000:.0f}ms")
+    for nombre, etapa in sorted(resumen["etapas"].items(), key=lambda x: x[1]["segundos"], reverse=True):
+        emitir(f"   • {nombre:<28} {etapa['segundos']:>8.2f}s", NIVEL_DETALLE)
+    for nombre, datos in resumen["http_por_endpoint"].items():
+        emitir(f"   • {nombre:<28} {datos['requests']:>6} req  p50 {datos['latencia_p50'] * 1000:>6.0f}ms  "
+               f"p99 {datos['latencia_p99'] * 1000:>6.0f}ms  status {datos['status']}", NIVEL_DETALLE)
+
+def cargar_perfiles(nombres=None):
+    """{perfil: (client_id, client_secret)} desde CLIENT_ID_<PERFIL>/CLIENT_SECRET_<PERFIL> del .env"""
+    if not nombres:
+        nombres = [n.strip() for n in os.getenv("XUBIO_PERFILES", "").split(",") if n.strip()]
+    perfiles = {}
+    for nombre in nombres:
+        sufijo = nombre.upper().replace("-", "_")
+        perfiles[nombre] = (os.getenv(f"CLIENT_ID_{sufijo}"), os.getenv(f"CLIENT_SECRET_{sufijo}"))
+    return perfiles
+
+# Rutas de archivos locales tal como están configuradas; el modo lote las ancla en el directorio de cada perfil
+_RUTAS_LOCALES = [(config, clave, config[clave]) for config, clave in (
+    (CONFIG_ALMACEN, "RUTA"), (CONFIG_DIARIO, "RUTA"), (CONFIG_ARCHIVO, "DIRECTORIO"),
+    (CONFIG_METRICAS, "DIRECTORIO"), (CONFIG_TOKEN, "RUTA_CACHE"))]
+
+def reiniciar_estado_proceso(directorio):
+    """Descarta los compartidos del proceso y resuelve las rutas locales dentro de `directorio`
+    
+    ProcessPoolExecutor reutiliza los procesos: sin esto, el segundo perfil que
+    cae en un proceso seguiría usando el almacén, los esquemas, la sesión y el
+    limitador del primero.
+    """
+    global _ALMACEN, _ARCHIVO, _DIARIO, _REGISTRO_ESQUEMAS, _METRICAS
+    global _LIMITADOR_GLOBAL, _SEMAFORO_EN_VUELO, _CONTROL_GLOBAL, _SESION_HTTP
+    with _SESION_LOCK:
+        if _ALMACEN is not None:
+            _ALMACEN.cerrar()
+        if _SESION_HTTP is not None:
+            _SESION_HTTP.close()
+        _ALMACEN = _ARCHIVO = _DIARIO = _SESION_HTTP = None
+    with _REGISTRO_ESQUEMAS_LOCK:
+        _REGISTRO_ESQUEMAS = None
+    with _LIMITADOR_LOCK:
+        _LIMITADOR_GLOBAL = _SEMAFORO_EN_VUELO = _CONTROL_GLOBAL = None
+    with _METRICAS_LOCK:
+        _METRICAS = None
+    _CATALOGOS_SIN_CAMBIOS.clear()
+    for config, clave, ruta in _RUTAS_LOCALES:
+        config[clave] = os.path.join(directorio, ruta)
+
+def _ejecutar_perfil(perfil, client_id, client_secret, directorio, args):
+    """Corrida completa de una empresa en su propio proceso
+    
+    El proceso tiene su limitador, su token y su almacén: todo se crea en
+    `directorio`, así las empresas no comparten caché, diario ni salidas.
+    """
+    global CLIENT_ID, SECRET_ID, _PREFIJO_CONSOLA
+    CLIENT_ID, SECRET_ID = client_id, client_secret
+    _PREFIJO_CONSOLA = f"[{perfil}] "
+    directorio = os.path.abspath(directorio)
+    os.makedirs(directorio, exist_ok=True)
+    os.chdir(directorio)
+    reiniciar_estado_proceso(directorio)
+    inicio = time.monotonic()
+    try:
+        resultado = ejecutar_corrida(args)
+    except KeyboardInterrupt:
+        resultado = {"estado": "interrumpida", "conteos": {}, "archivos": [], "pendientes": 0, "error": None}
+    resultado.update(perfil=perfil, directorio=directorio, duracion=time.monotonic() - inicio)
+    return resultado
+
+def exportar_resumen_lote(resultados, filename):
+    """Libro consolidado del lote: estado por empresa y registros por endpoint"""
+    import openpyxl
+    wb = openpyxl.Workbook(write_only=True)
+    ancho_maximo = CONFIG_EXPORTACION["ANCHO_MAXIMO"]
+    
+    filas = [["Perfil", "Estado", "Duración (s)", "Registros", "Unidades pendientes", "Directorio", "Archivos", "Error"]]
+    for r in resultados:
+        filas.append([r["perfil"], r["estado"], round(r["duracion"], 1), sum(r["conteos"].values()),
+                      r["pendientes"], r["directorio"], ", ".join(r["archivos"]), r["error"] or ""])
+    _escribir_hoja_streaming(wb.create_sheet(title="Resumen"), filas, ancho_maximo)
+    
+    perfiles = [r["perfil"] for r in resultados]
+    filas = [["Endpoint"] + perfiles + ["Total"]]
+    for nombre in ENDPOINTS_FUNCIONALES:
+        conteos = [r["conteos"].get(nombre, 0) for r in resultados]
+        filas.append([nombre] + conteos + [sum(conteos)])
+    _escribir_hoja_streaming(wb.create_sheet(title="Registros"), filas, ancho_maximo)
+    wb.save(filename)
+
+def ejecutar_lote(args):
+    """Corre la extracción de varias empresas en paralelo, un proceso por perfil
+    
+    Cada proceso usa ejecutar_corrida con las opciones de la línea de comandos
+    (formatos, --resume, --full-refresh...) y sus propias credenciales. Al final
+    se escribe xubio_lote_{timestamp}.xlsx con el resumen de todas.
+    """
+    perfiles = cargar_perfiles(args.lote)
+    CONFIG_METRICAS["VERBOSIDAD"] = NIVEL_ERROR if args.silencioso else NIVEL_NORMAL + args.verbose
+    if not perfiles:
+        emitir("❌ No hay perfiles: definir XUBIO_PERFILES o pasar nombres a --lote", NIVEL_ERROR)
+        return []
+    sin_credenciales = [p for p, (cid, secreto) in perfiles.items() if not cid or not secreto]
+    if sin_credenciales:
+        emitir(f"❌ Faltan CLIENT_ID_/CLIENT_SECRET_ para: {', '.join(sin_credenciales)}", NIVEL_ERROR)
+        return []
+    
+    procesos = args.procesos or CONFIG_LOTE["MAX_PROCESOS"] or os.cpu_count() or 1
+    procesos = max(1, min(procesos, len(perfiles)))
+    raiz = os.path.abspath(CONFIG_LOTE["DIRECTORIO"])
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    emitir(f"🏢 MODO LOTE: {len(perfiles)} empresas, {procesos} procesos → {raiz}/")
+    
+    resultados = {}
+    # spawn: cada proceso arranca limpio (sin hilos ni sesiones heredadas), también en Windows
+    contexto = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=procesos, mp_context=contexto) as pool:
+        futuros = {pool.submit(_ejecutar_perfil, perfil, cid, secreto, os.path.join(raiz, perfil), args): perfil
+                   for perfil, (cid, secreto) in perfiles.items()}
+        try:
+            for futuro in as_completed(futuros):
+                perfil = futuros[futuro]
+                try:
+                    resultados[perfil] = futuro.result()
+                except Exception as e:
+                    resultados[perfil] = {"perfil": perfil, "estado": "error", "conteos": {}, "archivos": [],
+                                          "pendientes": 0, "error": str(e), "duracion": 0.0,
+                                          "directorio": os.path.join(raiz, perfil)}
+                r = resultados[perfil]
+                emitir(f"🏁 {perfil}: {r['estado']} ({sum(r['conteos'].values()):,} registros, {r['duracion']:.1f}s)")
+        except KeyboardInterrupt:
+            # Los procesos reciben el mismo Ctrl-C y cierran su diario por su cuenta
+            pool.shutdown(wait=True, cancel_futures=True)
+            emitir("⛔ Lote interrumpido: continuar con --lote ... --resume", NIVEL_ERROR)
+            return list(resultados.values())
+    
+    resultados = [resultados[perfil] for perfil in perfiles]
+    os.makedirs(raiz, exist_ok=True)
+    filename = os.path.join(raiz, f"xubio_lote_{timestamp}.xlsx")
+    exportar_resumen_lote(resultados, filename)
+    exitosas = sum(1 for r in resultados if r["estado"] == "ok")
+    emitir(f"\n📊 Resumen del lote: {filename}")
+    emitir(f"🎯 Empresas completas: {exitosas}/{len(resultados)}")
+    return resultados
+
+def diagnosticar(endpoints, offline=False):
+    """Subcomando diagnose: qué hay guardado localmente y cómo viene un asiento
+    
+    Lee el archivo crudo, el diario y el almacén sin modificarlos. Con
+    credenciales (y sin --offline) muestra además la estructura del primer
+    asiento contable, como el antiguo modo de debug.
+    """
+    CONFIG_ARCHIVO["OFFLINE"] = False
+    resultado = {"timestamp": None, "estado": "ok", "conteos": {}, "archivos": [], "pendientes": 0, "error": None}
+    emitir("🩺 DIAGNÓSTICO")
+    emitir("=" * 60)
+    
+    archivo = obtener_archivo()
+    almacen = obtener_almacen()
+    duraciones = almacen.obtener_duraciones() if almacen else {}
+    emitir(f"📦 Archivo crudo ({archivo.directorio}/):" if archivo else "📦 Archivo crudo deshabilitado")
+    for nombre in endpoints:
+        manifiesto = archivo.manifiesto(nombre) if archivo else None
+        duracion = f", última descarga {duraciones[nombre]:.1f}s" if nombre in duraciones else ""
+        if manifiesto:
+            resultado["conteos"][nombre] = manifiesto["registros"]
+            emitir(f"   ✅ {nombre:<20}: {manifiesto['registros']:>8,} registros en "
+                   f"{len(manifiesto['unidades'])} unidades ({manifiesto['actualizado']}{duracion})")
+        else:
+            emitir(f"   ❌ {nombre:<20}: sin archivar{duracion}")
+    
+    pendiente = DiarioCorrida.pendiente(CONFIG_DIARIO["RUTA"]) if CONFIG_DIARIO["HABILITADO"] else None
+    if pendiente:
+        timestamp, unidades = pendiente
+        resultado["pendientes"] = sum(unidades.values())
+        emitir(f"📓 Corrida {timestamp} sin terminar: {resultado['pendientes']} unidades completas "
+               f"({', '.join(f'{e}: {n}' for e, n in sorted(unidades.items())) or 'ninguna'}), "
+               f"continuar con --resume")
+    else:
+        emitir("📓 No hay corridas sin terminar")
+    
+    especiales = [nombre for nombre in endpoints if nombre in ENDPOINTS_ESPECIALES]
+    if especiales and not offline:
+        if not CLIENT_ID or not SECRET_ID:
+            emitir("⚠️ Sin credenciales en .env: no se consulta la estructura de asientos", NIVEL_ERROR)
+            return resultado
+        try:
+            token = GestorToken()
+            if not token.vigente():
+                token.obtener()
+        except Exception as e:
+            emitir(f"❌ No se pudo obtener el token: {e}", NIVEL_ERROR)
+            resultado.update(estado="error", error=str(e))
+            return resultado
+        for nombre in especiales:
+            emitir("")
+            get_asientos_contables_debug_solo(token, nombre, endpoints[nombre])
+    return resultado
+
+def main(argv=None):
+    """Punto de entrada: una corrida, o el modo lote con --lote"""
+    args = parsear_argumentos(argv)
+    if args.lote is not None:
+        return ejecutar_lote(args)
+    return ejecutar_corrida(args)
+
+def ejecutar_corrida(args):
+    """Función principal con diagnóstico para asientos contables
+    
+    Devuelve un resumen de la corrida (estado, registros por endpoint y archivos
+    generados) que usa el modo lote para el libro consolidado.
+    """
+    comando = getattr(args, "comando", None)
+    # export y report trabajan solo con el archivo crudo; fetch y report no escriben Excel ni columnar
+    offline = args.offline or comando in ("export", "report")
+    CONFIG_ALMACEN["FULL_REFRESH"] = args.full_refresh
+    CONFIG_EXPORTACION["EXCEL_STREAMING"] = not args.excel_clasico
+    CONFIG_EXPORTACION["FORMATOS"] = [] if comando in ("fetch", "report") else args.formato
+    CONFIG_TOKEN["CACHE_EN_DISCO"] = args.cache_token
+    CONFIG_METRICAS["VERBOSIDAD"] = NIVEL_ERROR if args.silencioso else NIVEL_NORMAL + args.verbose
+    CONFIG_METRICAS["PERFILAR"] = args.perfilar
+    CONFIG_ARCHIVO["OFFLINE"] = offline
+    CONFIG_ARCHIVO["DESDE"], CONFIG_ARCHIVO["HASTA"] = (args.desde, args.hasta) if offline else (None, None)
+    if args.desde:
+        CONFIG_FECHAS["FECHA_DESDE"] = args.desde
+    if args.hasta:
+        CONFIG_FECHAS["FECHA_HASTA"] = args.hasta
+    if args.workers:
+        CONFIG_CONCURRENCIA["MAX_WORKERS"] = args.workers
+    if args.endpoints_paralelo:
+        CONFIG_CONCURRENCIA["MAX_ENDPOINTS_PARALELO"] = args.endpoints_paralelo
+    if args.rps:
+        CONFIG_CONCURRENCIA["REQUESTS_POR_SEGUNDO"] = args.rps
+        CONFIG_CONCURRENCIA["RAFAGA"] = max(1, int(args.rps))
+        CONFIG_CONCURRENCIA["TASA_MAXIMA"] = max(args.rps, CONFIG_CONCURRENCIA["TASA_MAXIMA"])
+    if args.sin_metricas:
+        CONFIG_METRICAS["HABILITADO"] = False
+    endpoints = {nombre: ENDPOINTS_FUNCIONALES[nombre] for nombre in args.endpoints or ENDPOINTS_FUNCIONALES}
+    if comando == "diagnose":
+        return diagnosticar(endpoints, args.offline)
+    metricas = reiniciar_metricas()
+    _CANCELACION.clear()
+    _CATALOGOS_SIN_CAMBIOS.clear()
+    diario = iniciar_diario(args.resume)
+    # Al reanudar se conserva el timestamp: las salidas reemplazan a las de la corrida cortada
+    timestamp = diario.timestamp if diario else datetime.now().strftime("%Y%m%d_%H%M%S")
+    prefijo_metricas = os.path.join(CONFIG_METRICAS["DIRECTORIO"], f"xubio_metricas_{timestamp}")
+    resultado = {"timestamp": timestamp, "estado": "error", "conteos": {}, "archivos": [],
+                 "pendientes": 0, "sin_cambios": [], "error": None}
+    # En streaming el perfil abarca descarga, cierre del escritor y guardado del Excel
+    perfil = ExitStack()
+    
+    try:
+        emitir("🚀 XUBIO API - DESCARGA CON DIAGNÓSTICO DE ASIENTOS")
+        emitir("=" * 60)
+        emitir("📅 MÉTODO: Chunks mensuales + diagnóstico automático")
+        fecha_desde, fecha_hasta = periodo_configurado()
+        emitir(f"🎯 PERÍODO: {fecha_desde} → {fecha_hasta}")
         
-        # Clasificar endpoints por método
-        endpoints_con_fechas = ['factura_compra', 'factura_venta', 'cobros', 'retenciones']
-        endpoints_sin_fechas = ['clientes', 'cuentas', 'categorias_cuentas', 'pagos']
-        endpoints_especiales = ['asiento_contable']  
+        if (not CLIENT_ID or not SECRET_ID) and not offline:
+            emitir("❌ Credenciales no configuradas en .env", NIVEL_ERROR)
+            resultado["error"] = "credenciales no configuradas"
+            return resultado
         
-        total_endpoints = len(ENDPOINTS_FUNCIONALES)
-        current = 0
+        emitir(f"🔧 Configuración:")
+        if comando:
+            emitir(f"   • Comando: {comando} ({COMANDOS[comando]})")
+        emitir(f"   • Desde: {fecha_desde}")
+        emitir(f"   • Hasta: {fecha_hasta}")
+        if len(endpoints) < len(ENDPOINTS_FUNCIONALES):
+            emitir(f"   • Endpoints: {', '.join(endpoints)}")
+        if offline:
+            emitir(f"   • 📦 Offline: se exporta desde {CONFIG_ARCHIVO['DIRECTORIO']}/ sin requests")
+        else:
+            emitir(f"   • Cliente: {CLIENT_ID[:15]}...")
+        if CONFIG_ALMACEN["HABILITADO"]:
+            modo_sync = "completa (--full-refresh)" if CONFIG_ALMACEN["FULL_REFRESH"] else \
+                f"incremental desde {calcular_corte_incremental().strftime('%Y-%m-%d')}"
+            emitir(f"   • Sincronización: {modo_sync}")
+        if diario and diario.reanudada:
+            emitir(f"   • ♻️ Reanudando corrida {timestamp}: {diario.unidades_completas()} unidades ya completas")
+        elif args.resume:
+            emitir(f"   • ♻️ No hay corrida sin terminar: se empieza una nueva")
         
-        MODO_COMPLETO_ASIENTOS = True  
         
-        for nombre, endpoint in ENDPOINTS_FUNCIONALES.items():
-            current += 1
-            print(f"[{current}/{total_endpoints}] 🎯 {nombre.upper()}")
-            
-            if nombre in endpoints_con_fechas:
-                
-                datos[nombre] = get_data_monthly_chunks_only(token, nombre, endpoint)
-                
-            elif nombre in endpoints_especiales:
-                
-                if MODO_COMPLETO_ASIENTOS:
-                    
-                    datos[nombre] = get_asientos_contables_con_detalle_mejorado(token, nombre, endpoint)
+        token = None
+        if not offline:
+            with metricas.medir_etapa("token"):
+                token = GestorToken()
+                if token.vigente():
+                    emitir(f"🔑 Token reutilizado desde {token.ruta_cache} "
+                           f"(vence en {token.segundos_restantes() / 60:.0f} min)")
                 else:
-                    
-                    datos[nombre] = get_asientos_contables_debug_solo(token, nombre, endpoint)
-                    
-            else:
-                
-                datos[nombre] = get_data_simple_for_catalogs(token, nombre, endpoint)
-            
-            
-            time.sleep(1)
+                    emitir("🔑 Generando token de acceso...")
+                    token.obtener()
+            emitir("✅ Token obtenido\n")
+        
+        emitir("📥 DESCARGA CON MÉTODOS OPTIMIZADOS:")
+        emitir("=" * 45)
+        
+        MODO_COMPLETO_ASIENTOS = not args.solo_estructura
+        
+        formatos = CONFIG_EXPORTACION["FORMATOS"]
+        excel_filename = f"xubio_diagnostico_{timestamp}.xlsx"
+        reporte_filename = f"reporte_diagnostico_{timestamp}.txt"
+        directorio = f"xubio_diagnostico_{timestamp}"
+        # El pipeline escribe mientras descarga; el Excel clásico necesita todo en memoria
+        en_streaming = CONFIG_PIPELINE["HABILITADO"] and (CONFIG_EXPORTACION["EXCEL_STREAMING"]
+                                                          or "excel" not in formatos)
+        
+        inicio_descarga = time.monotonic()
+        if en_streaming:
+            escritor = EscritorSalidas(excel_filename if "excel" in formatos else None, formatos, directorio)
+            perfil.enter_context(perfilar(f"{prefijo_metricas}_perfil"))
+            with metricas.medir_etapa("descarga"):
+                estadisticas = ejecutar_pipeline(token, endpoints, escritor, MODO_COMPLETO_ASIENTOS)
+            datos = None
+            conteos = {nombre: stats.registros for nombre, stats in estadisticas.items()}
+            emitir(f"\n⏱️ Descarga y escritura: {time.monotonic() - inicio_descarga:.1f}s\n")
+        else:
+            with metricas.medir_etapa("descarga"):
+                datos = orquestar_endpoints(token, endpoints, MODO_COMPLETO_ASIENTOS)
+            conteos = {nombre: len(data) if data else 0 for nombre, data in datos.items()}
+            emitir(f"\n⏱️ Descarga total: {time.monotonic() - inicio_descarga:.1f}s\n")
         
         
-        print("=" * 60)
-        print("📊 RESUMEN FINAL")
-        print("=" * 60)
+        emitir("=" * 60)
+        emitir("📊 RESUMEN FINAL")
+        emitir("=" * 60)
         
         total_registros = 0
         endpoints_exitosos = 0
         
-        for nombre, data in datos.items():
-            count = len(data) if data else 0
+        for nombre, count in conteos.items():
             total_registros += count
             if count > 0:
                 endpoints_exitosos += 1
@@ -609,41 +4449,123 @@ def main():
             status = "✅" if count > 0 else "❌"
             
             
-            if nombre in endpoints_especiales:
+            if nombre in ENDPOINTS_ESPECIALES:
                 metodo = "(diagnóstico automático)" if MODO_COMPLETO_ASIENTOS else "(debug estructura)"
-            elif nombre in endpoints_con_fechas:
+            elif nombre in ENDPOINTS_CON_FECHAS:
                 metodo = "(chunks mensuales)"
+            elif nombre in _CATALOGOS_SIN_CAMBIOS:
+                metodo = f"(catálogo sin cambios, {_CATALOGOS_SIN_CAMBIOS[nombre]})"
             else:
                 metodo = "(catálogo simple)"
                 
-            print(f"{status} {nombre:<20}: {count:>6,} registros {metodo}")
+            emitir(f"{status} {nombre:<20}: {count:>6,} registros {metodo}")
         
-        print(f"\n🎯 Endpoints exitosos: {endpoints_exitosos}/{len(datos)}")
-        print(f"📈 Total registros: {total_registros:,}")
+        resultado["conteos"] = conteos
+        resultado["sin_cambios"] = sorted(_CATALOGOS_SIN_CAMBIOS)
+        emitir(f"\n🎯 Endpoints exitosos: {endpoints_exitosos}/{len(conteos)}")
+        emitir(f"📈 Total registros: {total_registros:,}")
+        if _CATALOGOS_SIN_CAMBIOS:
+            emitir(f"⏭️ Catálogos sin cambios desde la corrida anterior: {', '.join(sorted(_CATALOGOS_SIN_CAMBIOS))}")
         
-        if total_registros > 0:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            excel_filename = f"xubio_diagnostico_{timestamp}.xlsx"
-            reporte_filename = f"reporte_diagnostico_{timestamp}.txt"
-            
-            print(f"\n💾 EXPORTANDO...")
-            exportar_a_excel_simple(datos, excel_filename)
-            generar_reporte_mensual(datos, reporte_filename)
+        if total_registros > 0 and comando == "fetch":
+            resultado["estado"] = "ok"
+            archivo = obtener_archivo()
+            emitir(f"\n🎉 ¡DESCARGA COMPLETA!")
+            if archivo:
+                emitir(f"📦 Archivo crudo: {archivo.directorio}/ (salidas con: python main.py export)")
+        elif total_registros > 0:
+            emitir(f"\n💾 EXPORTANDO...")
+            if en_streaming:
+                with perfil, metricas.medir_etapa("exportacion"):
+                    escritor.cerrar()
+                    with metricas.medir_etapa("reporte"):
+                        generar_reporte_mensual(None, reporte_filename, estadisticas)
+            else:
+                with perfilar(f"{prefijo_metricas}_perfil"), metricas.medir_etapa("exportacion"):
+                    with metricas.medir_etapa("estadisticas"):
+                        estadisticas = calcular_estadisticas(datos)
+                    with metricas.medir_etapa("esquemas"):
+                        esquemas = compilar_esquemas(datos) if CONFIG_ESQUEMA["HABILITADO"] else None
+                    analitica = nueva_analitica() if formatos else None
+                    analisis = []
+                    if analitica:
+                        with metricas.medir_etapa("analitica"):
+                            for nombre, data in datos.items():
+                                if data:
+                                    analitica.agregar(nombre, tablas_endpoint(nombre, data, None, esquemas))
+                            analisis = analitica.hojas()
+                    if "excel" in formatos:
+                        with metricas.medir_etapa("exportar.excel"):
+                            if CONFIG_EXPORTACION["EXCEL_STREAMING"]:
+                                exportar_a_excel_streaming(datos, excel_filename, estadisticas, esquemas, analisis)
+                            else:
+                                exportar_a_excel_simple(datos, excel_filename, estadisticas, esquemas, analisis)
+                    for formato in formatos:
+                        if formato in EXPORTADORES_COLUMNARES:
+                            with metricas.medir_etapa(f"exportar.{formato}"):
+                                exportar_columnar(datos, formato, directorio, esquemas)
+                                exportar_analitica(analisis, formato, directorio)
+                    with metricas.medir_etapa("reporte"):
+                        generar_reporte_mensual(datos, reporte_filename, estadisticas)
             
-            print(f"\n🎉 ¡COMPLETADO!")
-            print(f"📊 Excel: {excel_filename}")
-            print(f"📄 Reporte: {reporte_filename}")
-            print(f"⚡ Método: Chunks mensuales + diagnóstico automático")
-            print(f"⏱️ Período: Enero 2024 → {fecha_hasta}")
-            print(f"🔍 Asientos contables: {'Diagnóstico completo' if MODO_COMPLETO_ASIENTOS else 'Solo estructura'}")
+            resultado["estado"] = "ok"
+            resultado["archivos"] = ([excel_filename] if "excel" in formatos else []) + [reporte_filename]
+            if any(formato in EXPORTADORES_COLUMNARES for formato in formatos):
+                resultado["archivos"].append(f"{directorio}/")
+            emitir(f"\n🎉 ¡COMPLETADO!")
+            if "excel" in formatos:
+                emitir(f"📊 Excel: {excel_filename}")
+            if any(formato in EXPORTADORES_COLUMNARES for formato in formatos):
+                emitir(f"🗂️ Columnar: {directorio}/")
+            emitir(f"📄 Reporte: {reporte_filename}")
+            emitir(f"⚡ Método: Chunks mensuales + diagnóstico automático")
+            emitir(f"⏱️ Período: {fecha_desde} → {fecha_hasta}")
+            emitir(f"🔍 Asientos contables: {'Diagnóstico completo' if MODO_COMPLETO_ASIENTOS else 'Solo estructura'}")
             
         else:
-            print(f"\n⚠️ No se obtuvieron datos")
+            resultado["estado"] = "sin_datos"
+            emitir(f"\n⚠️ No se obtuvieron datos")
+        
+        if diario:
+            resultado["pendientes"] = len(diario.fallos)
+            if diario.fallos:
+                emitir(f"\n📓 {len(diario.fallos)} unidades sin completar "
+                       f"({', '.join(sorted({endpoint for endpoint, _, _ in diario.fallos}))}): "
+                       f"reintentar con --resume", NIVEL_ERROR)
+            else:
+                diario.completar()
             
+    except KeyboardInterrupt:
+        _CANCELACION.set()
+        resultado["estado"] = "interrumpida"
+        if diario:
+            emitir(f"\n⛔ Interrumpido: lo ya descargado quedó en {diario.ruta}, "
+                   f"continuar con --resume", NIVEL_ERROR)
+        else:
+            emitir(f"\n⛔ Interrumpido", NIVEL_ERROR)
     except Exception as e:
-        print(f"\n❌ ERROR: {e}")
+        resultado["estado"] = "error"
+        resultado["error"] = str(e)
+        emitir(f"\n❌ ERROR: {e}", NIVEL_ERROR)
         import traceback
         traceback.print_exc()
+        if diario:
+            emitir(f"📓 Lo ya descargado quedó en el diario: reintentar con --resume", NIVEL_ERROR)
+    finally:
+        perfil.close()
+        if diario:
+            diario.cerrar()
+        resumen = metricas.resumen()
+        if CONFIG_METRICAS["HABILITADO"] and metricas.eventos:
+            try:
+                resumen = metricas.guardar(prefijo_metricas)
+                emitir(f"📏 Métricas: {prefijo_metricas}.ndjson / .json")
+            except OSError as e:
+                emitir(f"⚠️ No se pudieron guardar las métricas: {e}", NIVEL_ERROR)
+        mostrar_resumen_metricas(resumen)
+    return resultado
 
 if __name__ == "__main__":
+    # Necesario para el modo lote en el ejecutable (los procesos se crean con spawn)
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
@@ -0,0 +1,51 @@
+"""Fixtures compartidas: main.py aislado por test y el servidor Xubio falso"""
+import copy
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "benchmarks"))
+
+import main  # noqa: E402
+import servidor_xubio_falso  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def estado_aislado(tmp_path, monkeypatch):
+    """Cada test corre en su directorio, con la configuración y los compartidos de main restaurados"""
+    monkeypatch.chdir(tmp_path)
+    configuraciones = {nombre: copy.deepcopy(valor) for nombre, valor in vars(main).items()
+                       if nombre.startswith("CONFIG_") and isinstance(valor, dict)}
+    main.reiniciar_estado_proceso(str(tmp_path))
+    main.CONFIG_METRICAS["VERBOSIDAD"] = main.NIVEL_ERROR
+    main.CONFIG_METRICAS["HABILITADO"] = False
+    yield tmp_path
+    main.reiniciar_estado_proceso(str(tmp_path))
+    for nombre, valor in configuraciones.items():
+        getattr(main, nombre).clear()
+        getattr(main, nombre).update(valor)
+
+
+@pytest.fixture
+def servidor_falso(monkeypatch):
+    """Fábrica: levanta un servidor falso con la configuración dada y apunta main a él"""
+    servidores = []
+
+    def iniciar(**config):
+        servidor, estado, url = servidor_xubio_falso.iniciar_servidor(
+            {"latencia_ms": 0, "jitter_ms": 0, **config})
+        servidores.append(servidor)
+        monkeypatch.setattr(main, "BASE_URL", url)
+        monkeypatch.setattr(main, "TOKEN_URL", url + "/TokenEndpoint")
+        monkeypatch.setattr(main, "CLIENT_ID", "test")
+        monkeypatch.setattr(main, "SECRET_ID", "test")
+        main.CONFIG_CONCURRENCIA.update(REQUESTS_POR_SEGUNDO=500.0, RAFAGA=500, TASA_MAXIMA=500.0)
+        return estado, url
+
+    yield iniciar
+    for servidor in servidores:
+        servidor.shutdown()
+        servidor.server_close()
@@ -0,0 +1,101 @@
+"""Archivo crudo: filtrado por fechas en modo offline y conservación del historial"""
+import os
+
+import main
+
+
+def _archivar(unidades):
+    archivo = main.obtener_archivo()
+    with archivo.escritor("factura_venta") as escritor:
+        for clave, registros in unidades:
+            escritor.registrar(clave, registros)
+    return archivo
+
+
+def test_iterar_con_rango_saltea_ventanas_y_filtra_las_que_lo_cruzan():
+    dias = [f"2025-{mes:02d}-{dia:02d}" for mes in (1, 2, 3) for dia in (1, 15, 28)]
+    archivo = _archivar([(f"ventana:2025-{mes:02d}-01..2025-{mes:02d}-{fin}",
+                          [{"transaccionid": d, "fecha": d + "T00:00:00"} for d in dias if d[5:7] == f"{mes:02d}"])
+                         for mes, fin in ((1, 31), (2, 28), (3, 31))])
+
+    assert [r["transaccionid"] for r in archivo.iterar("factura_venta")] == dias
+    assert [r["transaccionid"] for r in archivo.iterar("factura_venta", "2025-01-10", "2025-02-20")] == \
+        ["2025-01-15", "2025-01-28", "2025-02-01", "2025-02-15"]
+    assert [r["transaccionid"] for r in archivo.iterar("factura_venta", desde="2025-03-01")] == dias[6:]
+    assert archivo.cobertura("factura_venta") == ("2025-01-01", "2025-03-31")
+
+
+def test_export_offline_aplica_desde_y_hasta(servidor_falso, tmp_path):
+    servidor_falso(registros_por_mes=10)
+    comunes = ["-q", "--sin-metricas", "--endpoints", "factura_venta"]
+    main.ejecutar_corrida(main.parsear_argumentos(["fetch"] + comunes + ["--desde", "2025-01-01", "--hasta", "2025-03-31"]))
+
+    archivados = list(main.obtener_archivo().iterar("factura_venta"))
+
+    completo = main.ejecutar_corrida(main.parsear_argumentos(["export"] + comunes + ["--formato", "csv"]))
+    assert completo["conteos"]["factura_venta"] == len(archivados)
+
+    febrero = main.ejecutar_corrida(main.parsear_argumentos(
+        ["report"] + comunes + ["--desde", "2025-02-01", "--hasta", "2025-02-28"]))
+    assert 0 < febrero["conteos"]["factura_venta"] < len(archivados)
+    assert febrero["conteos"]["factura_venta"] == sum(r["fecha"].startswith("2025-02") for r in archivados)
+    reporte = next(tmp_path.glob(f"*{febrero['timestamp']}.txt")).read_text(encoding="utf-8")
+    assert "Período: 2025-02-01 → 2025-02-28" in reporte
+
+
+def test_fetch_mas_angosto_no_borra_el_historial_archivado(servidor_falso):
+    servidor_falso(registros_por_mes=10)
+    comunes = ["-q", "--sin-metricas", "--endpoints", "factura_venta"]
+    main.ejecutar_corrida(main.parsear_argumentos(["fetch"] + comunes + ["--desde", "2025-01-01", "--hasta", "2025-06-30"]))
+    completo = [r["transaccionid"] for r in main.obtener_archivo().iterar("factura_venta")]
+
+    main.ejecutar_corrida(main.parsear_argumentos(
+        ["fetch", "--full-refresh"] + comunes + ["--desde", "2025-05-01", "--hasta", "2025-06-30"]))
+    exportado = main.ejecutar_corrida(main.parsear_argumentos(["export"] + comunes + ["--formato", "csv"]))
+
+    assert [r["transaccionid"] for r in main.obtener_archivo().iterar("factura_venta")] == completo
+    assert exportado["conteos"]["factura_venta"] == len(completo)
+
+
+def test_ventana_anterior_que_cruza_el_rango_nuevo_conserva_sus_dias_no_cubiertos():
+    dias = ["2025-01-05", "2025-02-10", "2025-03-15", "2025-04-20"]
+    _archivar([("ventana:2025-01-01..2025-04-30", [{"transaccionid": d, "fecha": d} for d in dias])])
+
+    archivo = _archivar([("ventana:2025-02-01..2025-02-28", [{"transaccionid": "nuevo", "fecha": "2025-02-11"}])])
+
+    assert [u["clave"] for u in archivo.manifiesto("factura_venta")["unidades"]] == [
+        "ventana:2025-01-01..2025-01-31", "ventana:2025-02-01..2025-02-28", "ventana:2025-03-01..2025-04-30"]
+    assert [r["transaccionid"] for r in archivo.iterar("factura_venta")] == \
+        ["2025-01-05", "nuevo", "2025-03-15", "2025-04-20"]
+    assert archivo.buscar("factura_venta", "2025-04-20")["fecha"] == "2025-04-20"
+
+
+def test_unidad_descartada_por_reutilizable_no_corre_los_offsets_de_la_siguiente():
+    _archivar([("catalogo", [{"id": 1}])])
+    archivo = main.obtener_archivo()
+    with archivo.escritor("factura_venta") as escritor:
+        repetida = escritor.unidad("catalogo")
+        repetida.agregar({"id": 1})
+        repetida.confirmar(reutilizable=True)
+        escritor.registrar("extra", [{"id": 2}])
+
+    unidad = archivo.manifiesto("factura_venta")["unidades"][1]
+    segmento = archivo._ruta("factura_venta", unidad["segmento"])
+    assert unidad["offset"] + unidad["largo"] == os.path.getsize(segmento)
+    assert [r["id"] for r in archivo.iterar("factura_venta")] == [1, 2]
+
+
+def test_fetch_solo_archiva_sin_aplanar_ni_usar_spool(servidor_falso, monkeypatch):
+    servidor_falso(registros_por_mes=10)
+    creadas = []
+    original = main.TablaSpool.__init__
+    monkeypatch.setattr(main.TablaSpool, "__init__",
+                        lambda self, *a, **k: (creadas.append(a[0]), original(self, *a, **k))[-1])
+    comunes = ["-q", "--sin-metricas", "--endpoints", "factura_venta"]
+    resultado = main.ejecutar_corrida(main.parsear_argumentos(
+        ["fetch"] + comunes + ["--desde", "2025-01-01", "--hasta", "2025-03-31"]))
+
+    archivados = list(main.obtener_archivo().iterar("factura_venta"))
+    assert archivados
+    assert resultado["conteos"]["factura_venta"] == len(archivados)
+    assert creadas == []
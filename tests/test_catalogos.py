@@ -0,0 +1,46 @@
+"""Catálogos: detección de cambios por validadores y por huella"""
+import main
+
+
+def _descargar(endpoint_name="cuentas"):
+    return list(main.iterar_catalogo("token", endpoint_name, main.ENDPOINTS_FUNCIONALES[endpoint_name]))
+
+
+def test_catalogo_sin_validadores_se_archiva_en_streaming_y_reutiliza_la_unidad(servidor_falso):
+    estado, _ = servidor_falso(registros_catalogo=50)
+    primera = _descargar()
+    manifiesto = main.obtener_archivo().manifiesto("cuentas")
+
+    segunda = _descargar()
+
+    assert segunda == primera and len(primera) == 50
+    assert main._CATALOGOS_SIN_CAMBIOS == {"cuentas": "huella"}
+    assert main.obtener_archivo().manifiesto("cuentas")["unidades"] == manifiesto["unidades"]
+    assert list(main.obtener_archivo().iterar("cuentas")) == primera
+    # Sin ETag/Last-Modified no hay 304 posible: el almacén guarda solo la huella
+    assert main.obtener_almacen().obtener_registros_catalogo("cuentas") is None
+    assert estado.resumen()["respuestas_304"] == 0
+
+
+def test_catalogo_con_etag_se_sirve_desde_el_almacen_ante_304(servidor_falso):
+    estado, _ = servidor_falso(registros_catalogo=50, etag_catalogos=True)
+    primera = _descargar()
+
+    segunda = _descargar()
+
+    assert segunda == primera
+    assert main._CATALOGOS_SIN_CAMBIOS == {"cuentas": "304"}
+    assert estado.resumen()["respuestas_304"] == 1
+    assert list(main.obtener_archivo().iterar("cuentas")) == primera
+
+
+def test_catalogo_que_cambia_reescribe_la_unidad(servidor_falso):
+    estado, _ = servidor_falso(registros_catalogo=50)
+    _descargar()
+    estado.config["registros_catalogo"] = 60
+
+    segunda = _descargar()
+
+    assert len(segunda) == 60
+    assert main._CATALOGOS_SIN_CAMBIOS == {}
+    assert list(main.obtener_archivo().iterar("cuentas")) == segunda
@@ -0,0 +1,64 @@
+"""AnaliticaCorrida.conciliar: comprobantes contra las líneas de cobro que los cancelan"""
+import pytest
+
+import main
+
+pd = pytest.importorskip("pandas")
+
+
+def _factura(id_, total, fecha="2025-01-10"):
+    return {"transaccionid": id_, "numeroDocumento": f"A-{id_}", "fecha": fecha, "fechaVto": "2025-02-10",
+            "cliente": {"ID": 1, "nombre": "Cliente 1"}, "importetotal": total}
+
+
+def _cobro(id_, fecha, lineas):
+    return {"transaccionid": id_, "fecha": fecha, "cliente": {"ID": 1, "nombre": "Cliente 1"},
+            "importeTotal": sum(importe for _, importe in lineas),
+            "detalleCobranzas": [{"comprobante": {"ID": ref}, "importe": importe} for ref, importe in lineas]}
+
+
+def _analitica(facturas, cobros):
+    analitica = main.AnaliticaCorrida()
+    for nombre, registros in (("factura_venta", facturas), ("cobros", cobros)):
+        procesador = main.ProcesadorEndpoint(nombre)
+        for registro in registros:
+            procesador.agregar(registro)
+        procesador.cerrar()
+        analitica.agregar(nombre, [(tabla.nombre, tabla.filas()) for tabla in procesador.tablas])
+    return analitica
+
+
+def test_join_externo_con_estados_pendiente_y_lineas():
+    facturas = [_factura(1, 100.0), _factura(2, 100.0), _factura(3, 50.0), _factura(4, 10.0), _factura(5, 20.0)]
+    cobros = [
+        _cobro(101, "2025-01-15", [(1, 100.0), (2, 30.0)]),
+        _cobro(102, "2025-01-20", [(2, 10.0), (4, 15.0), (99, 7.0)]),
+        _cobro(103, "2025-01-25", [(5, 19.995)]),
+    ]
+
+    tabla = _analitica(facturas, cobros).conciliar("Conciliación Ventas").set_index("Comprobante")
+
+    assert tabla["Estado"].to_dict() == {"1": "Cancelada", "2": "Parcial", "3": "Sin aplicar", "4": "Excedida",
+                                         "5": "Cancelada", "99": "Sin comprobante"}
+    assert tabla.loc["2", ["Aplicado", "Pendiente", "Líneas"]].tolist() == [40.0, 60.0, 2]
+    assert tabla.loc["2", "Última aplicación"] == "2025-01-20"
+    assert tabla.loc["3", ["Aplicado", "Pendiente", "Líneas"]].tolist() == [0.0, 50.0, 0]
+    assert tabla.loc["4", "Pendiente"] == pytest.approx(-5.0)
+    assert pd.isna(tabla.loc["99", "Total"]) and tabla.loc["99", "Aplicado"] == 7.0
+    assert tabla.loc["1", ["Número", "Fecha", "Vencimiento", "Cliente", "Nombre"]].tolist() == \
+        ["A-1", "2025-01-10", "2025-02-10", "1", "Cliente 1"]
+    # Primero lo que requiere atención: Parcial, Sin aplicar, Excedida, Sin comprobante, Cancelada
+    assert tabla["Estado"].tolist() == ["Parcial", "Sin aplicar", "Excedida", "Sin comprobante",
+                                        "Cancelada", "Cancelada"]
+
+
+def test_comprobante_repetido_cuenta_una_vez():
+    tabla = _analitica([_factura(1, 100.0), _factura(1, 100.0)],
+                       [_cobro(101, "2025-01-15", [(1, 60.0)])]).conciliar("Conciliación Ventas")
+
+    assert len(tabla) == 1
+    assert tabla.loc[0, ["Aplicado", "Pendiente", "Estado"]].tolist() == [60.0, 40.0, "Parcial"]
+
+
+def test_sin_cobros_no_hay_conciliacion():
+    assert _analitica([_factura(1, 100.0)], []).conciliar("Conciliación Ventas") is None
@@ -0,0 +1,78 @@
+"""IndiceClaves y deduplicar_registros: una entrada por clave, la más completa"""
+import main
+
+
+def test_clave_nueva_duplicado_y_reemplazo_por_version_mas_completa():
+    indice = main.IndiceClaves("id")
+    cabecera = {"id": 7, "fecha": "2025-01-01"}
+    detalle = {"id": 7, "fecha": "2025-01-01", "items": [{"cuenta": 1}, {"cuenta": 2}]}
+
+    assert indice.registrar(cabecera, 0) is None
+    assert indice.registrar(dict(cabecera), 1) == (0, False)
+    assert indice.registrar(detalle, 2) == (0, True)
+    # Sin en_lugar el reemplazo pasa a ocupar la posición nueva
+    assert indice.registrar(cabecera, 3) == (2, False)
+    assert (indice.duplicados, indice.reemplazados) == (2, 1)
+
+
+def test_reemplazo_en_lugar_conserva_la_posicion_original():
+    indice = main.IndiceClaves("id")
+    indice.registrar({"id": "a"}, 5, en_lugar=True)
+    assert indice.registrar({"id": "a", "x": 1}, 9, en_lugar=True) == (5, True)
+    assert indice.registrar({"id": "a"}, 10, en_lugar=True) == (5, False)
+
+
+def test_claves_faltantes_o_vacias_no_se_indexan_y_se_comparan_como_texto():
+    indice = main.IndiceClaves("id")
+    assert indice.registrar({"otro": 1}, 0) is None
+    assert indice.registrar({"id": ""}, 1) is None
+    assert indice.registrar({"id": None}, 2) is None
+    assert indice.registrar({"id": 1}, 3) is None
+    assert indice.registrar({"id": "1"}, 4) == (3, False)
+
+
+def test_posicion_y_completitud_empaquetadas_sin_pisarse():
+    indice = main.IndiceClaves("id")
+    posicion = 3_000_000_000
+    enorme = {"id": 1, "items": list(range(70_000))}    # completitud por encima de 16 bits
+    assert main.completitud_registro(enorme) > 0xFFFF
+
+    assert indice.registrar(enorme, posicion) is None
+    # La completitud quedó topeada en 0xFFFF y la posición intacta en los bits altos
+    assert indice.registrar({"id": 1, "items": list(range(80_000))}, 0) == (posicion, False)
+    assert indice._posiciones[indice._hash(1)] == posicion << 16 | 0xFFFF
+
+
+def test_claves_distintas_con_el_mismo_hash_no_se_descartan(monkeypatch):
+    monkeypatch.setattr(main.IndiceClaves, "_hash", staticmethod(lambda valor: 42))
+    indice = main.IndiceClaves("id")
+
+    assert indice.registrar({"id": 1}, 0) is None
+    assert indice.registrar({"id": 2}, 1) is None
+    assert indice.registrar({"id": 3}, 2) is None
+    # Cada clave sigue deduplicando contra sí misma
+    assert indice.registrar({"id": 2}, 3) == (1, False)
+    assert indice.registrar({"id": 3, "x": 1}, 4) == (2, True)
+    assert indice.registrar({"id": 1}, 5) == (0, False)
+    assert (indice.duplicados, indice.reemplazados) == (2, 1)
+
+    main.CONFIG_DEDUP["CLAVES_POR_ENDPOINT"]["factura_venta"] = "transaccionid"
+    registros = [{"transaccionid": n} for n in (1, 2, 1, 3)]
+    assert main.deduplicar_registros("factura_venta", registros) == registros[:2] + registros[3:]
+
+
+def test_deduplicar_registros_mantiene_orden_y_reemplaza_en_lugar():
+    registros = [{"transaccionid": 1, "a": 1}, {"transaccionid": 2}, "no es dict",
+                 {"transaccionid": 1, "a": 1, "b": 2}, {"transaccionid": 2}, {"transaccionid": 3}]
+
+    # Con tan pocos registros la muestra no alcanza UNICIDAD_MINIMA: la clave se fuerza
+    main.CONFIG_DEDUP["CLAVES_POR_ENDPOINT"]["factura_venta"] = "transaccionid"
+    resultado = main.deduplicar_registros("factura_venta", registros)
+
+    assert resultado == [{"transaccionid": 1, "a": 1, "b": 2}, {"transaccionid": 2}, "no es dict",
+                         {"transaccionid": 3}]
+
+
+def test_deduplicar_registros_sin_clave_confiable_no_toca_nada():
+    registros = [{"nombre": "x"}, {"nombre": "x"}]
+    assert main.deduplicar_registros("clientes", registros) == registros
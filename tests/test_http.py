@@ -0,0 +1,30 @@
+"""solicitar_http y GestorToken contra el servidor falso"""
+import time
+
+import main
+
+
+def test_401_en_el_ultimo_intento_renueva_el_token_sin_consumir_reintentos(servidor_falso):
+    estado, url = servidor_falso(validar_tokens=True)
+    main.CONFIG_REINTENTOS["MAX_REINTENTOS"] = 0
+    token = main.GestorToken(cache_en_disco=False)
+    token._token, token._vida, token._vence = "token-revocado", 3600.0, time.time() + 3600
+
+    response = main.solicitar_http("GET", f"{url}/cuenta", "catalogo", token=token)
+
+    assert response.status_code == 200
+    assert token.renovaciones == 1
+    assert estado.resumen()["respuestas_401"] == 1
+
+
+def test_token_de_vida_corta_se_reutiliza_hasta_la_mitad_de_su_vida(servidor_falso):
+    estado, url = servidor_falso(validar_tokens=True, expires_in=30)
+    token = main.GestorToken(cache_en_disco=False)
+
+    for _ in range(7):
+        assert main.solicitar_http("GET", f"{url}/cuenta", "catalogo", token=token).status_code == 200
+
+    assert estado.resumen()["tokens_emitidos"] == 1
+    assert token.vigente()
+    token._vence = time.time() + 14   # menos de la mitad de la vida: se renueva
+    assert not token.vigente()
@@ -0,0 +1,78 @@
+"""iterar_json_array: parser incremental de arrays JSON por bloques"""
+import json
+
+import pytest
+
+import main
+
+CARGA = [
+    {"id": 1, "nombre": "Ñandú \"SA\"", "nota": "corchete ] y coma , en texto\\", "importe": 1.5e3},
+    {"id": 2, "items": [[1, 2], {"a": None}], "vacio": {}, "unicode": "€ – 日本"},
+    -12.75,
+    "texto suelto",
+    True,
+    {"id": 3, "ultimo": 1234567890},
+]
+
+
+class RespuestaFalsa:
+    """Lo que usa iterar_json_array de requests.Response: encoding, iter_content y close"""
+
+    def __init__(self, bloques, encoding="utf-8"):
+        self.bloques = bloques
+        self.encoding = encoding
+        self.cerrada = False
+
+    def iter_content(self, chunk_size=None):
+        return iter(self.bloques)
+
+    def close(self):
+        self.cerrada = True
+
+
+def _partir(datos, tam):
+    return [datos[i:i + tam] for i in range(0, len(datos), tam)]
+
+
+@pytest.mark.parametrize("tam", [1, 2, 3, 7, 64, 10_000])
+def test_elementos_iguales_a_json_loads_con_cualquier_tamano_de_bloque(tam):
+    datos = json.dumps(CARGA, ensure_ascii=False, indent=1).encode("utf-8")
+    assert list(main.iterar_json_array(RespuestaFalsa(_partir(datos, tam)))) == CARGA
+
+
+def test_cortes_en_cada_posicion_incluidos_escapes_y_multibyte():
+    datos = json.dumps(CARGA, ensure_ascii=False).encode("utf-8")
+    for corte in range(1, len(datos)):
+        bloques = [datos[:corte], datos[corte:]]
+        assert list(main.iterar_json_array(RespuestaFalsa(bloques))) == CARGA, corte
+
+
+def test_la_respuesta_se_cierra_aunque_se_corte_la_iteracion():
+    respuesta = RespuestaFalsa([json.dumps(CARGA).encode("utf-8")])
+    elementos = main.iterar_json_array(respuesta)
+    assert next(elementos) == CARGA[0]
+    elementos.close()
+    assert respuesta.cerrada
+
+
+def test_numero_cortado_al_final_del_bloque_no_se_acepta_a_medias():
+    bloques = [b"[1.5", b"e3, 2", b"0]"]
+    assert list(main.iterar_json_array(RespuestaFalsa(bloques))) == [1500.0, 20]
+
+
+@pytest.mark.parametrize("cuerpo, esperado", [
+    (b"", []),
+    (b"  \n ", []),
+    (b"[]", []),
+    (b" [ ] ", []),
+    (b'{"id": 7}', [{"id": 7}]),
+    (b"null", []),
+])
+def test_cuerpos_que_no_son_arrays_o_estan_vacios(cuerpo, esperado):
+    assert list(main.iterar_json_array(RespuestaFalsa(_partir(cuerpo, 2)))) == esperado
+
+
+@pytest.mark.parametrize("cuerpo", [b'[{"id": 1}, {"id": 2}', b'[{"id": 1} {"id": 2}]', b'[{"id": '])
+def test_array_incompleto_o_mal_formado_lanza_json_decode_error(cuerpo):
+    with pytest.raises(json.JSONDecodeError):
+        list(main.iterar_json_array(RespuestaFalsa(_partir(cuerpo, 3))))
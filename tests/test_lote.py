@@ -0,0 +1,26 @@
+"""Modo lote: varias empresas en un mismo proceso no comparten estado"""
+import os
+
+import main
+
+ARGV = ["-q", "--sin-metricas", "--desde", "2025-01-01", "--hasta", "2025-04-30",
+        "--endpoints", "factura_venta", "--formato", "csv"]
+
+
+def test_perfiles_en_el_mismo_proceso_usan_almacenes_separados(tmp_path, servidor_falso, monkeypatch):
+    monkeypatch.setattr(main, "_PREFIJO_CONSOLA", "")
+    args = main.parsear_argumentos(ARGV)
+
+    estado_a, _ = servidor_falso(registros_por_mes=40)
+    resultado_a = main._ejecutar_perfil("empresa_a", "id_a", "secreto_a", str(tmp_path / "empresa_a"), args)
+    estado_b, _ = servidor_falso(registros_por_mes=5)
+    resultado_b = main._ejecutar_perfil("empresa_b", "id_b", "secreto_b", str(tmp_path / "empresa_b"), args)
+
+    assert resultado_a["estado"] == resultado_b["estado"] == "ok"
+    # B descarga sus propios meses: nada sale del almacén de A
+    assert resultado_b["conteos"]["factura_venta"] < resultado_a["conteos"]["factura_venta"]
+    assert estado_b.resumen()["requests"] > 1
+    for perfil in ("empresa_a", "empresa_b"):
+        assert os.path.exists(tmp_path / perfil / "xubio_cache.sqlite")
+    assert main.CONFIG_ALMACEN["RUTA"] == str(tmp_path / "empresa_b" / "xubio_cache.sqlite")
+    assert main.obtener_almacen().ruta == main.CONFIG_ALMACEN["RUTA"]
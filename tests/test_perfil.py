@@ -0,0 +1,19 @@
+"""Perfil de la corrida: en streaming abarca también el cierre del escritor"""
+import pstats
+
+import main
+
+
+def test_perfil_en_streaming_incluye_cierre_del_escritor(servidor_falso, tmp_path):
+    servidor_falso(registros_por_mes=10)
+    comunes = ["-q", "--sin-metricas", "--endpoints", "factura_venta"]
+    main.ejecutar_corrida(main.parsear_argumentos(["fetch"] + comunes + ["--desde", "2025-01-01", "--hasta", "2025-02-28"]))
+
+    resultado = main.ejecutar_corrida(main.parsear_argumentos(["export", "--perfilar"] + comunes + ["--formato", "excel"]))
+
+    assert resultado["estado"] == "ok"
+    prefijo = tmp_path / main.CONFIG_METRICAS["DIRECTORIO"] / f"xubio_metricas_{resultado['timestamp']}_perfil"
+    funciones = pstats.Stats(f"{prefijo}.prof").stats
+    cerrar = main.EscritorSalidas.cerrar.__code__
+    assert (cerrar.co_filename, cerrar.co_firstlineno, "cerrar") in funciones
+    assert any(nombre == "ejecutar_pipeline" for _, _, nombre in funciones)
@@ -0,0 +1,54 @@
+"""TablaSpool: filas volcadas a disco y reproducidas al escribir"""
+import pytest
+
+import main
+
+FILAS = [
+    (1, "texto", None, 1.5),
+    (2, "ñandú € 日本", True, -0.0),
+    (3, "x" * 5000, False, 10**15),
+    (4, "", None, None),
+]
+
+
+@pytest.mark.parametrize("bloque", [1, 7, 64, 1 << 20])
+def test_ida_y_vuelta_con_filas_que_cruzan_bloques(monkeypatch, bloque):
+    monkeypatch.setattr(main, "_BLOQUE_SPOOL", bloque)
+    tabla = main.TablaSpool("t", ["id", "nombre", "flag", "importe"])
+    for fila in FILAS * 50:
+        tabla.agregar(fila)
+
+    filas = list(tabla.filas())
+
+    assert filas[0] == ["id", "nombre", "flag", "importe"]
+    assert [tuple(f) for f in filas[1:]] == FILAS * 50
+    assert tabla.cantidad == 200
+    assert tabla.anchos == [2, 5000, 5, 16]
+    # Se puede volver a leer
+    assert len(list(tabla.filas())) == 201
+
+
+def test_columna_agregada_en_la_marcha_completa_las_filas_previas():
+    tabla = main.TablaSpool("t", ["id"])
+    tabla.agregar((1,))
+    tabla.agregar_columna("extra")
+    tabla.agregar((2, "dato"))
+
+    assert list(tabla.filas(faltante="-")) == [["id", "extra"], (1, "-"), (2, "dato")]
+
+
+def test_filas_descartadas_y_renumeracion_de_hijas():
+    descartadas = set()
+    principal = main.TablaSpool("p", ["id"], descartadas)
+    hija = main.TablaSpool("p_items", ["padre.fila", "valor"], descartadas, con_padre=True, renumerar=True)
+    for posicion, (id_, items) in enumerate([("a", ["a1"]), ("b", ["b1", "b2"]), ("c", ["c1"])]):
+        principal.agregar((id_,))
+        for item in items:
+            hija.agregar((posicion + 1, item), posicion)
+    # "b" fue reemplazada por una versión más completa que quedó al final
+    descartadas.add(1)
+    principal.agregar(("b",))
+    hija.agregar((4, "b1'"), 3)
+
+    assert [tuple(f) for f in list(principal.filas())[1:]] == [("a",), ("c",), ("b",)]
+    assert [tuple(f) for f in list(hija.filas())[1:]] == [(1, "a1"), (2, "c1"), (3, "b1'")]
@@ -0,0 +1,62 @@
+"""Descarga de ventanas: partición ante timeouts"""
+from datetime import datetime
+
+import main
+
+
+def test_timeout_de_ventana_divisible_vuelve_sin_reintentar(servidor_falso, monkeypatch):
+    estado, url = servidor_falso(prob_timeout=1.0, demora_timeout_s=0.5)
+    monkeypatch.setitem(main.TIMEOUTS_POR_ENDPOINT, "factura_venta", (1, 0.1))
+    main.CONFIG_REINTENTOS.update(MAX_REINTENTOS=2, BACKOFF_BASE=0.01)
+    endpoint = f"{url}/comprobanteVentaBean"
+
+    registros, _, codigo = main._descargar_ventana(endpoint, "token", "2025-01-01", "2025-01-31",
+                                                   "factura_venta", reintentar_timeout=False)
+    assert (registros, codigo) == ([], 504)
+    assert estado.resumen()["requests"] == 1
+
+    main._descargar_ventana(endpoint, "token", "2025-01-01", "2025-01-01", "factura_venta")
+    assert estado.resumen()["requests"] == 1 + 3
+
+
+def test_planificador_parte_ante_timeout_y_solo_reintenta_ventanas_de_un_dia():
+    main.CONFIG_VENTANAS["ADAPTATIVO"] = True
+    pedidas = []
+
+    def descargar(desde, hasta, divisible):
+        pedidas.append((desde, hasta, divisible))
+        if desde != hasta:
+            return [], "timeout", 504
+        return [{"fecha": desde}], "ok", 200
+
+    planificador = main.PlanificadorVentanas("comprobanteVentaBean")
+    registros, _, hojas = planificador.descargar(datetime(2025, 1, 1), datetime(2025, 1, 4), descargar)
+
+    assert [r["fecha"] for r in registros] == ["2025-01-01", "2025-01-02", "2025-01-03", "2025-01-04"]
+    assert all(codigo == 200 for *_, codigo in hojas)
+    assert all(divisible == (desde != hasta) for desde, hasta, divisible in pedidas)
+
+
+def test_resume_usa_el_plan_de_ventanas_guardado_en_el_diario(servidor_falso):
+    estado, _ = servidor_falso(registros_por_mes=30)
+    main.CONFIG_ALMACEN["FULL_REFRESH"] = True
+    main.CONFIG_VENTANAS.update(ADAPTATIVO=True, UMBRAL_DIVISION=20, UMBRAL_FUSION=0)
+    main.CONFIG_FECHAS.update(FECHA_DESDE="2025-01-01", FECHA_HASTA="2025-03-31")
+    endpoint = main.ENDPOINTS_FUNCIONALES["factura_venta"]
+
+    diario = main.iniciar_diario()
+    primera = list(main.iterar_ventanas("token", "factura_venta", endpoint))
+    diario.cerrar()
+    requests = estado.resumen()["requests"]
+
+    # Las ventanas partidas quedaron como historial: un plan nuevo ya no sería el de la corrida cortada
+    nuevo_plan = main.PlanificadorVentanas(endpoint, main.obtener_almacen(), main.calcular_corte_incremental())
+    assert nuevo_plan.planificar("2025-01-01", main.fecha_hasta_configurada()) != \
+        main.generar_ventanas_mensuales("2025-01-01", main.fecha_hasta_configurada())
+
+    diario = main.iniciar_diario(reanudar=True)
+    segunda = list(main.iterar_ventanas("token", "factura_venta", endpoint))
+    diario.cerrar()
+
+    assert segunda == primera
+    assert estado.resumen()["requests"] == requests